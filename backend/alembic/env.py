@@ -30,7 +30,7 @@ sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..'
 from app.db.database import Base
 # Importar TODOS los modelos para que Alembic los detecte (NUEVA UBICACIÓN)
 # Necesitarás añadir una línea por cada archivo de modelo que crees
-from app.models import user # ¡Importante importar los modelos aquí!
+from app.models import user, plaid_item, transaction, insight, export_job, categorization_job, budget, dashboard_change # ¡Importante importar los modelos aquí!
 
 # Asignar los metadatos de la Base a target_metadata para que Alembic los detecte
 target_metadata = Base.metadata
@@ -0,0 +1,50 @@
+"""Add plaid_items table for multiple linked items per user
+
+Revision ID: 3f9a1c7b2d40
+Revises: e25113fa76ee
+Create Date: 2026-10-19 09:12:41.508211
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9a1c7b2d40'
+down_revision: Union[str, None] = 'e25113fa76ee'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('plaid_items',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('item_id', sa.String(), nullable=False),
+    sa.Column('access_token_encrypted', sa.LargeBinary(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_plaid_items_id'), 'plaid_items', ['id'], unique=False)
+    op.create_index(op.f('ix_plaid_items_item_id'), 'plaid_items', ['item_id'], unique=True)
+    op.create_index(op.f('ix_plaid_items_user_id'), 'plaid_items', ['user_id'], unique=False)
+
+    # Copiar el Item único que hasta ahora vivía en 'users'
+    op.execute(
+        "INSERT INTO plaid_items (user_id, item_id, access_token_encrypted, created_at, updated_at) "
+        "SELECT id, plaid_item_id, plaid_access_token_encrypted, now(), now() FROM users "
+        "WHERE plaid_access_token_encrypted IS NOT NULL AND plaid_item_id IS NOT NULL"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_plaid_items_user_id'), table_name='plaid_items')
+    op.drop_index(op.f('ix_plaid_items_item_id'), table_name='plaid_items')
+    op.drop_index(op.f('ix_plaid_items_id'), table_name='plaid_items')
+    op.drop_table('plaid_items')
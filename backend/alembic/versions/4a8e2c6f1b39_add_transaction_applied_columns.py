@@ -0,0 +1,37 @@
+"""Add applied amount, date and currency to transactions
+
+Revision ID: 4a8e2c6f1b39
+Revises: 9d4f6b2e8a17
+Create Date: 2026-10-19 21:07:43.518206
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4a8e2c6f1b39'
+down_revision: Union[str, None] = '9d4f6b2e8a17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('transactions', sa.Column('applied_date', sa.Date(), nullable=True))
+    op.add_column('transactions', sa.Column('applied_amount', sa.Float(), nullable=True))
+    op.add_column('transactions', sa.Column('applied_currency', sa.String(length=3), nullable=True))
+    # Las ya aplicadas se sumaron con sus valores actuales (lo mejor que se conoce)
+    op.execute(
+        "UPDATE transactions SET applied_date = date, applied_amount = amount, "
+        "applied_currency = iso_currency_code WHERE stats_applied"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('transactions', 'applied_currency')
+    op.drop_column('transactions', 'applied_amount')
+    op.drop_column('transactions', 'applied_date')
@@ -0,0 +1,28 @@
+"""Add profile_version to users
+
+Revision ID: 7c3e9a5d2f61
+Revises: 4a8e2c6f1b39
+Create Date: 2026-10-19 21:48:12.604731
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c3e9a5d2f61'
+down_revision: Union[str, None] = '4a8e2c6f1b39'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('profile_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'profile_version')
@@ -0,0 +1,29 @@
+"""Add updated_at heartbeat to export_jobs
+
+Revision ID: b8d2f4a6c371
+Revises: 7c3e9a5d2f61
+Create Date: 2026-10-19 22:15:36.902417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8d2f4a6c371'
+down_revision: Union[str, None] = '7c3e9a5d2f61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('export_jobs', sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True))
+    op.execute("UPDATE export_jobs SET updated_at = created_at")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('export_jobs', 'updated_at')
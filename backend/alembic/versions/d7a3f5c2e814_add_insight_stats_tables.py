@@ -0,0 +1,85 @@
+"""Add category/merchant stats and user_insights tables
+
+Revision ID: d7a3f5c2e814
+Revises: c4d1e7a9b352
+Create Date: 2026-10-19 14:12:48.903127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7a3f5c2e814'
+down_revision: Union[str, None] = 'c4d1e7a9b352'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Las transacciones ya guardadas no se cuentan: las estadísticas empiezan con las nuevas
+    op.add_column('transactions', sa.Column('stats_applied', sa.Boolean(), nullable=False, server_default=sa.true()))
+    op.alter_column('transactions', 'stats_applied', server_default=None)
+
+    op.create_table('category_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('category', sa.String(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('mean', sa.Float(), nullable=False),
+    sa.Column('m2', sa.Float(), nullable=False),
+    sa.Column('current_month', sa.Date(), nullable=True),
+    sa.Column('current_month_total', sa.Float(), nullable=False),
+    sa.Column('months', sa.Integer(), nullable=False),
+    sa.Column('month_mean', sa.Float(), nullable=False),
+    sa.Column('month_m2', sa.Float(), nullable=False),
+    sa.Column('month_ewma_fast', sa.Float(), nullable=False),
+    sa.Column('month_ewma_slow', sa.Float(), nullable=False),
+    sa.Column('last_spike_date', sa.Date(), nullable=True),
+    sa.Column('last_spike_amount', sa.Float(), nullable=True),
+    sa.Column('last_spike_z', sa.Float(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'category')
+    )
+    op.create_table('merchant_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('merchant', sa.String(), nullable=False),
+    sa.Column('category', sa.String(), nullable=True),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('amount_mean', sa.Float(), nullable=False),
+    sa.Column('amount_m2', sa.Float(), nullable=False),
+    sa.Column('intervals', sa.Integer(), nullable=False),
+    sa.Column('interval_mean', sa.Float(), nullable=False),
+    sa.Column('interval_m2', sa.Float(), nullable=False),
+    sa.Column('first_seen', sa.Date(), nullable=False),
+    sa.Column('last_seen', sa.Date(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'merchant')
+    )
+    op.create_table('user_insights',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(), nullable=False),
+    sa.Column('category', sa.String(), nullable=True),
+    sa.Column('message', sa.String(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('relevant_until', sa.Date(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_user_insights_id'), 'user_insights', ['id'], unique=False)
+    op.create_index(op.f('ix_user_insights_user_id'), 'user_insights', ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_user_insights_user_id'), table_name='user_insights')
+    op.drop_index(op.f('ix_user_insights_id'), table_name='user_insights')
+    op.drop_table('user_insights')
+    op.drop_table('merchant_stats')
+    op.drop_table('category_stats')
+    op.drop_column('transactions', 'stats_applied')
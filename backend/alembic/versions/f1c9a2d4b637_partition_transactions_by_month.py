@@ -0,0 +1,142 @@
+"""Partition transactions by month (PostgreSQL)
+
+Revision ID: f1c9a2d4b637
+Revises: e5b8c3a1f926
+Create Date: 2026-10-19 16:48:09.671203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1c9a2d4b637'
+down_revision: Union[str, None] = 'e5b8c3a1f926'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# En PostgreSQL 'transactions' pasa a estar particionada por rango de 'date' (una partición
+# por mes: transactions_pYYYYMM) más una partición DEFAULT para fechas fuera de rango.
+# La PK incluye la clave de partición: (transaction_id, date).
+# En SQLite (desarrollo/tests) la tabla se queda como tabla única: esta migración no hace nada.
+
+COLUMNS = "transaction_id, user_id, item_id, account_id, date, name, amount, iso_currency_code, pending, stats_applied, created_at, updated_at"
+
+# Crea (si faltan) las particiones mensuales desde 'from_month' hasta 'months_ahead' meses
+# después del mes actual. Si la partición DEFAULT ya tenía filas de ese mes, las mueve.
+ENSURE_PARTITIONS_FUNCTION = """
+CREATE OR REPLACE FUNCTION transactions_ensure_partitions(from_month date, months_ahead integer)
+RETURNS integer AS $$
+DECLARE
+    month date := date_trunc('month', from_month)::date;
+    last_month date := (date_trunc('month', current_date) + make_interval(months => months_ahead))::date;
+    next_month date;
+    partition_name text;
+    created integer := 0;
+BEGIN
+    WHILE month <= last_month LOOP
+        partition_name := 'transactions_p' || to_char(month, 'YYYYMM');
+        next_month := (month + interval '1 month')::date;
+        IF to_regclass(partition_name) IS NULL THEN
+            IF EXISTS (SELECT 1 FROM transactions_default WHERE date >= month AND date < next_month) THEN
+                CREATE TEMP TABLE transactions_moving ON COMMIT DROP AS
+                    SELECT * FROM transactions_default WHERE date >= month AND date < next_month;
+                DELETE FROM transactions_default WHERE date >= month AND date < next_month;
+                EXECUTE format('CREATE TABLE %I PARTITION OF transactions FOR VALUES FROM (%L) TO (%L)',
+                               partition_name, month, next_month);
+                INSERT INTO transactions SELECT * FROM transactions_moving;
+                DROP TABLE transactions_moving;
+            ELSE
+                EXECUTE format('CREATE TABLE %I PARTITION OF transactions FOR VALUES FROM (%L) TO (%L)',
+                               partition_name, month, next_month);
+            END IF;
+            created := created + 1;
+        END IF;
+        month := next_month;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    op.execute("ALTER TABLE transactions RENAME TO transactions_legacy")
+    op.execute("ALTER TABLE transactions_legacy RENAME CONSTRAINT transactions_pkey TO transactions_legacy_pkey")
+    op.execute("ALTER INDEX ix_transactions_user_id_date RENAME TO ix_transactions_legacy_user_id_date")
+
+    op.execute("""
+        CREATE TABLE transactions (
+            transaction_id VARCHAR NOT NULL,
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            item_id VARCHAR,
+            account_id VARCHAR NOT NULL,
+            date DATE NOT NULL,
+            name VARCHAR NOT NULL,
+            amount FLOAT NOT NULL,
+            iso_currency_code VARCHAR(3),
+            pending BOOLEAN NOT NULL,
+            stats_applied BOOLEAN NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            updated_at TIMESTAMP WITH TIME ZONE,
+            PRIMARY KEY (transaction_id, date)
+        ) PARTITION BY RANGE (date)
+    """)
+    op.execute("CREATE TABLE transactions_default PARTITION OF transactions DEFAULT")
+    # Índices en la tabla padre: se crean automáticamente en cada partición (actual y futura).
+    # BRIN sobre la fecha: diminuto y suficiente para escaneos por rango (filas casi ordenadas por fecha).
+    op.execute("CREATE INDEX ix_transactions_date_brin ON transactions USING brin (date) WITH (pages_per_range = 32)")
+    op.execute("CREATE INDEX ix_transactions_user_id_date ON transactions (user_id, date)")
+
+    op.execute(ENSURE_PARTITIONS_FUNCTION)
+    # Particiones para el histórico existente (hasta 24 meses atrás) y los próximos 3 meses
+    op.execute("""
+        SELECT transactions_ensure_partitions(
+            GREATEST(
+                COALESCE((SELECT min(date) FROM transactions_legacy), current_date),
+                (current_date - interval '24 months')::date
+            ),
+            3
+        )
+    """)
+    op.execute(f"INSERT INTO transactions ({COLUMNS}) SELECT {COLUMNS} FROM transactions_legacy")
+    op.drop_table('transactions_legacy')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    op.create_table('transactions_plain',
+    sa.Column('transaction_id', sa.String(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('item_id', sa.String(), nullable=True),
+    sa.Column('account_id', sa.String(), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('iso_currency_code', sa.String(length=3), nullable=True),
+    sa.Column('pending', sa.Boolean(), nullable=False),
+    sa.Column('stats_applied', sa.Boolean(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], name='transactions_user_id_fkey', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('transaction_id', name='transactions_plain_pkey')
+    )
+    # Con particiones, un mismo transaction_id podría repetirse con otra fecha: se conserva la más reciente
+    op.execute(f"""
+        INSERT INTO transactions_plain ({COLUMNS})
+        SELECT DISTINCT ON (transaction_id) {COLUMNS} FROM transactions ORDER BY transaction_id, date DESC
+    """)
+    op.execute("DROP TABLE transactions") # Elimina también todas las particiones
+    op.execute("DROP FUNCTION IF EXISTS transactions_ensure_partitions(date, integer)")
+    op.execute("ALTER TABLE transactions_plain RENAME TO transactions")
+    op.execute("ALTER TABLE transactions RENAME CONSTRAINT transactions_plain_pkey TO transactions_pkey")
+    op.create_index('ix_transactions_user_id_date', 'transactions', ['user_id', 'date'], unique=False)
@@ -0,0 +1,489 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from pydantic import TypeAdapter
+
+from .config import settings
+from .singleflight import SingleFlight
+
+# --- Caché Compartida ---
+# Una única caché para todos los servicios, con backend configurable (CACHE_BACKEND):
+#   - "memory": LRU en memoria del proceso (cada worker de uvicorn tiene la suya).
+#   - "sqlite": archivo SQLite local en modo WAL, compartido entre los workers del mismo host.
+#   - "redis": cualquier servidor que hable el protocolo RESP (Redis, Valkey, KeyDB o un
+#     sustituto local), compartido entre hosts. Cliente mínimo incluido: sin dependencias.
+# Cada servicio usa su propio espacio de nombres (CacheNamespace) con su TTL; un espacio de
+# nombres se invalida completo de una vez. Los errores del backend nunca rompen la petición:
+# se registran y la lectura cuenta como miss.
+# Los backends compartidos (shared = True):
+#   - Hacen IO bloqueante (socket, archivo): desde código async se usan los métodos a*() del
+#     espacio de nombres, que los ejecutan en un hilo (asyncio.to_thread).
+#   - Guardan JSON, nunca pickle: un valor leído de un servidor compartido no puede ejecutar
+#     código al deserializarse. Cada espacio de nombres declara el tipo de sus valores
+#     (value_type) y se validan con Pydantic al leerlos.
+#   - Abren sus conexiones al primer uso en cada hilo y proceso (no se heredan tras el fork).
+
+_MISSING = object()
+
+
+class MemoryCacheBackend:
+    """LRU en memoria del proceso con caducidad por entrada (guarda los objetos tal cual)."""
+
+    shared = False
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock() # También se usa desde hilos (asyncio.to_thread)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, namespace: str, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is None:
+                return _MISSING
+            if entry[0] <= time.time():
+                del self._entries[(namespace, key)]
+                return _MISSING
+            self._entries.move_to_end((namespace, key))
+            return entry[1]
+
+    def set(self, namespace: str, key: str, value: Any, ttl_seconds: float) -> None:
+        with self._lock:
+            self._entries[(namespace, key)] = (time.time() + ttl_seconds, value)
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False) # Menos usada recientemente
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self._entries.pop((namespace, key), None)
+
+    def get_int(self, namespace: str, key: str) -> Optional[int]:
+        value = self.get(namespace, key)
+        return None if value is _MISSING else int(value)
+
+    def set_max(self, namespace: str, key: str, value: int, ttl_seconds: float) -> None:
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is not None and entry[0] > time.time() and entry[1] > value:
+                value = entry[1]
+            self._entries[(namespace, key)] = (time.time() + ttl_seconds, value)
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self, namespace: str) -> None:
+        with self._lock:
+            for entry_key in [entry_key for entry_key in self._entries if entry_key[0] == namespace]:
+                del self._entries[entry_key]
+
+
+class SQLiteCacheBackend:
+    """
+    Caché compartida entre los workers del mismo host en un archivo SQLite (WAL).
+    Los valores llegan ya serializados (bytes JSON); las entradas caducadas se purgan cada cierto
+    número de escrituras.
+    """
+
+    shared = True
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connect() # Falla al arrancar si el archivo no se puede abrir
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL") # Es una caché: no hace falta fsync en cada escritura
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, expires REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_expires ON cache_entries (expires)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, namespace: str, key: str) -> Any:
+        row = self._connect().execute(
+            "SELECT value FROM cache_entries WHERE namespace = ? AND key = ? AND expires > ?",
+            (namespace, key, time.time()),
+        ).fetchone()
+        return row[0] if row else _MISSING
+
+    def set(self, namespace: str, key: str, value: bytes, ttl_seconds: float) -> None:
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            "INSERT INTO cache_entries (namespace, key, value, expires) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(namespace, key) DO UPDATE SET value = excluded.value, expires = excluded.expires",
+            (namespace, key, value, now + ttl_seconds),
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM cache_entries WHERE expires <= ?", (now,))
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._connect().execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def clear(self, namespace: str) -> None:
+        self._connect().execute("DELETE FROM cache_entries WHERE namespace = ?", (namespace,))
+
+    def get_int(self, namespace: str, key: str) -> Optional[int]:
+        value = self.get(namespace, key)
+        return None if value is _MISSING else int(value)
+
+    def set_max(self, namespace: str, key: str, value: int, ttl_seconds: float) -> None:
+        """Guarda max(valor vigente, 'value') en una sola sentencia (sin lectura previa)."""
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO cache_entries (namespace, key, value, expires) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(namespace, key) DO UPDATE SET "
+            "value = CASE WHEN cache_entries.expires > ? AND cache_entries.value > excluded.value "
+            "THEN cache_entries.value ELSE excluded.value END, expires = excluded.expires",
+            (namespace, key, int(value), now + ttl_seconds, now),
+        )
+
+
+class RespError(Exception):
+    """Respuesta de error (-ERR ...) del servidor RESP."""
+
+
+class RedisCacheBackend:
+    """
+    Caché compartida en un servidor que hable RESP (redis://[user:password@]host:port/db).
+    Una conexión por hilo; las claves son '<prefijo><namespace>:<key>' con caducidad nativa (SET PX).
+    """
+
+    shared = True
+    # Máximo atómico en el servidor: conserva el valor vigente si es mayor (y renueva su TTL)
+    SET_MAX_SCRIPT = (
+        "local current = tonumber(redis.call('GET', KEYS[1])) "
+        "if current == nil or tonumber(ARGV[1]) > current then "
+        "redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2]) "
+        "else redis.call('PEXPIRE', KEYS[1], ARGV[2]) end "
+        "return 1"
+    )
+
+    def __init__(self, url: str, prefix: str = "nexusmc:", timeout: float = 0.5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.username = parsed.username
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+        self._command("PING") # Falla al arrancar si el servidor no responde
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid != os.getpid():
+            conn = None # Socket heredado del proceso maestro (--preload): no se comparte entre procesos
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = (sock, sock.makefile("rb"))
+            if self.password:
+                self._send(conn, ("AUTH", self.username, self.password) if self.username else ("AUTH", self.password))
+            if self.db:
+                self._send(conn, ("SELECT", self.db))
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None and self._local.pid == os.getpid():
+            conn[1].close()
+            conn[0].close()
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read_reply(self, reader) -> Any:
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Conexión cerrada por el servidor RESP")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            raise RespError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply(reader) for _ in range(length)]
+        raise ConnectionError(f"Respuesta RESP no reconocida: {line[:20]!r}")
+
+    def _send(self, conn, args) -> Any:
+        conn[0].sendall(self._encode(args))
+        return self._read_reply(conn[1])
+
+    def _command(self, *args) -> Any:
+        try:
+            return self._send(self._connect(), args)
+        except (OSError, ConnectionError):
+            # Conexión caída (reinicio del servidor, timeout): un reintento con conexión nueva
+            self._close()
+            return self._send(self._connect(), args)
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}{namespace}:{key}"
+
+    def get(self, namespace: str, key: str) -> Any:
+        data = self._command("GET", self._key(namespace, key))
+        return data if data is not None else _MISSING
+
+    def set(self, namespace: str, key: str, value: bytes, ttl_seconds: float) -> None:
+        self._command("SET", self._key(namespace, key), value, "PX", max(1, int(ttl_seconds * 1000)))
+
+    def get_int(self, namespace: str, key: str) -> Optional[int]:
+        value = self.get(namespace, key)
+        return None if value is _MISSING else int(value)
+
+    def set_max(self, namespace: str, key: str, value: int, ttl_seconds: float) -> None:
+        self._command("EVAL", self.SET_MAX_SCRIPT, 1, self._key(namespace, key), int(value), max(1, int(ttl_seconds * 1000)))
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._command("DEL", self._key(namespace, key))
+
+    def clear(self, namespace: str) -> None:
+        # SCAN incremental (no bloquea el servidor como KEYS) y borrado por lotes
+        cursor = b"0"
+        pattern = f"{self.prefix}{namespace}:*"
+        while True:
+            cursor, keys = self._command("SCAN", cursor, "MATCH", pattern, "COUNT", 500)
+            if keys:
+                self._command("DEL", *keys)
+            if cursor in (b"0", 0, "0"):
+                break
+
+
+class CacheNamespace:
+    """
+    Espacio de nombres de la caché compartida para un servicio, con su TTL.
+
+    Con stale_seconds > 0 las entradas se conservan ese tiempo extra después de caducar,
+    para que el servicio pueda servirlas de forma explícita (get_stale) si su origen está saturado.
+    value_type es el tipo de los valores: en los backends compartidos se guardan como JSON y se
+    validan con ese tipo al leerlos (Any = JSON tal cual).
+    Los métodos get/set/... son síncronos (para código que ya corre en un hilo); desde el event
+    loop se usan aget/aset/..., que con un backend compartido hacen el IO en un hilo.
+    """
+
+    def __init__(self, cache: "Cache", name: str, ttl_seconds: float, stale_seconds: float = 0.0, value_type: Any = Any):
+        self.cache = cache
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._adapter = TypeAdapter(value_type)
+        self._flight = SingleFlight(name, namespace=self)
+        # Contadores por proceso
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @property
+    def _shared(self) -> bool:
+        return getattr(self.cache.backend, "shared", False)
+
+    def _encode(self, fresh_until: float, value: Any) -> Any:
+        if not self._shared:
+            return (fresh_until, value)
+        return json.dumps([fresh_until, self._adapter.dump_python(value, mode="json")], separators=(",", ":")).encode("utf-8")
+
+    def _decode(self, data: Any) -> Tuple[float, Any]:
+        if not self._shared:
+            return data
+        fresh_until, value = json.loads(data)
+        return fresh_until, self._adapter.validate_python(value)
+
+    async def _run(self, func: Callable, *args) -> Any:
+        if self._shared:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    def _read(self, key: str) -> Any:
+        try:
+            data = self.cache.backend.get(self.name, key)
+            return data if data is _MISSING else self._decode(data)
+        except Exception as e:
+            self.errors += 1
+            print(f"ERROR: Falla leyendo la caché '{self.name}' ({e!r}). Se trata como miss.")
+            return _MISSING
+
+    def _lookup(self, key: str, allow_stale: bool) -> Any:
+        entry = self._read(key)
+        if entry is _MISSING:
+            return _MISSING
+        fresh_until, value = entry
+        if allow_stale or fresh_until > time.time():
+            return value
+        return _MISSING
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Valor vigente de 'key', o 'default' si no está o ha caducado."""
+        value = self._lookup(key, allow_stale=False)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def get_stale(self, key: str, default: Any = None) -> Any:
+        """Valor de 'key' aunque haya caducado (dentro de stale_seconds). No cuenta en las estadísticas."""
+        value = self._lookup(key, allow_stale=True)
+        return default if value is _MISSING else value
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        try:
+            self.cache.backend.set(self.name, key, self._encode(time.time() + ttl, value), ttl + self.stale_seconds)
+        except Exception as e:
+            self.errors += 1
+            print(f"ERROR: Falla escribiendo en la caché '{self.name}' ({e!r}).")
+
+    def delete(self, key: str) -> None:
+        try:
+            self.cache.backend.delete(self.name, key)
+        except Exception as e:
+            self.errors += 1
+            print(f"ERROR: Falla invalidando '{key}' en la caché '{self.name}' ({e!r}).")
+
+    def invalidate(self) -> None:
+        """Invalida todas las entradas del espacio de nombres."""
+        try:
+            self.cache.backend.clear(self.name)
+        except Exception as e:
+            self.errors += 1
+            print(f"ERROR: Falla invalidando la caché '{self.name}' ({e!r}).")
+
+    def get_int(self, key: str) -> Optional[int]:
+        """Contador entero de 'key' (escrito con set_max), o None si no está o no se pudo leer."""
+        try:
+            return self.cache.backend.get_int(self.name, key)
+        except Exception as e:
+            self.errors += 1
+            print(f"ERROR: Falla leyendo la caché '{self.name}' ({e!r}). Se trata como miss.")
+            return None
+
+    def set_max(self, key: str, value: int) -> None:
+        """Guarda max(valor actual, 'value') de forma atómica en el backend."""
+        try:
+            self.cache.backend.set_max(self.name, key, value, self.ttl_seconds)
+        except Exception as e:
+            self.errors += 1
+            print(f"ERROR: Falla escribiendo en la caché '{self.name}' ({e!r}).")
+
+    async def aget(self, key: str, default: Any = None) -> Any:
+        return await self._run(self.get, key, default)
+
+    async def aget_stale(self, key: str, default: Any = None) -> Any:
+        return await self._run(self.get_stale, key, default)
+
+    async def aset(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        await self._run(self.set, key, value, ttl_seconds)
+
+    async def adelete(self, key: str) -> None:
+        await self._run(self.delete, key)
+
+    async def ainvalidate(self) -> None:
+        await self._run(self.invalidate)
+
+    async def aget_int(self, key: str) -> Optional[int]:
+        return await self._run(self.get_int, key)
+
+    async def aset_max(self, key: str, value: int) -> None:
+        await self._run(self.set_max, key, value)
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Devuelve el valor cacheado o lo calcula con 'loader' y lo guarda.
+        Los misses concurrentes de la misma clave en este proceso se colapsan en una única carga.
+        """
+        return await self._flight.do(key, loader)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+class Cache:
+    """Caché compartida: un backend y los espacios de nombres registrados por los servicios."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._namespaces: Dict[str, CacheNamespace] = {}
+
+    @property
+    def backend_name(self) -> str:
+        return type(self.backend).__name__
+
+    def namespace(self, name: str, ttl_seconds: float, stale_seconds: float = 0.0, value_type: Any = Any) -> CacheNamespace:
+        if name in self._namespaces:
+            return self._namespaces[name]
+        namespace = CacheNamespace(self, name, ttl_seconds, stale_seconds, value_type)
+        self._namespaces[name] = namespace
+        return namespace
+
+    def namespaces(self) -> List[str]:
+        return sorted(self._namespaces)
+
+    def stats(self) -> Dict[str, Any]:
+        """Aciertos/fallos por espacio de nombres (de este proceso)."""
+        return {
+            "backend": self.backend_name,
+            "namespaces": {name: namespace.stats() for name, namespace in sorted(self._namespaces.items())},
+        }
+
+
+def _build_backend():
+    if settings.CACHE_BACKEND == "sqlite":
+        try:
+            return SQLiteCacheBackend(settings.CACHE_SQLITE_PATH)
+        except sqlite3.Error as e:
+            print(f"ERROR: No se pudo abrir la caché SQLite ({e}). Usando memoria local.")
+    elif settings.CACHE_BACKEND == "redis":
+        try:
+            return RedisCacheBackend(settings.CACHE_REDIS_URL, prefix=settings.CACHE_KEY_PREFIX)
+        except (OSError, ConnectionError, RespError) as e:
+            print(f"ERROR: No se pudo conectar con la caché RESP en {settings.CACHE_REDIS_URL} ({e}). Usando memoria local.")
+    return MemoryCacheBackend(settings.CACHE_MAX_ENTRIES)
+
+cache = Cache(_build_backend())
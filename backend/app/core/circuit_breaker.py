@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Tuple
+
+# --- Circuit Breaker ---
+# Protege a la API de un servicio externo degradado. Mantiene una ventana deslizante
+# con el resultado y la latencia de las últimas llamadas:
+#   - CLOSED: las llamadas pasan. Si en la ventana la tasa de fallos o de llamadas lentas
+#     supera su umbral, pasa a OPEN.
+#   - OPEN: las llamadas se rechazan de inmediato (el llamador usa su fallback) durante open_seconds.
+#   - HALF_OPEN: se deja pasar un número limitado de sondas; si tienen éxito vuelve a CLOSED,
+#     si alguna falla vuelve a OPEN.
+# Toda llamada autorizada por allow_request() debe terminar en record_success, record_failure
+# o release_probe (en un finally), o la sonda de HALF_OPEN quedaría reservada para siempre.
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float,
+        slow_call_seconds: float,
+        slow_call_rate_threshold: float,
+        window_size: int,
+        min_calls: int,
+        open_seconds: float,
+        half_open_max_calls: int,
+    ):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.min_calls = max(1, min_calls)
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = max(1, half_open_max_calls)
+
+        self._lock = threading.Lock()
+        self._window: Deque[Tuple[bool, bool]] = deque(maxlen=max(1, window_size)) # (fallo, lenta)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self) -> None:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._half_open_in_flight = 0
+
+    def _open(self) -> None:
+        if self._state != OPEN:
+            print(f"ADVERTENCIA: Circuit breaker '{self.name}' ABIERTO durante {self.open_seconds:.0f}s.")
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._window.clear()
+
+    def allow_request(self) -> bool:
+        """Indica si la llamada puede ir al servicio externo (reserva una sonda en HALF_OPEN)."""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._half_open_in_flight < self.half_open_max_calls:
+                self._half_open_in_flight += 1
+                return True
+            return False
+
+    def release_probe(self) -> None:
+        """
+        Libera la sonda reservada por allow_request() cuando la llamada termina sin resultado
+        que registrar (limitador saturado, error de configuración, cancelación). Sin esto la
+        plaza queda ocupada y el breaker no sale nunca de HALF_OPEN.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+
+    def record_success(self, latency_seconds: float) -> None:
+        with self._lock:
+            slow = latency_seconds >= self.slow_call_seconds
+            if self._state == HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+                if slow:
+                    self._open()
+                else:
+                    print(f"DEBUG: Circuit breaker '{self.name}' CERRADO tras sonda exitosa.")
+                    self._state = CLOSED
+                    self._window.clear()
+                return
+            self._window.append((False, slow))
+            self._evaluate()
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+                self._open()
+                return
+            self._window.append((True, False))
+            self._evaluate()
+
+    def _evaluate(self) -> None:
+        calls = len(self._window)
+        if self._state != CLOSED or calls < self.min_calls:
+            return
+        failures = sum(1 for failed, _ in self._window if failed)
+        slow_calls = sum(1 for _, slow in self._window if slow)
+        if failures / calls >= self.failure_rate_threshold or slow_calls / calls >= self.slow_call_rate_threshold:
+            self._open()
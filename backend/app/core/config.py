@@ -18,7 +18,10 @@ class Settings(BaseSettings):
     # Seguridad JWT
     SECRET_KEY: str = os.getenv("SECRET_KEY", "default_super_secret_key_change_me")
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
-    ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+    # Access tokens de vida corta: llevan el claim de perfil versionado y se validan sin BD
+    ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 15))
+    # Refresh tokens de vida larga: sólo sirven para pedir un nuevo par en /auth/refresh
+    REFRESH_TOKEN_EXPIRE_DAYS: int = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 14))
 
     # Clave de Encriptación Fernet (Debe ser de 32 bytes URL-safe base64 encoded)
     ENCRYPTION_KEY: str = os.getenv("ENCRYPTION_KEY", "generate_a_real_32_byte_key_please") # Placeholder - ¡Generar una real!
@@ -27,9 +30,162 @@ class Settings(BaseSettings):
     PLAID_CLIENT_ID: Optional[str] = os.getenv("PLAID_CLIENT_ID")
     PLAID_SECRET_SANDBOX: Optional[str] = os.getenv("PLAID_SECRET_SANDBOX")
     PLAID_ENV: str = os.getenv("PLAID_ENV", "sandbox")
+    # Máximo de llamadas simultáneas a Plaid por usuario al recorrer sus Items
+    PLAID_MAX_CONCURRENCY_PER_USER: int = int(os.getenv("PLAID_MAX_CONCURRENCY_PER_USER", 4))
+    # Segundos que se reutilizan cuentas y saldos (accounts_get) de cada Item
+    PLAID_ACCOUNTS_CACHE_TTL_SECONDS: int = int(os.getenv("PLAID_ACCOUNTS_CACHE_TTL_SECONDS", 300))
+    # Segundos extra que se conservan los saldos expirados para servirlos si Plaid está saturado
+    PLAID_ACCOUNTS_STALE_SECONDS: int = int(os.getenv("PLAID_ACCOUNTS_STALE_SECONDS", 24 * 3600))
+    # Segundos que se reutiliza la sincronización de transacciones de un Item (peticiones casi simultáneas)
+    PLAID_TRANSACTIONS_CACHE_TTL_SECONDS: int = int(os.getenv("PLAID_TRANSACTIONS_CACHE_TTL_SECONDS", 30))
 
     # Hugging Face API
     HUGGINGFACE_API_KEY: Optional[str] = os.getenv("HUGGINGFACE_API_KEY")
+    # Presupuesto por categorización (segundos, todos los intentos) e intentos hedged
+    HF_REQUEST_DEADLINE_SECONDS: float = float(os.getenv("HF_REQUEST_DEADLINE_SECONDS", 3.0))
+    HF_HEDGE_DELAY_SECONDS: float = float(os.getenv("HF_HEDGE_DELAY_SECONDS", 0.8))
+    HF_MAX_ATTEMPTS: int = int(os.getenv("HF_MAX_ATTEMPTS", 2))
+    # Categorizador kNN local (índice persistido y memory-mapped)
+    CATEGORIZER_INDEX_DIR: str = os.getenv("CATEGORIZER_INDEX_DIR", os.path.join(os.path.dirname(__file__), '..', '..', 'var', 'categorizer'))
+    CATEGORIZER_DIM: int = int(os.getenv("CATEGORIZER_DIM", 512))
+    CATEGORIZER_K: int = int(os.getenv("CATEGORIZER_K", 5))
+    # Por debajo de esta confianza se consulta el modelo remoto
+    CATEGORIZER_CONFIDENCE_THRESHOLD: float = float(os.getenv("CATEGORIZER_CONFIDENCE_THRESHOLD", 0.6))
+    CATEGORIZER_REBUILD_EVERY: int = int(os.getenv("CATEGORIZER_REBUILD_EVERY", 256))
+    # Cada rebuild añade un segmento; al superar este número se compactan en uno solo
+    CATEGORIZER_MAX_SEGMENTS: int = int(os.getenv("CATEGORIZER_MAX_SEGMENTS", 16))
+    # Circuit breaker del cliente de inferencia
+    HF_BREAKER_FAILURE_RATE: float = float(os.getenv("HF_BREAKER_FAILURE_RATE", 0.5))
+    HF_BREAKER_SLOW_CALL_SECONDS: float = float(os.getenv("HF_BREAKER_SLOW_CALL_SECONDS", 2.0))
+    HF_BREAKER_SLOW_CALL_RATE: float = float(os.getenv("HF_BREAKER_SLOW_CALL_RATE", 0.8))
+    HF_BREAKER_WINDOW_SIZE: int = int(os.getenv("HF_BREAKER_WINDOW_SIZE", 20))
+    HF_BREAKER_MIN_CALLS: int = int(os.getenv("HF_BREAKER_MIN_CALLS", 5))
+    HF_BREAKER_OPEN_SECONDS: float = float(os.getenv("HF_BREAKER_OPEN_SECONDS", 30))
+    HF_BREAKER_HALF_OPEN_PROBES: int = int(os.getenv("HF_BREAKER_HALF_OPEN_PROBES", 1))
+
+    # Cola persistente de categorización (app/services/categorization_queue.py)
+    CATEGORIZATION_WORKERS: int = int(os.getenv("CATEGORIZATION_WORKERS", 4)) # Workers async del proceso de cola
+    CATEGORIZATION_API_WORKERS: int = int(os.getenv("CATEGORIZATION_API_WORKERS", 0)) # Workers dentro de la API (0 = proceso aparte)
+    CATEGORIZATION_BATCH_SIZE: int = int(os.getenv("CATEGORIZATION_BATCH_SIZE", 20)) # Trabajos reclamados a la vez por worker
+    CATEGORIZATION_MAX_ATTEMPTS: int = int(os.getenv("CATEGORIZATION_MAX_ATTEMPTS", 5)) # Después pasa a 'dead'
+    CATEGORIZATION_BACKOFF_SECONDS: float = float(os.getenv("CATEGORIZATION_BACKOFF_SECONDS", 30)) # Base del backoff exponencial
+    CATEGORIZATION_BACKOFF_MAX_SECONDS: float = float(os.getenv("CATEGORIZATION_BACKOFF_MAX_SECONDS", 3600))
+    CATEGORIZATION_POLL_SECONDS: float = float(os.getenv("CATEGORIZATION_POLL_SECONDS", 2)) # Espera con la cola vacía
+    CATEGORIZATION_LEASE_SECONDS: float = float(os.getenv("CATEGORIZATION_LEASE_SECONDS", 300)) # Trabajo 'running' abandonado
+    # Con el modelo caído (breaker abierto) el resultado local se descarta y el trabajo se reintenta
+    # cada CATEGORIZATION_LOCAL_RETRY_SECONDS; pasado CATEGORIZATION_LOCAL_MAX_AGE_SECONDS desde que
+    # se encoló, el resultado local se acepta como definitivo
+    CATEGORIZATION_LOCAL_RETRY_SECONDS: float = float(os.getenv("CATEGORIZATION_LOCAL_RETRY_SECONDS", 300))
+    CATEGORIZATION_LOCAL_MAX_AGE_SECONDS: float = float(os.getenv("CATEGORIZATION_LOCAL_MAX_AGE_SECONDS", 6 * 3600))
+    # Con el limitador de Hugging Face saturado el trabajo se reprograma (sin gastar intento) tras estos segundos
+    CATEGORIZATION_THROTTLED_RETRY_SECONDS: float = float(os.getenv("CATEGORIZATION_THROTTLED_RETRY_SECONDS", 30))
+    # Segundos que se reutiliza un dashboard completo del usuario (varias pantallas abiertas a la vez)
+    DASHBOARD_CACHE_TTL_SECONDS: int = int(os.getenv("DASHBOARD_CACHE_TTL_SECONDS", 10))
+    # Plazo (segundos) de /dashboard/data para las consultas a Plaid; al vencer se responde con lo
+    # guardado en la BD y las cuentas cacheadas (complete=False) y la sincronización sigue en segundo plano
+    DASHBOARD_PLAID_DEADLINE_SECONDS: float = float(os.getenv("DASHBOARD_PLAID_DEADLINE_SECONDS", 5.0))
+    # Eventos del dashboard (/dashboard/stream, SSE): intervalo de heartbeat, eventos en cola por
+    # conexión (si se llena, el cliente recibe 'resync') y espera de reconexión sugerida al cliente
+    SSE_HEARTBEAT_SECONDS: float = float(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+    SSE_QUEUE_SIZE: int = int(os.getenv("SSE_QUEUE_SIZE", 16))
+    SSE_RETRY_MS: int = int(os.getenv("SSE_RETRY_MS", 5000))
+    # Cada cuánto busca cada proceso cambios de otros procesos (ej. workers de categorización)
+    # para los usuarios con conexiones abiertas (una consulta por intervalo, no por conexión)
+    SSE_CHANGE_POLL_SECONDS: float = float(os.getenv("SSE_CHANGE_POLL_SECONDS", 2))
+    # Rango por defecto y máximo de buckets de /dashboard/timeseries
+    TIMESERIES_DEFAULT_DAYS: int = int(os.getenv("TIMESERIES_DEFAULT_DAYS", 365))
+    TIMESERIES_MAX_BUCKETS: int = int(os.getenv("TIMESERIES_MAX_BUCKETS", 1000))
+    # Divisas: tabla diaria de tipos de cambio (CSV fecha,divisa,tipo) y moneda base de los agregados.
+    # Las transacciones y cuentas sin iso_currency_code se asumen en BASE_CURRENCY.
+    BASE_CURRENCY: str = os.getenv("BASE_CURRENCY", "USD")
+    FX_RATES_PATH: str = os.getenv("FX_RATES_PATH", os.path.join(os.path.dirname(__file__), '..', 'data', 'fx_rates.csv'))
+    FX_RATES_QUOTE_CURRENCY: str = os.getenv("FX_RATES_QUOTE_CURRENCY", "USD") # Divisa de referencia del archivo (tipo = unidades por 1 de ella)
+    FX_BATCH_SIZE: int = int(os.getenv("FX_BATCH_SIZE", 5000)) # Filas (día x divisa x categoría) convertidas por lote
+    FX_AGGREGATE_CACHE_TTL_SECONDS: int = int(os.getenv("FX_AGGREGATE_CACHE_TTL_SECONDS", 300)) # Agregados ya convertidos, por moneda base
+    # Motor de insights (estadísticas incrementales por categoría y comercio)
+    INSIGHT_MIN_SAMPLES: int = int(os.getenv("INSIGHT_MIN_SAMPLES", 5)) # Transacciones antes de buscar anomalías
+    INSIGHT_SPIKE_Z: float = float(os.getenv("INSIGHT_SPIKE_Z", 3.0)) # Desviaciones típicas para considerar un gasto inusual
+    INSIGHT_TREND_RATIO: float = float(os.getenv("INSIGHT_TREND_RATIO", 1.2)) # EWMA rápida / lenta de totales mensuales
+    INSIGHT_RECURRING_INTERVAL_TOLERANCE_DAYS: float = float(os.getenv("INSIGHT_RECURRING_INTERVAL_TOLERANCE_DAYS", 3.0))
+    INSIGHT_NEW_RECURRING_DAYS: int = int(os.getenv("INSIGHT_NEW_RECURRING_DAYS", 120))
+    INSIGHT_RECENT_DAYS: int = int(os.getenv("INSIGHT_RECENT_DAYS", 30))
+    INSIGHT_MAX_PER_USER: int = int(os.getenv("INSIGHT_MAX_PER_USER", 5))
+
+    # Proyección Monte Carlo (/investment/projection)
+    PROJECTION_MAX_PATHS: int = int(os.getenv("PROJECTION_MAX_PATHS", 20000))
+    PROJECTION_CACHE_SIZE: int = int(os.getenv("PROJECTION_CACHE_SIZE", 512)) # Resultados cacheados por perfil y parámetros
+    # Catálogo de fondos ESG (/investment/funds), cargado una vez al arrancar
+    FUND_CATALOG_PATH: str = os.getenv("FUND_CATALOG_PATH", os.path.join(os.path.dirname(__file__), '..', 'data', 'esg_funds.json'))
+    FUND_CATALOG_CACHE_SIZE: int = int(os.getenv("FUND_CATALOG_CACHE_SIZE", 1024)) # Respuestas serializadas cacheadas
+
+    # Exportación de transacciones (/export): filas por lote y carpeta de los archivos generados
+    EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", 5000))
+    EXPORT_DIR: str = os.getenv("EXPORT_DIR", os.path.join(os.path.dirname(__file__), '..', '..', 'var', 'exports'))
+    # Un trabajo 'pending'/'running' sin latido (un lote escrito) en este tiempo se da por perdido (reinicio o caída del worker)
+    EXPORT_JOB_STALE_SECONDS: int = int(os.getenv("EXPORT_JOB_STALE_SECONDS", 600))
+    # Segundos que se conservan los archivos generados (y sus trabajos) tras terminar
+    EXPORT_RETENTION_SECONDS: int = int(os.getenv("EXPORT_RETENTION_SECONDS", 24 * 3600))
+
+    # Ingesta de transacciones: filas por sentencia INSERT ... ON CONFLICT y, en PostgreSQL,
+    # tamaño a partir del cual se usa COPY a una tabla temporal + merge (cargas iniciales)
+    INGEST_BATCH_SIZE: int = int(os.getenv("INGEST_BATCH_SIZE", 1000))
+    INGEST_COPY_THRESHOLD: int = int(os.getenv("INGEST_COPY_THRESHOLD", 5000))
+
+    # Particiones mensuales de 'transactions' (PostgreSQL) y retención del histórico
+    TRANSACTION_PARTITION_MONTHS_AHEAD: int = int(os.getenv("TRANSACTION_PARTITION_MONTHS_AHEAD", 3))
+    TRANSACTION_RETENTION_MONTHS: int = int(os.getenv("TRANSACTION_RETENTION_MONTHS", 36)) # Meses que se conservan en la BD
+    TRANSACTION_ARCHIVE_DIR: str = os.getenv("TRANSACTION_ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), '..', '..', 'var', 'archive'))
+
+    # Caché compartida (app/core/cache.py): "memory" (por worker), "sqlite" (workers del mismo host)
+    # o "redis" (cualquier servidor RESP, compartido entre hosts)
+    CACHE_BACKEND: str = os.getenv("CACHE_BACKEND", "memory")
+    # Procesos worker de la API (la misma variable que leen uvicorn y gunicorn). Con más de uno y
+    # CACHE_BACKEND="memory", la versión de perfil de los tokens se comprueba siempre en la BD
+    WEB_CONCURRENCY: int = int(os.getenv("WEB_CONCURRENCY", 1))
+    CACHE_MAX_ENTRIES: int = int(os.getenv("CACHE_MAX_ENTRIES", 10000)) # Sólo backend "memory"
+    CACHE_SQLITE_PATH: str = os.getenv("CACHE_SQLITE_PATH", "/tmp/nexusmc_cache.sqlite3")
+    CACHE_REDIS_URL: str = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+    CACHE_KEY_PREFIX: str = os.getenv("CACHE_KEY_PREFIX", "nexusmc:")
+    # Segundos que se reutiliza la categoría del modelo para una misma descripción
+    CATEGORY_CACHE_TTL_SECONDS: int = int(os.getenv("CATEGORY_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+
+    # Perfilado por muestreo (app/core/profiling.py). Por petición: cabecera X-Profile-Token = PROFILING_TOKEN
+    PROFILING_ENABLED: bool = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+    PROFILING_TOKEN: Optional[str] = os.getenv("PROFILING_TOKEN")
+    PROFILING_SAMPLE_INTERVAL_MS: float = float(os.getenv("PROFILING_SAMPLE_INTERVAL_MS", 2))
+    PROFILING_MAX_SECONDS: float = float(os.getenv("PROFILING_MAX_SECONDS", 30)) # Techo de muestreo por petición
+    # Muestreo continuo a baja frecuencia, volcado a disco cada PROFILING_FLUSH_SECONDS
+    PROFILING_CONTINUOUS: bool = os.getenv("PROFILING_CONTINUOUS", "false").lower() == "true"
+    PROFILING_CONTINUOUS_INTERVAL_MS: float = float(os.getenv("PROFILING_CONTINUOUS_INTERVAL_MS", 50))
+    PROFILING_FLUSH_SECONDS: float = float(os.getenv("PROFILING_FLUSH_SECONDS", 60))
+    PROFILING_DIR: str = os.getenv("PROFILING_DIR", os.path.join(os.path.dirname(__file__), '..', '..', 'var', 'profiles'))
+
+    # Cabecera Server-Timing en cada respuesta; con DEBUG, 'X-Debug-Timing: 1' añade el campo '_timing' al JSON
+    SERVER_TIMING_ENABLED: bool = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+    SERVER_TIMING_DEBUG: bool = os.getenv("SERVER_TIMING_DEBUG", "false").lower() == "true"
+
+    # Vigilante del event loop: detecta bloqueos (código síncrono en handlers async) por encima del umbral
+    LOOP_WATCHDOG_ENABLED: bool = os.getenv("LOOP_WATCHDOG_ENABLED", "false").lower() == "true"
+    LOOP_WATCHDOG_THRESHOLD_MS: float = float(os.getenv("LOOP_WATCHDOG_THRESHOLD_MS", 100))
+    LOOP_WATCHDOG_INTERVAL_MS: float = float(os.getenv("LOOP_WATCHDOG_INTERVAL_MS", 20)) # Latido del loop
+    LOOP_WATCHDOG_DIR: str = os.getenv("LOOP_WATCHDOG_DIR", os.path.join(os.path.dirname(__file__), '..', '..', 'var', 'loop_watchdog'))
+
+    # Calentamiento al arrancar cada worker (lifespan) y sondas /healthz y /readyz
+    WARMUP_ENABLED: bool = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+    WARMUP_DB_CONNECTIONS: int = int(os.getenv("WARMUP_DB_CONNECTIONS", 5)) # Conexiones del pool abiertas de antemano
+    READINESS_CACHE_SECONDS: float = float(os.getenv("READINESS_CACHE_SECONDS", 5)) # Reutilización del resultado de /readyz
+    READINESS_TIMEOUT_SECONDS: float = float(os.getenv("READINESS_TIMEOUT_SECONDS", 2)) # Por comprobación
+
+    # Rate limiting de salida (token bucket por servicio externo)
+    PLAID_RATE_LIMIT_PER_SECOND: float = float(os.getenv("PLAID_RATE_LIMIT_PER_SECOND", 10))
+    PLAID_RATE_LIMIT_BURST: int = int(os.getenv("PLAID_RATE_LIMIT_BURST", 20))
+    HF_RATE_LIMIT_PER_SECOND: float = float(os.getenv("HF_RATE_LIMIT_PER_SECOND", 5))
+    HF_RATE_LIMIT_BURST: int = int(os.getenv("HF_RATE_LIMIT_BURST", 10))
+    # Espera máxima en cola antes de degradar (segundos)
+    RATE_LIMIT_MAX_WAIT_SECONDS: float = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", 2.0))
+    # "memory" (por worker) o "sqlite" (compartido entre workers del mismo host)
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    RATE_LIMIT_SQLITE_PATH: str = os.getenv("RATE_LIMIT_SQLITE_PATH", "/tmp/nexusmc_rate_limits.sqlite3")
 
     # Pydantic-settings cargará automáticamente desde variables de entorno.
     # La configuración de Config es opcional si las variables ya están en el entorno (gracias a load_dotenv)
@@ -49,19 +205,15 @@ except ValidationError as e:
 
 # Validación y advertencias para claves placeholder
 if settings.SECRET_KEY == "default_super_secret_key_change_me":
-    print("
-ADVERTENCIA: La SECRET_KEY de JWT es un placeholder inseguro.")
-    print("             Genera una clave segura (ej. openssl rand -hex 32) y configúrala en .env.
-")
+    print("\nADVERTENCIA: La SECRET_KEY de JWT es un placeholder inseguro.")
+    print("             Genera una clave segura (ej. openssl rand -hex 32) y configúrala en .env.\n")
     # Considera lanzar un error en producción:
     # raise ValueError("¡SECRET_KEY debe ser configurada con un valor seguro en .env!")
 
 if settings.ENCRYPTION_KEY == "generate_a_real_32_byte_key_please":
-    print("
-ADVERTENCIA: La ENCRYPTION_KEY es un placeholder inseguro.")
+    print("\nADVERTENCIA: La ENCRYPTION_KEY es un placeholder inseguro.")
     print("             Genera una clave Fernet (python -c 'from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())')")
-    print("             y configúrala en .env.
-")
+    print("             y configúrala en .env.\n")
     # Considera lanzar un error en producción:
     # raise ValueError("¡ENCRYPTION_KEY debe ser generada y configurada en .env!")
 
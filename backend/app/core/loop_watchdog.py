@@ -0,0 +1,195 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .config import settings
+
+# --- Detector de Bloqueos del Event Loop ---
+# Un latido (loop.call_later) marca cada LOOP_WATCHDOG_INTERVAL_MS que el loop sigue atendiendo.
+# Un hilo vigilante comprueba el último latido: si el loop lleva más de LOOP_WATCHDOG_THRESHOLD_MS
+# sin latir, captura en ese momento la pila del hilo del loop (el código que lo está bloqueando)
+# y la ruta de la petición en curso. Cuando el loop vuelve a latir se conoce la duración real
+# del bloqueo. Cada bloqueo se agrega por (ruta, línea de nuestro código) con número, total y
+# máximo; el log y el volcado JSON (LOOP_WATCHDOG_DIR/loop-blocks-<pid>.json) se escriben desde
+# el hilo vigilante, nunca desde el loop.
+
+APP_MARKER = os.sep + "app" + os.sep
+# Middlewares propios: aparecen en todas las pilas, no son el sitio del bloqueo
+_MIDDLEWARE_FILES = {os.path.join("app", "core", name) for name in ("timing.py", "profiling.py", "loop_watchdog.py")}
+
+
+def _format_stack(frame) -> List[str]:
+    return [
+        f"{entry.filename}:{entry.lineno} in {entry.name}"
+        for entry in traceback.extract_stack(frame)
+    ]
+
+def _blocking_site(stack: List[str]) -> str:
+    """Línea más interna de nuestro código (app/, sin los middlewares) en la pila; si no hay, la hoja."""
+    for line in reversed(stack):
+        if APP_MARKER in line:
+            site = line[line.rfind(APP_MARKER) + 1:]
+            if site.split(":", 1)[0] not in _MIDDLEWARE_FILES:
+                return site
+    return stack[-1] if stack else "desconocido"
+
+
+class LoopWatchdog:
+    """Vigilante de un event loop (uno por worker)."""
+
+    def __init__(self, threshold_seconds: float, interval_seconds: float, report_dir: Optional[str]):
+        self.threshold = threshold_seconds
+        self.interval = min(interval_seconds, threshold_seconds / 2)
+        self.report_dir = report_dir
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._lock = threading.Lock()
+        self._beat = 0
+        self._last_beat = time.monotonic()
+        self._expected = self._last_beat
+        self._captured: Optional[Tuple[int, str, List[str]]] = None # (latido, ruta, pila)
+        self._finished: Deque[Tuple[float, str, List[str]]] = deque()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Peticiones en curso: tarea -> scope ASGI (la ruta se resuelve al detectar el bloqueo)
+        self._scopes: "weakref.WeakKeyDictionary[asyncio.Task, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+        # (ruta, sitio) -> estadísticas
+        self._stats: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Se llama desde el propio loop (hilo del loop)."""
+        if self.running:
+            return
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = self._expected = time.monotonic()
+        loop.call_soon(self._heartbeat)
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        print(f"DEBUG: Vigilante del event loop activo (umbral {self.threshold * 1000:.0f} ms).")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def track(self, scope: Dict[str, Any]) -> None:
+        """Asocia la tarea actual a su petición (para atribuir los bloqueos a una ruta)."""
+        task = asyncio.current_task()
+        if task is not None:
+            self._scopes[task] = scope
+
+    # --- En el loop ---
+
+    def _heartbeat(self) -> None:
+        now = time.monotonic()
+        lag = now - self._expected
+        with self._lock:
+            captured, self._captured = self._captured, None
+            self._beat += 1
+            self._last_beat = now
+        if lag >= self.threshold:
+            if captured is not None:
+                _, route, stack = captured
+            else:
+                route, stack = "desconocida", [] # El vigilante no llegó a verlo (ej. GIL retenido)
+            self._finished.append((lag, route, stack))
+        if not self._stop_event.is_set():
+            self._expected = now + self.interval
+            self._loop.call_later(self.interval, self._heartbeat)
+
+    # --- En el hilo vigilante ---
+
+    def _current_route(self) -> str:
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        scope = self._scopes.get(task) if task is not None else None
+        if scope is None:
+            return "sin petición"
+        route = scope.get("route")
+        path = getattr(route, "path", None) or scope.get("path", "?")
+        return f"{scope.get('method', '')} {path}".strip()
+
+    def _watch(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            with self._lock:
+                beat, last_beat, captured = self._beat, self._last_beat, self._captured
+            if captured is None and time.monotonic() - last_beat >= self.threshold:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = _format_stack(frame) if frame is not None else []
+                route = self._current_route()
+                with self._lock:
+                    if self._beat == beat: # Sigue bloqueado en el mismo latido
+                        self._captured = (beat, route, stack)
+            while self._finished:
+                self._record(*self._finished.popleft())
+
+    def _record(self, duration: float, route: str, stack: List[str]) -> None:
+        site = _blocking_site(stack)
+        entry = self._stats.setdefault((route, site), {
+            "route": route, "site": site, "count": 0, "total_ms": 0.0, "max_ms": 0.0, "stack": stack,
+        })
+        entry["count"] += 1
+        entry["total_ms"] += duration * 1000
+        if duration * 1000 >= entry["max_ms"]:
+            entry["max_ms"] = duration * 1000
+            entry["stack"] = stack or entry["stack"]
+        print(
+            f"ADVERTENCIA: Event loop bloqueado {duration * 1000:.0f} ms en {route} ({site}).\n"
+            + "".join(f"    {line}\n" for line in stack[-12:])
+        )
+        self._dump()
+
+    def _dump(self) -> None:
+        if not self.report_dir:
+            return
+        path = os.path.join(self.report_dir, f"loop-blocks-{os.getpid()}.json")
+        try:
+            os.makedirs(self.report_dir, exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.stats(), f, indent=2)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"ERROR: No se pudo escribir el informe de bloqueos en {path}: {e}")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Bloqueos agregados por ruta y sitio, de mayor a menor tiempo total."""
+        entries = [
+            {**entry, "total_ms": round(entry["total_ms"], 1), "max_ms": round(entry["max_ms"], 1)}
+            for entry in self._stats.values()
+        ]
+        return sorted(entries, key=lambda entry: entry["total_ms"], reverse=True)
+
+
+class LoopWatchdogMiddleware:
+    """Arranca el vigilante en el loop del worker y asocia cada petición a su tarea."""
+
+    def __init__(self, app, watchdog: LoopWatchdog):
+        self.app = app
+        self.watchdog = watchdog
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            if not self.watchdog.running:
+                self.watchdog.start(asyncio.get_running_loop())
+            self.watchdog.track(scope)
+        await self.app(scope, receive, send)
+
+
+loop_watchdog = LoopWatchdog(
+    settings.LOOP_WATCHDOG_THRESHOLD_MS / 1000.0,
+    settings.LOOP_WATCHDOG_INTERVAL_MS / 1000.0,
+    settings.LOOP_WATCHDOG_DIR,
+)
@@ -0,0 +1,253 @@
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional, Tuple
+
+from .config import settings
+
+# --- Perfilado por Muestreo ---
+# Un hilo muestrea periódicamente las pilas de todos los hilos del proceso (sys._current_frames)
+# y acumula cuántas veces aparece cada pila. El resultado se escribe en formato "folded"
+# ("raíz;...;hoja N" por línea), compatible con flamegraph.pl, inferno y speedscope.
+# No instrumenta nada: el coste sólo existe mientras hay un muestreo activo.
+#   - Por petición: con PROFILING_ENABLED, una petición con la cabecera X-Profile-Token correcta
+#     se perfila sola; el informe se guarda en PROFILING_DIR (o se devuelve en lugar de la respuesta).
+#   - Continuo: con PROFILING_CONTINUOUS, muestreo a baja frecuencia y volcado periódico a disco.
+# La raíz de cada pila es el hilo: el event loop y los hilos de asyncio.to_thread se distinguen
+# (bcrypt, consultas SQLAlchemy síncronas y SDK de Plaid corren en estos últimos).
+
+PROFILE_TOKEN_HEADER = b"x-profile-token"
+PROFILE_OUTPUT_HEADER = b"x-profile-output"
+
+# Hojas de pila de hilos ociosos (esperando trabajo o eventos): no aportan al perfil
+_IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+}
+
+_PATH_MARKERS = ("site-packages" + os.sep, "lib" + os.sep + "python")
+
+def _short_path(filename: str) -> str:
+    """Ruta legible del módulo: relativa a site-packages, a la librería estándar o al backend."""
+    for marker in _PATH_MARKERS:
+        index = filename.rfind(marker)
+        if index >= 0:
+            rest = filename[index + len(marker):]
+            return rest.split(os.sep, 1)[1] if marker.startswith("lib") and os.sep in rest else rest
+    index = filename.rfind(os.sep + "app" + os.sep)
+    return filename[index + 1:] if index >= 0 else os.path.basename(filename)
+
+def _collapse(frame) -> Tuple[str, ...]:
+    """Pila de la raíz a la hoja como etiquetas 'modulo.py:funcion'."""
+    labels = []
+    while frame is not None:
+        code = frame.f_code
+        labels.append(f"{_short_path(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    labels.reverse()
+    return tuple(labels)
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES
+
+
+class StackSampler(threading.Thread):
+    """
+    Hilo que muestrea las pilas de todos los hilos cada 'interval' segundos,
+    como mucho durante 'max_seconds' (si se indica).
+    """
+
+    def __init__(self, interval: float, name: str = "stack-sampler", max_seconds: Optional[float] = None):
+        super().__init__(name=name, daemon=True)
+        self.interval = max(interval, 0.0005)
+        self.max_seconds = max_seconds
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def sample(self) -> None:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        frames = sys._current_frames()
+        with self._lock:
+            self.samples += 1
+            for ident, frame in frames.items():
+                if ident == own or _is_idle(frame):
+                    continue
+                self.counts[(f"thread:{names.get(ident, ident)}",) + _collapse(frame)] += 1
+
+    def run(self) -> None:
+        deadline = time.monotonic() + self.max_seconds if self.max_seconds else None
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+            if deadline is not None and time.monotonic() >= deadline:
+                break # Techo de duración: el informe conserva lo muestreado hasta aquí
+
+    def stop(self) -> Counter:
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        return self.drain()
+
+    def drain(self) -> Counter:
+        """Devuelve las pilas acumuladas y reinicia el contador."""
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+        return counts
+
+
+def folded(counts: Counter) -> str:
+    """Pilas en formato folded (una por línea, más frecuentes primero)."""
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in counts.most_common())
+
+def write_folded(counts: Counter, path: str) -> str:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(folded(counts))
+    os.replace(temp_path, path)
+    return path
+
+
+class ContinuousProfiler(StackSampler):
+    """
+    Muestreo continuo a baja frecuencia. Cada 'flush_seconds' vuelca las pilas agregadas
+    a PROFILING_DIR/continuous-<pid>-<YYYYmmddHHMMSS>.folded (un archivo por ventana y worker).
+    """
+
+    def __init__(self, interval: float, flush_seconds: float, directory: str):
+        super().__init__(interval, name="continuous-profiler")
+        self.flush_seconds = max(flush_seconds, 1.0)
+        self.directory = directory
+        self._window_start = time.time()
+
+    def flush(self) -> Optional[str]:
+        counts = self.drain()
+        started, self._window_start = self._window_start, time.time()
+        if not counts:
+            return None
+        stamp = time.strftime("%Y%m%d%H%M%S", time.gmtime(started))
+        try:
+            return write_folded(counts, os.path.join(self.directory, f"continuous-{os.getpid()}-{stamp}.folded"))
+        except OSError as e:
+            print(f"ERROR: No se pudo escribir el perfil continuo en {self.directory}: {e}")
+            return None
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+            if time.time() - self._window_start >= self.flush_seconds:
+                self.flush()
+        self.flush()
+
+
+# --- Middleware ASGI ---
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+def _authorized(token: Optional[str]) -> bool:
+    expected = settings.PROFILING_TOKEN
+    return settings.PROFILING_ENABLED and bool(expected and token) and hmac.compare_digest(token, expected)
+
+_continuous: Optional[ContinuousProfiler] = None
+
+def start_continuous_profiler() -> Optional[ContinuousProfiler]:
+    """Arranca (una vez por proceso) el muestreo continuo si está configurado."""
+    global _continuous
+    if settings.PROFILING_CONTINUOUS and (_continuous is None or not _continuous.is_alive()):
+        _continuous = ContinuousProfiler(
+            settings.PROFILING_CONTINUOUS_INTERVAL_MS / 1000.0,
+            settings.PROFILING_FLUSH_SECONDS,
+            settings.PROFILING_DIR,
+        )
+        _continuous.start()
+        print(f"DEBUG: Perfilado continuo activo (cada {settings.PROFILING_CONTINUOUS_INTERVAL_MS} ms, volcado en {settings.PROFILING_DIR}).")
+    return _continuous
+
+
+class ProfilingMiddleware:
+    """
+    Perfila bajo demanda la petición que trae 'X-Profile-Token: <PROFILING_TOKEN>'.
+
+    El informe folded se guarda en PROFILING_DIR y su nombre se devuelve en la cabecera
+    X-Profile-Report. Con 'X-Profile-Output: inline' el informe sustituye al cuerpo de la
+    respuesta (el estado original va en X-Profile-Status). Sólo se perfila una petición a la vez
+    por worker; el muestreo cubre también el envío del cuerpo (respuestas en streaming).
+    Las muestras del event loop pueden incluir otras peticiones concurrentes del mismo worker.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._busy = threading.Lock()
+        start_continuous_profiler()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _authorized(_header(scope, PROFILE_TOKEN_HEADER)):
+            await self.app(scope, receive, send)
+            return
+        if not self._busy.acquire(blocking=False):
+            print("ADVERTENCIA: Ya hay una petición perfilándose en este worker; se atiende sin perfilar.")
+            await self.app(scope, receive, send)
+            return
+
+        inline = (_header(scope, PROFILE_OUTPUT_HEADER) or "").lower() == "inline"
+        stamp = time.strftime("%Y%m%d%H%M%S", time.gmtime())
+        route = scope["path"].strip("/").replace("/", "_") or "root"
+        report_name = f"request-{stamp}-{os.getpid()}-{route}.folded"
+        status_code = 500
+        sampler = StackSampler(
+            settings.PROFILING_SAMPLE_INTERVAL_MS / 1000.0, name="request-profiler",
+            max_seconds=settings.PROFILING_MAX_SECONDS,
+        )
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if inline:
+                    return # Se sustituye por el informe al terminar
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-report", report_name.encode("latin-1"))]
+            elif inline and message["type"] == "http.response.body":
+                return
+            await send(message)
+
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            counts = sampler.stop()
+            self._busy.release()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            print(f"DEBUG: Perfil de {scope['method']} {scope['path']}: {elapsed_ms:.1f} ms, {sampler.samples} muestras.")
+
+        if inline:
+            body = folded(counts).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                    (b"x-profile-status", str(status_code).encode("latin-1")),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+        else:
+            try:
+                write_folded(counts, os.path.join(settings.PROFILING_DIR, report_name))
+            except OSError as e:
+                print(f"ERROR: No se pudo guardar el perfil {report_name}: {e}")
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+from typing import Any, Dict, Hashable, List, Optional, Set
+
+# --- Pub/Sub en Proceso ---
+# Canales por clave (ej. id de usuario) para empujar eventos a las conexiones abiertas
+# (SSE de /dashboard/stream). Cada suscripción tiene su propia cola acotada: un cliente lento no
+# acumula memoria ni frena a los demás; si su cola se llena, los eventos nuevos se descartan y la
+# suscripción queda marcada como 'overflowed' (el consumidor debe reenviar el estado completo).
+# publish() se puede llamar desde cualquier hilo (escrituras en segundo plano con
+# asyncio.to_thread, workers de la cola): la entrega se programa en el event loop de cada suscripción.
+# Es por proceso: con varios workers, sólo reciben el evento las conexiones del mismo proceso
+# (los cambios de otros procesos llegan por sondeo; ver services/live_updates.py).
+
+
+class Subscription:
+    """Cola acotada de eventos de una conexión (una por suscriptor)."""
+
+    __slots__ = ("key", "queue", "loop", "overflowed")
+
+    def __init__(self, key: Hashable, maxsize: int, loop: asyncio.AbstractEventLoop):
+        self.key = key
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, maxsize))
+        self.loop = loop
+        self.overflowed = False
+
+    def _deliver(self, event: Any) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout: float) -> Optional[Any]:
+        """Siguiente evento, o None si no llega ninguno en 'timeout' segundos."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def drain(self) -> List[Any]:
+        """Eventos ya encolados, sin esperar (para procesarlos juntos)."""
+        events = []
+        while not self.queue.empty():
+            events.append(self.queue.get_nowait())
+        return events
+
+
+class PubSub:
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock() # publish() llega también desde hilos
+        self._subscribers: Dict[Hashable, Set[Subscription]] = {}
+        # Contadores por proceso
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, key: Hashable, maxsize: int) -> Subscription:
+        """Nueva suscripción a 'key' (llamar desde el event loop que la consumirá)."""
+        subscription = Subscription(key, maxsize, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.key)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.key]
+
+    def has_subscribers(self, key: Hashable) -> bool:
+        return key in self._subscribers
+
+    def keys(self) -> List[Hashable]:
+        """Claves con alguna suscripción abierta."""
+        with self._lock:
+            return list(self._subscribers)
+
+    def publish(self, key: Hashable, event: Any) -> int:
+        """Entrega 'event' a todas las suscripciones de 'key' sin bloquear. Devuelve cuántas había."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(key, ()))
+        self.published += 1
+        if not subscribers:
+            return 0
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None # Desde un hilo sin event loop
+        for subscription in subscribers:
+            if subscription.loop is running:
+                subscription._deliver(event)
+            else:
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription._deliver, event)
+                except RuntimeError:
+                    pass # Loop ya cerrado (apagado del worker)
+        self.delivered += len(subscribers)
+        return len(subscribers)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            keys = len(self._subscribers)
+            connections = sum(len(subscribers) for subscribers in self._subscribers.values())
+        return {"keys": keys, "connections": connections, "published": self.published, "delivered": self.delivered}
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Tuple
+
+from .config import settings
+
+# --- Limitadores de Salida (Token Bucket) ---
+# Limitan la velocidad a la que llamamos a servicios externos (Plaid, Hugging Face).
+# Cada llamada reserva un token; si el bucket está vacío la llamada espera su turno
+# (cola implícita por orden de reserva) hasta un máximo de RATE_LIMIT_MAX_WAIT_SECONDS.
+# Si la espera necesaria supera ese máximo, no se reserva nada y se lanza RateLimitExceeded
+# para que el llamador degrade de forma explícita (datos cacheados, categoría sin asignar, etc.).
+# Con un almacén que hace IO (SQLite) la reserva corre en un hilo (asyncio.to_thread): un lock
+# disputado entre workers no puede detener el event loop.
+
+class RateLimitExceeded(Exception):
+    """El limitador está saturado: no hay token disponible dentro de la espera máxima."""
+
+    def __init__(self, name: str, wait_seconds: float):
+        super().__init__(f"Rate limit '{name}' saturado (espera necesaria {wait_seconds:.2f}s)")
+        self.name = name
+        self.wait_seconds = wait_seconds
+
+
+class MemoryBucketStore:
+    """Estado de los buckets en memoria del proceso (un estado por worker)."""
+
+    blocking = False # Reserva instantánea: se llama directamente desde el event loop
+
+    def __init__(self):
+        self._lock = threading.Lock() # También se usa desde hilos (asyncio.to_thread)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def reserve(self, name: str, rate: float, burst: float, max_wait: float) -> Tuple[bool, float]:
+        """Intenta reservar un token. Devuelve (reservado, segundos a esperar)."""
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(name, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = (1.0 - tokens) / rate if tokens < 1.0 else 0.0
+            if wait > max_wait:
+                self._buckets[name] = (tokens, now)
+                return False, wait
+            self._buckets[name] = (tokens - 1.0, now)
+            return True, wait
+
+
+class SQLiteBucketStore:
+    """
+    Estado de los buckets compartido entre los workers de uvicorn del mismo host,
+    en un archivo SQLite local. Cada reserva es una transacción BEGIN IMMEDIATE.
+    La conexión se abre al primer uso en cada hilo y proceso: con --preload, una conexión
+    abierta al importar se heredaría en todos los workers tras el fork.
+    """
+
+    blocking = True # Puede esperar al lock del archivo: se llama en un hilo
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            # En un worker hijo, la conexión heredada del maestro se abandona sin cerrarla
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS rate_buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def reserve(self, name: str, rate: float, burst: float, max_wait: float) -> Tuple[bool, float]:
+        """
+        Reserva un token. Si otro proceso retiene el archivo más allá del timeout de la conexión,
+        la reserva se rechaza como si el limitador estuviera saturado (no se propaga el error).
+        """
+        conn = self._connect()
+        now = time.time() # Reloj de pared: compartido entre procesos
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE name = ?", (name,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            wait = (1.0 - tokens) / rate if tokens < 1.0 else 0.0
+            if wait <= max_wait:
+                tokens -= 1.0
+            conn.execute(
+                "INSERT INTO rate_buckets (name, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (name, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise
+            print(f"ADVERTENCIA: Almacén de rate limiting bloqueado ({e}). Reserva de '{name}' rechazada.")
+            return False, max_wait
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return wait <= max_wait, wait
+
+
+class TokenBucket:
+    """Limitador token bucket para un servicio externo."""
+
+    def __init__(self, name: str, rate: float, burst: float, max_wait: float, store):
+        self.name = name
+        self.rate = max(rate, 1e-6)
+        self.burst = max(burst, 1.0)
+        self.max_wait = max_wait
+        self.store = store
+        # Contadores básicos para diagnóstico
+        self.granted = 0
+        self.rejected = 0
+
+    async def _store_reserve(self, max_wait: float) -> Tuple[bool, float]:
+        if self.store.blocking:
+            return await asyncio.to_thread(self.store.reserve, self.name, self.rate, self.burst, max_wait)
+        return self.store.reserve(self.name, self.rate, self.burst, max_wait)
+
+    def _record(self, reserved: bool, wait: float) -> float:
+        if not reserved:
+            self.rejected += 1
+            raise RateLimitExceeded(self.name, wait)
+        self.granted += 1
+        return wait
+
+    async def acquire(self) -> None:
+        """Espera (sin bloquear el event loop) hasta tener un token, o lanza RateLimitExceeded."""
+        wait = self._record(*await self._store_reserve(self.max_wait))
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def try_acquire(self) -> bool:
+        """Toma un token sólo si hay uno disponible ahora mismo (sin esperar turno ni lanzar)."""
+        reserved, _ = await self._store_reserve(0.0)
+        if reserved:
+            self.granted += 1
+        return reserved
+
+
+def _build_store():
+    if settings.RATE_LIMIT_BACKEND == "sqlite":
+        try:
+            return SQLiteBucketStore(settings.RATE_LIMIT_SQLITE_PATH)
+        except (sqlite3.Error, OSError) as e:
+            print(f"ERROR: No se pudo abrir el almacén SQLite de rate limiting ({e}). Usando memoria local.")
+    return MemoryBucketStore()
+
+_store = _build_store()
+
+plaid_limiter = TokenBucket(
+    "plaid", settings.PLAID_RATE_LIMIT_PER_SECOND, settings.PLAID_RATE_LIMIT_BURST,
+    settings.RATE_LIMIT_MAX_WAIT_SECONDS, _store,
+)
+huggingface_limiter = TokenBucket(
+    "huggingface", settings.HF_RATE_LIMIT_PER_SECOND, settings.HF_RATE_LIMIT_BURST,
+    settings.RATE_LIMIT_MAX_WAIT_SECONDS, _store,
+)
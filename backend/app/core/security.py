@@ -1,6 +1,6 @@
 import os
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Any
+from typing import Optional, Any, Dict
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -11,11 +11,15 @@ from sqlalchemy.orm import Session
 from cryptography.fernet import Fernet
 
 # Importaciones relativas desde el mismo nivel 'core' o niveles superiores
+import asyncio
+
+from .cache import cache
 from .config import settings
-from ..db.database import get_db
+from .timing import timed, CRYPTO
+from ..db.database import get_db, SessionLocal
 from ..models.user import User
 # Importar TokenData desde su nueva ubicación
-from ..schemas.token import TokenData
+from ..schemas.token import TokenData, TokenPrincipal
 
 # Esquema OAuth2 para obtener el token de las cabeceras
 # El tokenUrl debe coincidir con la ruta del endpoint de login
@@ -28,14 +32,20 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifica una contraseña plana contra su hash."""
-    return pwd_context.verify(plain_password, hashed_password)
+    with timed(CRYPTO):
+        return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     """Genera el hash de una contraseña."""
-    return pwd_context.hash(password)
+    with timed(CRYPTO):
+        return pwd_context.hash(password)
 
 # --- Funciones de Token JWT ---
 
+# Tipos de token emitidos ('typ' en el payload)
+ACCESS_TOKEN_TYPE = "access"
+REFRESH_TOKEN_TYPE = "refresh"
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Crea un nuevo token de acceso JWT."""
     to_encode = data.copy()
@@ -46,45 +56,174 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expire = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
 
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    with timed(CRYPTO):
+        encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-# --- Dependencia para Obtener Usuario Actual ---
+def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+    """Crea un refresh token JWT (sin claim de perfil, sólo válido en /auth/refresh)."""
+    to_encode = data.copy()
+    to_encode["typ"] = REFRESH_TOKEN_TYPE
+    return create_access_token(to_encode, expires_delta or timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS))
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+# --- Versionado del Perfil en el Token ---
+# El access token lleva una copia del perfil y la versión (User.profile_version, un contador que
+# sube en cada actualización) con la que se emitió. La última versión conocida de cada usuario vive
+# en la caché compartida (espacio 'profile_counters'), así que con un backend compartido todos los
+# workers rechazan a la vez los tokens con una versión anterior. Basta con recordarla lo que dura
+# un access token: los emitidos antes ya han caducado. El máximo se calcula en el backend
+# (set_max), sin leer y escribir por separado. Una entrada que falta (desalojada por el LRU, caché
+# reiniciada) no significa "válido": se recarga de la BD.
+# Con varios workers (WEB_CONCURRENCY > 1) y la caché en memoria de cada proceso, un worker no ve
+# las actualizaciones hechas en otro: la versión se lee siempre de la BD.
+
+_profile_versions = cache.namespace("profile_counters", settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60, value_type=int)
+_PROFILE_VERSION_FROM_DB = settings.WEB_CONCURRENCY > 1 and not getattr(cache.backend, "shared", False)
+if _PROFILE_VERSION_FROM_DB:
+    print(f"ADVERTENCIA: {settings.WEB_CONCURRENCY} workers con caché '{cache.backend_name}' por proceso: "
+          "la versión de perfil de cada token se comprobará en la BD. Configura CACHE_BACKEND=sqlite o redis.")
+
+async def note_profile_version(user_id: int, version: int) -> None:
+    """Registra la versión de perfil más reciente vista para el usuario."""
+    await _profile_versions.aset_max(str(user_id), version)
+
+def _load_profile_version(user_id: int) -> Optional[int]:
+    """Versión actual del usuario leída de la BD (None si ya no existe)."""
+    db = SessionLocal()
+    try:
+        row = db.query(User.profile_version).filter(User.id == user_id).first()
+        return row[0] if row is not None else None
+    finally:
+        db.close()
+
+async def is_profile_version_current(user_id: int, version: int) -> bool:
     """
-    Dependencia para obtener el usuario actual basado en el token JWT.
-    Decodifica el token, valida los datos y obtiene el usuario de la BD.
+    Indica si un token con esta versión sigue siendo válido para el usuario.
+    Sin versión en la caché se consulta la BD (y se vuelve a registrar); si el usuario ya no existe, no es válido.
+    """
+    current = None if _PROFILE_VERSION_FROM_DB else await _profile_versions.aget_int(str(user_id))
+    if current is None:
+        current = await asyncio.to_thread(_load_profile_version, user_id)
+        if current is None:
+            return False
+        await note_profile_version(user_id, current)
+    return version >= current
+
+def build_profile_claim(user: User) -> Dict[str, Any]:
+    """Extrae los campos de perfil que viajan dentro del access token."""
+    return {
+        "age": user.age,
+        "primary_goal": user.primary_goal,
+        "esg_interest": bool(user.esg_interest),
+        "created_at": user.created_at.isoformat() if user.created_at else None,
+        "updated_at": user.updated_at.isoformat() if user.updated_at else None,
+    }
+
+async def create_user_tokens(user: User) -> Dict[str, Any]:
     """
-    credentials_exception = HTTPException(
+    Emite el par access/refresh para un usuario.
+    El access token incluye el perfil versionado para servir lecturas sin consultar la BD.
+    """
+    version = user.profile_version or 0
+    await note_profile_version(user.id, version)
+    access_token = create_access_token(data={
+        "sub": user.email,
+        "uid": user.id,
+        "typ": ACCESS_TOKEN_TYPE,
+        "ver": version,
+        "profile": build_profile_claim(user),
+    })
+    refresh_token = create_refresh_token(data={"sub": user.email, "uid": user.id})
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "expires_in": settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+def _credentials_exception(detail: str = "Could not validate credentials") -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
+        detail=detail,
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        email: Optional[str] = payload.get("sub") # Hacer email opcional temporalmente
-        if email is None:
-            print("DEBUG: JWT payload no contiene 'sub' (email)")
-            raise credentials_exception
-        # Validar con el esquema TokenData
-        try:
-            token_data = TokenData(email=email)
-        except ValidationError as e:
-             print(f"DEBUG: Error de validación de TokenData: {e}")
-             raise credentials_exception
 
+def decode_token(token: str, expected_type: str = ACCESS_TOKEN_TYPE) -> Dict[str, Any]:
+    """
+    Decodifica y valida un JWT del tipo esperado. Lanza 401 si no es válido.
+    Los tokens antiguos sin 'typ' se tratan como access tokens.
+    """
+    try:
+        with timed(CRYPTO):
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
     except JWTError as e:
         print(f"DEBUG: Error al decodificar JWT: {e}")
-        raise credentials_exception
+        raise _credentials_exception()
+
+    if payload.get("typ", ACCESS_TOKEN_TYPE) != expected_type:
+        print(f"DEBUG: Tipo de token inesperado: {payload.get('typ')} (esperado: {expected_type})")
+        raise _credentials_exception()
+    if payload.get("sub") is None:
+        print("DEBUG: JWT payload no contiene 'sub' (email)")
+        raise _credentials_exception()
+    return payload
+
+# --- Dependencia para Obtener Usuario Actual ---
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+    """
+    Dependencia para obtener el usuario actual basado en el token JWT.
+    Decodifica el token, valida los datos y obtiene el usuario de la BD.
+    """
+    credentials_exception = _credentials_exception()
+    payload = decode_token(token, ACCESS_TOKEN_TYPE)
+    email: Optional[str] = payload.get("sub")
+    # Validar con el esquema TokenData
+    try:
+        token_data = TokenData(email=email)
+    except ValidationError as e:
+         print(f"DEBUG: Error de validación de TokenData: {e}")
+         raise credentials_exception
 
     user = db.query(User).filter(User.email == email).first()
     if user is None:
         print(f"DEBUG: Usuario no encontrado en BD para email: {email}")
         raise credentials_exception
+
+    # Rechazar tokens emitidos con un perfil anterior a la última actualización
+    current_version = user.profile_version or 0
+    await note_profile_version(user.id, current_version)
+    token_version = payload.get("ver")
+    if token_version is not None and token_version < current_version:
+        print(f"DEBUG: Token con versión de perfil obsoleta para usuario {user.id}")
+        raise _credentials_exception("Token profile version is stale")
     # print(f"DEBUG: Usuario autenticado: {user.email}") # Línea de depuración opcional
     return user
 
+# --- Dependencia Ligera: Principal desde el Token (sin BD) ---
+
+async def get_token_principal(token: str = Depends(oauth2_scheme)) -> TokenPrincipal:
+    """
+    Construye un principal de sólo lectura a partir del access token, sin consultar la BD.
+    Usar sólo en endpoints que leen el perfil; para escribir, usar get_current_user.
+    """
+    payload = decode_token(token, ACCESS_TOKEN_TYPE)
+    profile = payload.get("profile")
+    user_id = payload.get("uid")
+    version = payload.get("ver")
+    if not isinstance(profile, dict) or user_id is None or version is None:
+        # Token antiguo sin claim de perfil: el cliente debe refrescarlo
+        print("DEBUG: Access token sin claim de perfil; se requiere refresh.")
+        raise _credentials_exception()
+    if not await is_profile_version_current(user_id, version):
+        print(f"DEBUG: Token con versión de perfil obsoleta para usuario {user_id}")
+        raise _credentials_exception("Token profile version is stale")
+    try:
+        return TokenPrincipal(id=user_id, email=payload["sub"], version=version, exp=payload.get("exp"), **profile)
+    except ValidationError as e:
+        print(f"DEBUG: Claim de perfil inválido en el token: {e}")
+        raise _credentials_exception()
+
 # --- Funciones de Encriptación (para Plaid Token) ---
 # Asegúrate de que ENCRYPTION_KEY sea una clave válida generada por Fernet.generate_key()
 # y codificada en base64 url-safe.
@@ -106,7 +245,8 @@ def encrypt_data(data: str) -> Optional[bytes]:
     """Encripta datos de tipo string usando la clave Fernet."""
     if fernet and isinstance(data, str):
         try:
-            return fernet.encrypt(data.encode('utf-8'))
+            with timed(CRYPTO):
+                return fernet.encrypt(data.encode('utf-8'))
         except Exception as e:
             print(f"Error al encriptar datos: {e}")
             return None
@@ -118,7 +258,8 @@ def decrypt_data(encrypted_data: bytes) -> Optional[str]:
     """Desencripta datos usando la clave Fernet y devuelve un string."""
     if fernet and isinstance(encrypted_data, bytes):
         try:
-            return fernet.decrypt(encrypted_data).decode('utf-8')
+            with timed(CRYPTO):
+                return fernet.decrypt(encrypted_data).decode('utf-8')
         except Exception as e: # Captura errores de desencriptación (ej. token inválido, padding incorrecto)
             print(f"Error al desencriptar datos: {e}")
             return None
@@ -0,0 +1,83 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# --- Single-Flight ---
+# Colapsa las llamadas concurrentes con la misma clave en una única ejecución: la primera
+# (líder) ejecuta la función y las demás esperan su mismo resultado (o excepción).
+# Con un espacio de nombres de la caché compartida, el resultado se reutiliza además durante
+# su TTL (breve) después de terminar. El resultado es compartido: no debe modificarse.
+# El colapso es por proceso; la caché posterior es la del backend configurado (ver core/cache.py).
+
+_MISSING = object()
+
+
+class SingleFlight:
+
+    def __init__(self, name: str, namespace=None):
+        self.name = name
+        self.namespace = namespace # CacheNamespace opcional para cachear el resultado
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Contadores por proceso
+        self.leaders = 0
+        self.shared = 0
+
+    async def forget(self, key: str) -> None:
+        """Descarta el resultado cacheado de 'key' (la ejecución en curso, si la hay, sigue)."""
+        if self.namespace is not None:
+            await self.namespace.adelete(key)
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        cache_if: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """
+        Devuelve el resultado de 'fn' para 'key', compartiendo la ejecución en curso si la hay.
+
+        Args:
+            cache_if: si se indica, sólo se cachean los resultados para los que devuelve True
+                      (ej. no cachear un resultado parcial).
+        """
+        while True:
+            if self.namespace is not None:
+                cached = await self.namespace.aget(key, _MISSING)
+                if cached is not _MISSING:
+                    return cached
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.shared += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise # Se canceló esta petición, no la ejecución compartida
+                # La petición líder se canceló (ej. cliente desconectado): otra toma el relevo
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.leaders += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # Marcar como recuperada si nadie más la esperaba
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                self._inflight.pop(key, None)
+
+        # Resolver antes de escribir en la caché: la escritura puede esperar (backend compartido, en
+        # un hilo) y si el líder se cancela ahí, quienes esperan su resultado no deben quedarse colgados
+        future.set_result(result)
+        if self.namespace is not None and (cache_if is None or cache_if(result)):
+            await self.namespace.aset(key, result)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {"leaders": self.leaders, "shared": self.shared, "in_flight": len(self._inflight)}
@@ -0,0 +1,217 @@
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .config import settings
+
+# --- Desglose de Tiempos por Petición (Server-Timing) ---
+# Cada petición crea un acumulador en una ContextVar. El código instrumentado suma su duración
+# al componente correspondiente con 'timed(...)'; asyncio.to_thread y el threadpool de Starlette
+# copian el contexto, así que también cuentan las llamadas síncronas hechas en hilos.
+# Al enviar la respuesta se emite la cabecera estándar Server-Timing (visible en las devtools):
+#   Server-Timing: db;dur=12.4;desc="n=3", crypto;dur=0.9;desc="n=1", total;dur=48.2
+# Componentes: db (SQLAlchemy), plaid (SDK de Plaid), inference (Hugging Face),
+# crypto (JWT, Fernet, bcrypt) y serialization (validación y render de la respuesta).
+# Las llamadas concurrentes (ej. varios Items de Plaid en paralelo) suman su duración completa.
+
+DB = "db"
+PLAID = "plaid"
+INFERENCE = "inference"
+CRYPTO = "crypto"
+SERIALIZATION = "serialization"
+
+DEBUG_HEADER = b"x-debug-timing"
+
+
+class RequestTimings:
+    """Duración acumulada y número de llamadas por componente (seguro entre hilos)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._components: Dict[str, List[float]] = {}
+
+    def add(self, component: str, seconds: float) -> None:
+        with self._lock:
+            entry = self._components.setdefault(component, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def snapshot(self) -> Dict[str, Tuple[float, int]]:
+        """{componente: (milisegundos, llamadas)}."""
+        with self._lock:
+            return {name: (seconds * 1000, count) for name, (seconds, count) in self._components.items()}
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+
+_current: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("request_timings", default=None)
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current.get()
+
+@contextmanager
+def timed(component: str):
+    """
+    Suma la duración del bloque al componente en la petición actual (sin petición, no hace nada).
+    También sirve como decorador de funciones síncronas: @timed(CRYPTO).
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(component, time.perf_counter() - started)
+
+
+# --- Instrumentación de Librerías ---
+
+def instrument_engine(engine: Engine) -> None:
+    """Cuenta el tiempo de cada sentencia SQL (desde que se envía hasta que el cursor responde)."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("timing_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("timing_started")
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        timings = _current.get()
+        if timings is not None:
+            timings.add(DB, elapsed)
+
+def instrument_plaid_client(api_client) -> None:
+    """Todas las llamadas del SDK de Plaid pasan por ApiClient.call_api."""
+    api_client.call_api = timed(PLAID)(api_client.call_api)
+
+def instrument_serialization() -> None:
+    """
+    Cuenta la validación/serialización del response_model que hace FastAPI.
+    FastAPI resuelve serialize_response como global del módulo en cada petición, así que
+    basta con envolverla una vez al arrancar. El render JSON lo cuenta TimedJSONResponse.
+    """
+    import fastapi.routing
+
+    original = fastapi.routing.serialize_response
+    if getattr(original, "_timed", False):
+        return
+
+    async def serialize_response(*args, **kwargs):
+        with timed(SERIALIZATION):
+            return await original(*args, **kwargs)
+
+    serialize_response._timed = True
+    fastapi.routing.serialize_response = serialize_response
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse que suma el render (json.dumps) al componente de serialización."""
+
+    def render(self, content) -> bytes:
+        with timed(SERIALIZATION):
+            return super().render(content)
+
+
+# --- Middleware ASGI ---
+
+def server_timing_header(timings: RequestTimings) -> str:
+    metrics = [
+        f'{name};dur={ms:.1f};desc="n={count}"'
+        for name, (ms, count) in sorted(timings.snapshot().items())
+    ]
+    metrics.append(f"total;dur={timings.elapsed_ms():.1f}")
+    return ", ".join(metrics)
+
+def debug_field(timings: RequestTimings) -> Dict[str, object]:
+    return {
+        "total_ms": round(timings.elapsed_ms(), 2),
+        "components": {
+            name: {"ms": round(ms, 2), "calls": count}
+            for name, (ms, count) in sorted(timings.snapshot().items())
+        },
+    }
+
+def _header(headers: Iterable[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+class ServerTimingMiddleware:
+    """
+    Crea el acumulador de cada petición y añade Server-Timing a la respuesta.
+
+    Con SERVER_TIMING_DEBUG, una petición con 'X-Debug-Timing: 1' recibe además el desglose como
+    campo '_timing' dentro de la respuesta JSON (sólo objetos JSON enviados en un único bloque).
+    Timing-Allow-Origin permite leer los tiempos desde los orígenes del frontend.
+    """
+
+    def __init__(self, app, allowed_origins: Iterable[str] = ()):
+        self.app = app
+        self.allowed_origins = {origin.encode("latin-1") for origin in allowed_origins}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        request_headers = scope.get("headers", [])
+        origin = _header(request_headers, b"origin")
+        debug = settings.SERVER_TIMING_DEBUG and _header(request_headers, DEBUG_HEADER) in (b"1", b"true")
+        pending_start = None
+
+        def with_timing_headers(message, content_length: Optional[int] = None):
+            headers = [
+                (key, value) for key, value in message.get("headers", [])
+                if content_length is None or key.lower() != b"content-length"
+            ]
+            if content_length is not None:
+                headers.append((b"content-length", str(content_length).encode("latin-1")))
+            headers.append((b"server-timing", server_timing_header(timings).encode("latin-1")))
+            if origin is not None and origin in self.allowed_origins:
+                headers.append((b"timing-allow-origin", origin))
+            return {**message, "headers": headers}
+
+        async def send_wrapper(message):
+            nonlocal pending_start
+            if message["type"] == "http.response.start":
+                if debug:
+                    pending_start = message # Se envía junto al cuerpo, con el campo _timing
+                    return
+                await send(with_timing_headers(message))
+                return
+            if pending_start is not None and message["type"] == "http.response.body":
+                start, pending_start = pending_start, None
+                body = message.get("body", b"")
+                content_type = _header(start.get("headers", []), b"content-type") or b""
+                if content_type.startswith(b"application/json") and not message.get("more_body") and body[:1] == b"{":
+                    payload = json.loads(body)
+                    payload["_timing"] = debug_field(timings)
+                    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+                    message = {**message, "body": body}
+                    await send(with_timing_headers(start, len(body)))
+                else:
+                    await send(with_timing_headers(start))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
@@ -0,0 +1,56 @@
+"""
+Workers de la cola persistente de categorización (proceso aparte de la API):
+
+    python -m app.jobs.categorization_worker                  # procesar hasta Ctrl+C / SIGTERM
+    python -m app.jobs.categorization_worker --concurrency 8  # workers async en este proceso
+    python -m app.jobs.categorization_worker --once           # vaciar la cola y terminar
+    python -m app.jobs.categorization_worker --stats          # trabajos por estado
+    python -m app.jobs.categorization_worker --requeue-dead   # reintentar los trabajos en 'dead'
+
+Desde la carpeta 'backend', con las mismas variables de entorno que la API.
+Se pueden lanzar varios procesos (en uno o varios hosts) contra la misma base de datos.
+"""
+import argparse
+import asyncio
+import signal
+
+from app.core.config import settings
+from app.services.categorization_queue import queue_stats, requeue_dead, run_worker_pool
+
+
+async def _run(concurrency: int, batch_size: int, once: bool) -> int:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass # Windows: Ctrl+C interrumpe con KeyboardInterrupt
+    return await run_worker_pool(concurrency, stop, batch_size=batch_size, once=once)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Workers de la cola de categorización de transacciones.")
+    parser.add_argument("--concurrency", type=int, default=settings.CATEGORIZATION_WORKERS,
+                        help="Workers async en este proceso.")
+    parser.add_argument("--batch-size", type=int, default=settings.CATEGORIZATION_BATCH_SIZE,
+                        help="Trabajos reclamados a la vez por cada worker.")
+    parser.add_argument("--once", action="store_true", help="Terminar cuando la cola quede vacía.")
+    parser.add_argument("--stats", action="store_true", help="Mostrar los trabajos por estado y salir.")
+    parser.add_argument("--requeue-dead", action="store_true", help="Reencolar los trabajos en 'dead' y salir.")
+    args = parser.parse_args()
+
+    if args.requeue_dead:
+        print(f"Trabajos reencolados: {requeue_dead()}.")
+        return
+    if args.stats:
+        for status, count in sorted(queue_stats().items()):
+            print(f"{status}: {count}")
+        return
+
+    processed = asyncio.run(_run(args.concurrency, args.batch_size, args.once))
+    print(f"Workers de categorización detenidos: {processed} trabajos procesados.")
+
+
+if __name__ == "__main__":
+    main()
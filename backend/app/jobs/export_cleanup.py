@@ -0,0 +1,20 @@
+"""
+Mantenimiento de las exportaciones en segundo plano (ejecutar periódicamente, ej. cada hora con cron):
+
+    python -m app.jobs.export_cleanup
+
+Marca como fallidos los trabajos interrumpidos por un reinicio y borra los archivos (y sus
+trabajos) terminados hace más de EXPORT_RETENTION_SECONDS. Cada worker de la API lo hace
+también al arrancar.
+Desde la carpeta 'backend', con las mismas variables de entorno que la API.
+"""
+from app.services.export_service import maintain_jobs
+
+
+def main() -> None:
+    recovered, removed = maintain_jobs()
+    print(f"Mantenimiento de exportaciones terminado: {recovered} trabajos recuperados, {removed} borrados.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+Mantenimiento periódico de la tabla de transacciones (ejecutar a diario, ej. con cron):
+
+    python -m app.jobs.transaction_retention            # crear particiones futuras + archivar
+    python -m app.jobs.transaction_retention --dry-run  # sólo mostrar qué se archivaría
+
+Desde la carpeta 'backend', con las mismas variables de entorno que la API.
+"""
+import argparse
+
+from app.core.config import settings
+from app.services.partition_maintenance import archive_old_partitions, ensure_future_partitions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Particiones y retención de la tabla de transacciones.")
+    parser.add_argument("--months-ahead", type=int, default=settings.TRANSACTION_PARTITION_MONTHS_AHEAD,
+                        help="Meses futuros con partición ya creada (PostgreSQL).")
+    parser.add_argument("--retention-months", type=int, default=settings.TRANSACTION_RETENTION_MONTHS,
+                        help="Meses de histórico que se conservan en la base de datos.")
+    parser.add_argument("--archive-dir", default=settings.TRANSACTION_ARCHIVE_DIR,
+                        help="Carpeta de los archivos comprimidos con las transacciones archivadas.")
+    parser.add_argument("--dry-run", action="store_true", help="No modifica nada; sólo informa.")
+    args = parser.parse_args()
+
+    if not args.dry_run:
+        ensure_future_partitions(args.months_ahead)
+    archived = archive_old_partitions(args.retention_months, args.archive_dir, dry_run=args.dry_run)
+    print(f"Mantenimiento de transacciones terminado: {archived} filas archivadas.")
+
+
+if __name__ == "__main__":
+    main()
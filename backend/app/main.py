@@ -1,14 +1,61 @@
+import asyncio
+import gc
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 # Importar routers
-from .routers import auth, users, plaid, dashboard, investment # <<<--- IMPORTAR ROUTER INVESTMENT
+from .routers import auth, users, plaid, dashboard, investment, export, health, budgets # <<<--- IMPORTAR ROUTER INVESTMENT
 # from .routers import ia # Rutas relativas a 'app'
+from .core.config import settings
+from .core.loop_watchdog import LoopWatchdogMiddleware, loop_watchdog
+from .core.profiling import ProfilingMiddleware
+from .core.timing import ServerTimingMiddleware, TimedJSONResponse, instrument_engine, instrument_serialization
+from .db.database import engine
+from .services.categorization_queue import run_worker_pool
+from .services.export_service import maintain_jobs as maintain_export_jobs
+from .services.live_updates import change_poller
+from .services.warmup import readiness, start_warmup
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Arranque y apagado de cada worker.
+    - Calentamiento (WARMUP_ENABLED) en segundo plano: /readyz responde 503 ("starting") hasta que
+      termina y vuelve a 503 ("draining") al empezar el apagado, para que el balanceador no envíe
+      peticiones a un worker frío ni a uno que se está apagando.
+    - Mantenimiento de las exportaciones en segundo plano (ver export_service.maintain_jobs).
+    - Sondeo de los cambios hechos en otros procesos para /dashboard/stream (ver live_updates).
+    - Con CATEGORIZATION_API_WORKERS > 0, el worker ejecuta también workers de la cola
+      de categorización (despliegues pequeños). Por defecto se lanzan aparte:
+      python -m app.jobs.categorization_worker
+    """
+    warming = start_warmup(settings.WARMUP_ENABLED)
+    # Trabajos de exportación que quedaron a medias en un reinicio y archivos caducados
+    maintenance = asyncio.ensure_future(asyncio.to_thread(maintain_export_jobs))
+    stop = asyncio.Event()
+    changes = asyncio.ensure_future(change_poller.run(stop))
+    workers = None
+    if settings.CATEGORIZATION_API_WORKERS > 0:
+        workers = asyncio.ensure_future(run_worker_pool(settings.CATEGORIZATION_API_WORKERS, stop))
+    try:
+        yield
+    finally:
+        readiness.mark_draining()
+        warming.cancel()
+        stop.set()
+        await changes
+        if workers is not None:
+            await workers
 
 # Crear la instancia de la aplicación FastAPI
 app = FastAPI(
     title="NexusMC AI API",
     description="API para la plataforma NexusMC AI - MVP",
     version="0.1.0", # Versión inicial
+    default_response_class=TimedJSONResponse, # El render JSON cuenta como 'serialization' en Server-Timing
+    lifespan=lifespan,
 )
 
 # Configuración de CORS (Cross-Origin Resource Sharing)
@@ -30,6 +77,21 @@ app.add_middleware(
     allow_headers=["*"],    # Permite todas las cabeceras HTTP
 )
 
+# Perfilado bajo demanda (cabecera X-Profile-Token) y muestreo continuo opcional.
+# Desactivado por defecto: sin PROFILING_ENABLED ni PROFILING_CONTINUOUS no añade ningún coste por petición.
+if settings.PROFILING_ENABLED or settings.PROFILING_CONTINUOUS:
+    app.add_middleware(ProfilingMiddleware)
+
+# Desglose de tiempos (db, plaid, inference, crypto, serialization) en la cabecera Server-Timing
+if settings.SERVER_TIMING_ENABLED:
+    instrument_engine(engine)
+    instrument_serialization()
+    app.add_middleware(ServerTimingMiddleware, allowed_origins=origins)
+
+# Detección de bloqueos del event loop (pila y ruta del código síncrono que lo retiene)
+if settings.LOOP_WATCHDOG_ENABLED:
+    app.add_middleware(LoopWatchdogMiddleware, watchdog=loop_watchdog)
+
 # --- Incluir Routers --- 
 # Asegúrate de que los archivos de router existan en app/routers/
 app.include_router(auth.router, prefix="/auth", tags=["Auth"])
@@ -37,6 +99,9 @@ app.include_router(users.router, prefix="/users", tags=["Users"])
 app.include_router(plaid.router, prefix="/plaid", tags=["Plaid"])
 app.include_router(dashboard.router, prefix="/dashboard", tags=["Dashboard"])
 app.include_router(investment.router, prefix="/investment", tags=["Investment"]) # <<<--- ACTIVAR ESTA LÍNEA
+app.include_router(export.router, prefix="/export", tags=["Export"])
+app.include_router(budgets.router, prefix="/budgets", tags=["Budgets"])
+app.include_router(health.router, tags=["Health"]) # /healthz y /readyz
 # app.include_router(ia.router, prefix="/ia", tags=["AI"])
 
 
@@ -53,4 +118,20 @@ async def read_root():
 # uvicorn app.main:app --reload --host 0.0.0.0 --port 8000
 # --reload: Reinicia automáticamente al guardar cambios.
 # --host 0.0.0.0: Permite acceso desde fuera de localhost (útil para emulador/dispositivo físico).
-# --port 8000: Puerto estándar para APIs.
\ No newline at end of file
+# --port 8000: Puerto estándar para APIs.
+#
+# --- Producción: Workers Pre-fork con Preload ---
+# gunicorn app.main:app -k uvicorn.workers.UvicornWorker --workers 4 --preload --bind 0.0.0.0:8000
+# Con --preload el proceso maestro importa la aplicación una sola vez y luego hace fork de los
+# workers: las estructuras de sólo lectura creadas al importar (catálogo de fondos y sus índices,
+# reglas de categorización compiladas, rutas, esquemas de Pydantic) se comparten copy-on-write
+# entre todos los workers en lugar de duplicarse por cada uno. El índice kNN ya es un memory-map
+# del archivo: sus páginas las comparte el page cache con o sin preload.
+# Lo que no puede compartirse entre procesos (conexiones de la BD, clientes HTTP, sockets de la
+# caché) se abre en el lifespan de cada worker, después del fork (ver app/services/warmup.py).
+# uvicorn --workers no hace preload: cada worker importa la aplicación por su cuenta.
+# Sin --preload este bloque no tiene efecto práctico.
+
+# Los objetos creados al importar no se liberan nunca: sacarlos del recolector cíclico evita que
+# sus pasadas escriban en sus cabeceras y rompan el copy-on-write de las páginas compartidas.
+gc.freeze()
\ No newline at end of file
@@ -0,0 +1,90 @@
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class Budget(Base):
+    """Presupuesto de un usuario para una categoría y un periodo (mes o semana)."""
+    __tablename__ = "budgets"
+    __table_args__ = (
+        UniqueConstraint("user_id", "category", "period", name="uq_budgets_user_category_period"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    category = Column(String, nullable=False)
+    period = Column(String, nullable=False, default="month") # month o week
+    amount = Column(Float, nullable=False) # Límite del periodo, en 'currency'
+    currency = Column(String(3), nullable=False) # Los gastos se convierten a ella con el tipo del día
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    rules = relationship("BudgetAlertRule", cascade="all, delete-orphan", lazy="selectin")
+
+    def __repr__(self):
+        return f"<Budget(id={self.id}, user_id={self.user_id}, category='{self.category}', period='{self.period}')>"
+
+
+class BudgetAlertRule(Base):
+    """Umbral de alerta de un presupuesto, como fracción del límite (ej. 0.8 = al 80%)."""
+    __tablename__ = "budget_alert_rules"
+    __table_args__ = (
+        UniqueConstraint("budget_id", "threshold", name="uq_budget_alert_rules_budget_threshold"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    budget_id = Column(Integer, ForeignKey("budgets.id", ondelete="CASCADE"), nullable=False)
+    threshold = Column(Float, nullable=False)
+
+    def __repr__(self):
+        return f"<BudgetAlertRule(budget_id={self.budget_id}, threshold={self.threshold})>"
+
+
+class BudgetPeriodTotal(Base):
+    """
+    Total acumulado de un presupuesto en un periodo concreto (en la divisa del presupuesto).
+    Se incrementa con cada lote de transacciones aplicadas; nunca se recalcula desde el histórico.
+    """
+    __tablename__ = "budget_period_totals"
+
+    budget_id = Column(Integer, ForeignKey("budgets.id", ondelete="CASCADE"), primary_key=True)
+    period_start = Column(Date, primary_key=True) # Lunes de la semana o día 1 del mes
+    total = Column(Float, nullable=False, default=0.0)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<BudgetPeriodTotal(budget_id={self.budget_id}, period_start={self.period_start}, total={self.total:.2f})>"
+
+
+class AlertOutbox(Base):
+    """
+    Alerta disparada, pendiente de entregar (outbox): se escribe en la misma transacción que
+    actualiza los totales, y un consumidor la entrega después y rellena 'dispatched_at'.
+    Cada umbral se dispara como mucho una vez por presupuesto y periodo.
+    """
+    __tablename__ = "alert_outbox"
+    __table_args__ = (
+        UniqueConstraint("budget_id", "period_start", "threshold", name="uq_alert_outbox_budget_period_threshold"),
+        Index("ix_alert_outbox_user_id_created_at", "user_id", "created_at"),
+        Index("ix_alert_outbox_dispatched_at", "dispatched_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    budget_id = Column(Integer, ForeignKey("budgets.id", ondelete="CASCADE"), nullable=False)
+
+    kind = Column(String, nullable=False, default="budget_threshold")
+    category = Column(String, nullable=False)
+    period_start = Column(Date, nullable=False)
+    threshold = Column(Float, nullable=False)
+    spent = Column(Float, nullable=False) # Total del periodo al dispararse
+    budget_amount = Column(Float, nullable=False)
+    currency = Column(String(3), nullable=False)
+    message = Column(String, nullable=False)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    dispatched_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<AlertOutbox(id={self.id}, budget_id={self.budget_id}, threshold={self.threshold})>"
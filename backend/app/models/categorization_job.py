@@ -0,0 +1,33 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class CategorizationJob(Base):
+    """
+    Trabajo de la cola de categorización: una transacción pendiente de categorizar.
+    Los workers lo reclaman (FOR UPDATE SKIP LOCKED en PostgreSQL), lo procesan y lo marcan
+    como 'done'; tras CATEGORIZATION_MAX_ATTEMPTS fallos pasa a 'dead' (dead-letter).
+    """
+    __tablename__ = "categorization_jobs"
+    __table_args__ = (
+        Index("ix_categorization_jobs_status_available_at", "status", "available_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    # Sin FK a transactions: con particiones su PK es (transaction_id, date); los mocks tampoco se guardan
+    transaction_id = Column(String, nullable=False, unique=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    name = Column(String, nullable=False) # Descripción que se categoriza
+
+    status = Column(String, nullable=False, default="pending") # pending, running, done, dead
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now()) # Próximo intento (backoff)
+    locked_at = Column(DateTime(timezone=True), nullable=True)
+    locked_by = Column(String, nullable=True) # Worker que lo tiene reclamado
+    last_error = Column(String, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<CategorizationJob(id={self.id}, transaction_id='{self.transaction_id}', status='{self.status}')>"
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class DashboardChange(Base):
+    """
+    Versión de los datos del dashboard de un usuario: se incrementa al guardar transacciones,
+    categorías o presupuestos desde cualquier proceso (API o workers de la cola de categorización).
+    Los procesos con conexiones de /dashboard/stream abiertas la sondean (services/live_updates.py).
+    """
+    __tablename__ = "dashboard_changes"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    version = Column(Integer, nullable=False, default=1)
+    reason = Column(String, nullable=False) # transactions, categories o budgets (último cambio)
+
+    changed_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<DashboardChange(user_id={self.user_id}, version={self.version}, reason='{self.reason}')>"
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class ExportJob(Base):
+    """Exportación de transacciones ejecutada en segundo plano; el archivo resultante se descarga después."""
+    __tablename__ = "export_jobs"
+
+    id = Column(String, primary_key=True) # UUID hex
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    format = Column(String, nullable=False) # csv o parquet
+    status = Column(String, nullable=False, default="pending") # pending, running, done, failed
+    file_path = Column(String, nullable=True)
+    rows = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Latido: run_job lo actualiza en cada lote; sin latido reciente el trabajo se da por perdido
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<ExportJob(id='{self.id}', user_id={self.user_id}, status='{self.status}')>"
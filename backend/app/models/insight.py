@@ -0,0 +1,80 @@
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class CategoryStats(Base):
+    """
+    Estadísticas incrementales (Welford) del gasto de un usuario en una categoría.
+    Se actualizan al llegar cada transacción; nunca se recalculan desde el histórico.
+    """
+    __tablename__ = "category_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    category = Column(String, primary_key=True)
+
+    # Importe por transacción: n, media y suma de cuadrados de diferencias (M2)
+    count = Column(Integer, nullable=False, default=0)
+    mean = Column(Float, nullable=False, default=0.0)
+    m2 = Column(Float, nullable=False, default=0.0)
+
+    # Total del mes en curso y estadísticas de los meses ya cerrados
+    current_month = Column(Date, nullable=True)
+    current_month_total = Column(Float, nullable=False, default=0.0)
+    months = Column(Integer, nullable=False, default=0)
+    month_mean = Column(Float, nullable=False, default=0.0)
+    month_m2 = Column(Float, nullable=False, default=0.0)
+    # Medias móviles exponenciales de los totales mensuales (rápida vs. lenta) para detectar tendencias
+    month_ewma_fast = Column(Float, nullable=False, default=0.0)
+    month_ewma_slow = Column(Float, nullable=False, default=0.0)
+
+    # Último gasto anómalo detectado al actualizar (z-score respecto a la media previa)
+    last_spike_date = Column(Date, nullable=True)
+    last_spike_amount = Column(Float, nullable=True)
+    last_spike_z = Column(Float, nullable=True)
+
+    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<CategoryStats(user_id={self.user_id}, category='{self.category}', count={self.count})>"
+
+
+class MerchantStats(Base):
+    """Estadísticas incrementales por comercio: importe e intervalo entre cargos (para cargos recurrentes)."""
+    __tablename__ = "merchant_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    merchant = Column(String, primary_key=True) # Nombre normalizado (normalize_merchant_name)
+    category = Column(String, nullable=True)
+
+    count = Column(Integer, nullable=False, default=0)
+    amount_mean = Column(Float, nullable=False, default=0.0)
+    amount_m2 = Column(Float, nullable=False, default=0.0)
+
+    intervals = Column(Integer, nullable=False, default=0) # Días entre cargos consecutivos
+    interval_mean = Column(Float, nullable=False, default=0.0)
+    interval_m2 = Column(Float, nullable=False, default=0.0)
+
+    first_seen = Column(Date, nullable=False)
+    last_seen = Column(Date, nullable=False)
+
+    def __repr__(self):
+        return f"<MerchantStats(user_id={self.user_id}, merchant='{self.merchant}', count={self.count})>"
+
+
+class UserInsight(Base):
+    """Insight de ahorro precalculado: el dashboard sólo lee esta tabla."""
+    __tablename__ = "user_insights"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    kind = Column(String, nullable=False) # spike, recurring, trend, top_category
+    category = Column(String, nullable=True)
+    message = Column(String, nullable=False)
+    score = Column(Float, nullable=False) # Mayor = más relevante
+    relevant_until = Column(Date, nullable=True) # Deja de mostrarse después de esta fecha
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<UserInsight(user_id={self.user_id}, kind='{self.kind}', score={self.score:.2f})>"
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, DateTime, LargeBinary, ForeignKey
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class PlaidItem(Base):
+    """Un Item de Plaid (una institución enlazada). Un usuario puede tener varios."""
+    __tablename__ = "plaid_items"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    # Identificador del Item en Plaid y su access_token encriptado con Fernet
+    item_id = Column(String, unique=True, index=True, nullable=False)
+    access_token_encrypted = Column(LargeBinary, nullable=False)
+
+    # Timestamps
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+    owner = relationship("User", back_populates="plaid_items")
+
+    def __repr__(self):
+        return f"<PlaidItem(id={self.id}, user_id={self.user_id}, item_id='{self.item_id}')>"
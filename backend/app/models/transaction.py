@@ -0,0 +1,54 @@
+from sqlalchemy import Column, Integer, String, DateTime, Date, Float, Boolean, ForeignKey, Index
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class TransactionCategory(Base):
+    """Categoría asignada a una transacción de Plaid (por el modelo o por reglas locales)."""
+    __tablename__ = "transaction_categories"
+
+    transaction_id = Column(String, primary_key=True) # transaction_id de Plaid
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    name = Column(String, nullable=False) # Descripción categorizada (PlaidTransaction.name)
+    category = Column(String, nullable=False)
+    source = Column(String, nullable=False, default="model") # 'model' o 'local'
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<TransactionCategory(transaction_id='{self.transaction_id}', category='{self.category}')>"
+
+
+class Transaction(Base):
+    """
+    Transacción de Plaid persistida: histórico sobre el que se calculan las tendencias de gasto.
+    En PostgreSQL la tabla está particionada por mes de 'date' (PK real: transaction_id + date,
+    índice BRIN sobre 'date'); ver migración f1c9a2d4b637 y services/partition_maintenance.py.
+    """
+    __tablename__ = "transactions"
+
+    transaction_id = Column(String, primary_key=True) # transaction_id de Plaid
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    item_id = Column(String, nullable=True)
+    account_id = Column(String, nullable=False)
+
+    date = Column(Date, nullable=False)
+    name = Column(String, nullable=False)
+    amount = Column(Float, nullable=False) # Positivo = gasto, negativo = ingreso (convención de Plaid)
+    iso_currency_code = Column(String(3), nullable=True)
+    pending = Column(Boolean, nullable=False, default=False)
+    # True cuando la transacción (ya categorizada) se ha sumado a las estadísticas de insights
+    stats_applied = Column(Boolean, nullable=False, default=False)
+    # Valores con los que se aplicó (para restarlos si Plaid la elimina o cambia su importe o fecha)
+    applied_date = Column(Date, nullable=True)
+    applied_amount = Column(Float, nullable=True)
+    applied_currency = Column(String(3), nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+    # Las agregaciones siempre filtran por usuario y rango de fechas
+    __table_args__ = (Index("ix_transactions_user_id_date", "user_id", "date"),)
+
+    def __repr__(self):
+        return f"<Transaction(transaction_id='{self.transaction_id}', date={self.date}, amount={self.amount})>"
@@ -2,6 +2,7 @@ from sqlalchemy import Column, Integer, String, Boolean, DateTime, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func # Para valores por defecto como now()
 from app.db.database import Base
+from app.models.plaid_item import PlaidItem # Registrar el modelo para la relación 'plaid_items'
 # import uuid # Descomentar si usas UUID
 # from sqlalchemy.dialects.postgresql import UUID # Específico para PostgreSQL UUID
 
@@ -18,8 +19,12 @@ class User(Base):
     age = Column(Integer, nullable=True)
     primary_goal = Column(String, nullable=True)
     esg_interest = Column(Boolean, default=False, nullable=False)
+    # Contador que sube en cada actualización del perfil: versión de los access tokens emitidos
+    profile_version = Column(Integer, nullable=False, default=0, server_default="0")
 
-    # Campos Plaid
+    # Campos Plaid (legado: un solo Item por usuario)
+    # Los Items enlazados viven ahora en la tabla 'plaid_items'; estas columnas ya no se escriben
+    # y se conservan sólo para no perder datos de instalaciones anteriores a la migración.
     plaid_access_token_encrypted = Column(LargeBinary, nullable=True) # Almacena bytes encriptados
     plaid_item_id = Column(String, nullable=True, index=True)
 
@@ -27,8 +32,8 @@ class User(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
 
-    # Ejemplo relación (si hubiera una tabla 'items'):
-    # items = relationship("Item", back_populates="owner")
+    # Items de Plaid enlazados (varias instituciones por usuario)
+    plaid_items = relationship("PlaidItem", back_populates="owner", cascade="all, delete-orphan")
 
     def __repr__(self):
         return f"<User(id={self.id}, email='{self.email}')>"
\ No newline at end of file
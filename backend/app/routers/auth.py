@@ -52,7 +52,7 @@ async def register_user(user: schemas.user.UserCreate, db: Session = Depends(get
 @router.post("/token", response_model=schemas.token.Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """
-    Autentica al usuario y devuelve un token JWT.
+    Autentica al usuario y devuelve un access token JWT y un refresh token.
     FastAPI espera que el cliente envíe 'username' y 'password' en un form-data.
     Usaremos el 'username' como el email.
     """
@@ -68,10 +68,23 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    # Crear el token de acceso
-    access_token = security.create_access_token(
-        data={"sub": user.email} # Usar email como 'subject' del token
-        # expires_delta puede ser omitido para usar el default de settings
-    )
+    # Crear el par de tokens: access (con perfil versionado) + refresh
+    # El access token expira según ACCESS_TOKEN_EXPIRE_MINUTES (default de settings)
+    return await security.create_user_tokens(user)
 
-    return {"access_token": access_token, "token_type": "bearer"} 
\ No newline at end of file
+# --- Endpoint de Refresh (Nuevo Par de Tokens) ---
+@router.post("/refresh", response_model=schemas.token.Token)
+async def refresh_access_token(request_body: schemas.token.RefreshTokenRequest, db: Session = Depends(get_db)):
+    """
+    Intercambia un refresh token válido por un nuevo par access/refresh.
+    El nuevo access token lleva el perfil actual (p.ej. tras un PUT /users/me).
+    """
+    payload = security.decode_token(request_body.refresh_token, security.REFRESH_TOKEN_TYPE)
+    user = db.query(models.user.User).filter(models.user.User.email == payload["sub"]).first()
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return await security.create_user_tokens(user)
@@ -0,0 +1,97 @@
+import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from typing import List
+
+# Importaciones relativas
+from .. import schemas
+from ..schemas.budget import BudgetAlertRead, BudgetCreate, BudgetRead
+from ..db.database import get_db
+from ..core.security import get_token_principal
+from ..models.budget import Budget
+from ..services import budget_service
+from ..services.analytics_service import NON_SPENDING_CATEGORIES
+from ..services.fx_service import fx_rates
+from ..services.ia_service import FINANCIAL_CATEGORIES
+from ..services.live_updates import publish_changes
+
+router = APIRouter()
+
+def _budget_response(budget: Budget, period_start: datetime.date, spent: float) -> BudgetRead:
+    return BudgetRead(
+        id=budget.id,
+        category=budget.category,
+        period=budget.period,
+        amount=budget.amount,
+        currency=budget.currency,
+        thresholds=sorted(rule.threshold for rule in budget.rules),
+        period_start=period_start,
+        spent=spent,
+        created_at=budget.created_at,
+    )
+
+@router.get("", response_model=List[BudgetRead])
+async def list_budgets(
+    db: Session = Depends(get_db),
+    principal: schemas.token.TokenPrincipal = Depends(get_token_principal)
+):
+    """Presupuestos del usuario con el gasto acumulado de su periodo en curso (mes o semana)."""
+    return [_budget_response(*entry) for entry in budget_service.list_budgets(db, principal.id)]
+
+@router.post("", response_model=BudgetRead, status_code=status.HTTP_201_CREATED)
+async def create_budget(
+    request_body: BudgetCreate,
+    db: Session = Depends(get_db),
+    principal: schemas.token.TokenPrincipal = Depends(get_token_principal)
+):
+    """
+    Crea un presupuesto para una categoría de gasto con sus umbrales de alerta.
+    El gasto se evalúa de forma incremental al guardar y categorizar transacciones; las
+    alertas disparadas se consultan en /budgets/alerts.
+    """
+    if request_body.category not in FINANCIAL_CATEGORIES or request_body.category in NON_SPENDING_CATEGORIES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown spending category '{request_body.category}'.")
+    if any(not 0 < threshold <= 10 for threshold in request_body.thresholds):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Thresholds must be fractions of the budget in (0, 10].")
+    if request_body.currency is not None and not fx_rates.supports(request_body.currency):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported currency '{request_body.currency}'.")
+    existing = db.query(Budget).filter(
+        Budget.user_id == principal.id,
+        Budget.category == request_body.category,
+        Budget.period == request_body.period,
+    ).first()
+    if existing is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A budget for this category and period already exists.")
+
+    try:
+        created = budget_service.create_budget(
+            db, principal.id, request_body.category, request_body.amount, request_body.period,
+            request_body.currency, request_body.thresholds,
+        )
+    except IntegrityError:
+        # Otra petición creó el mismo presupuesto entre la comprobación y el INSERT (índice único)
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A budget for this category and period already exists.")
+    publish_changes(db, principal.id, "budgets") # Umbrales que ya se superan al crearlo
+    return _budget_response(*created)
+
+@router.delete("/{budget_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_budget(
+    budget_id: int,
+    db: Session = Depends(get_db),
+    principal: schemas.token.TokenPrincipal = Depends(get_token_principal)
+):
+    """Borra un presupuesto del usuario junto con sus umbrales, totales y alertas."""
+    if not budget_service.delete_budget(db, principal.id, budget_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Budget not found.")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@router.get("/alerts", response_model=List[BudgetAlertRead])
+async def list_alerts(
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    principal: schemas.token.TokenPrincipal = Depends(get_token_principal)
+):
+    """Últimas alertas de presupuesto del usuario (outbox), de la más reciente a la más antigua."""
+    return budget_service.load_alerts(db, principal.id, limit)
@@ -1,22 +1,42 @@
 import random
+import time
+import datetime
+import json
 import asyncio # Para llamar a la función async de categorización
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Dict, Optional
+from typing import Any, AsyncIterator, List, Dict, Optional, Literal, Set, Tuple
 
 # Importaciones relativas
 from .. import models
 from .. import schemas
-from ..db.database import get_db
-from ..core.security import get_current_user
-from ..services.ia_service import categorize_transaction
+from ..db.database import get_db, SessionLocal
+from ..core.config import settings
+from ..core.cache import cache
+from ..core.security import get_current_user, get_token_principal
+from ..core.singleflight import SingleFlight
+from ..models.plaid_item import PlaidItem
+from ..models.transaction import Transaction, TransactionCategory
+from ..services.categorization_store import load_categories, persist_in_background, learn_from_plaid, predict_locally
+from ..services.categorization_queue import dead_transaction_ids, enqueue_in_background
 # Necesitamos una forma de obtener transacciones. Importamos la función de plaid.py
 # y su esquema de respuesta para usarlo.
-from .plaid import get_transactions, create_mock_transactions_response
-from ..schemas.plaid import PlaidTransactionResponse, PlaidTransaction
+from .plaid import get_transactions, create_mock_transactions_response, get_plaid_client, get_accounts
+from ..schemas.plaid import PlaidTransactionResponse, PlaidAccount
+from ..services.plaid_service import accounts_cache, total_balance
+from ..services.ia_service import SOURCE_KNN, UNCATEGORIZED_CATEGORY
+from ..services.insight_service import load_insights
+from ..services.transaction_frame import TransactionFrame
+from ..services.fx_service import fx_rates
+from ..services.live_updates import change_poller, claim_alerts, current_version, dashboard_events
+from ..services.analytics_service import spending_timeseries, bucket_count, NON_SPENDING_CATEGORIES
 
 router = APIRouter()
 
+# Bucket para el gasto que la cola de categorización todavía no ha procesado
+PENDING_CATEGORY = "Uncategorized (pending)"
+
 # Lista de Tips Financieros
 FINANCIAL_TIPS = [
     "Automatiza tus ahorros transfiriendo un % a una cuenta separada cada mes.",
@@ -31,82 +51,195 @@ FINANCIAL_TIPS = [
     "Invierte en tu educación financiera continuamente.",
 ]
 
+# Dashboards por usuario: las peticiones concurrentes (varias pantallas abiertas a la vez)
+# comparten una única generación, y el resultado completo se reutiliza DASHBOARD_CACHE_TTL_SECONDS.
+# La clave incluye la moneda base: cada divisa pedida tiene su propio resultado ya convertido.
+dashboard_flight = SingleFlight(
+    "dashboard",
+    namespace=cache.namespace("dashboard", settings.DASHBOARD_CACHE_TTL_SECONDS, value_type=schemas.dashboard.DashboardData),
+)
+
+async def forget_dashboard(user_id: int) -> None:
+    """Descarta los dashboards cacheados del usuario en todas las monedas base."""
+    for currency in fx_rates.currencies:
+        await dashboard_flight.forget(f"{user_id}:{currency}")
+
+def resolve_currency(currency: Optional[str]) -> str:
+    """Moneda base pedida (por defecto BASE_CURRENCY); 400 si no hay tipos de cambio para ella."""
+    currency = (currency or settings.BASE_CURRENCY).upper()
+    if not fx_rates.supports(currency):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unsupported currency '{currency}'. Available: {', '.join(fx_rates.currencies)}."
+        )
+    return currency
+
 @router.get("/data", response_model=schemas.dashboard.DashboardData)
 async def get_dashboard_data(
+    currency: Optional[str] = Query(None, min_length=3, max_length=3, description="Moneda de los importes (por defecto BASE_CURRENCY)"),
     db: Session = Depends(get_db),
-    current_user: models.user.User = Depends(get_current_user)
+    current_user: models.user.User = Depends(get_current_user),
+    client = Depends(get_plaid_client)
 ):
     """
     Obtiene los datos agregados para el dashboard principal, incluyendo categorización IA.
+    El modelo remoto nunca se consulta aquí: el gasto que no tiene categoría guardada ni
+    predicción kNN se encola y se devuelve como pendiente (complete=False) hasta que lo
+    procesen los workers de la cola. Los resultados parciales no se cachean.
+    Gastos y saldos se convierten a 'currency' con el tipo de cambio de su día.
     """
+    currency = resolve_currency(currency)
+    return await dashboard_flight.do(
+        f"{current_user.id}:{currency}",
+        lambda: build_dashboard_data(db, current_user, client, currency),
+        cache_if=lambda data: data.complete,
+    )
+
+def summarize_spending(
+    db: Session, user_id: int, frame: TransactionFrame, currency: str,
+) -> Tuple[Dict[str, float], List[schemas.dashboard.SavingsInsight], str]:
+    """Gasto por categoría en 'currency', insights guardados y el insight principal."""
+    # Suma por categoría en columnas (ver services/transaction_frame.py), tras convertir
+    # cada importe a la moneda base con el tipo de su día.
+    # "Uncategorized" (limitador saturado) y el bucket pendiente se muestran: es gasto real sin clasificar
+    frame = frame.in_currency(fx_rates, currency)
+    gasto_categorias = frame.sum_by_category(frame.spending_mask(NON_SPENDING_CATEGORIES))
+
+    # Insights de Ahorro: precalculados por el motor de insights al llegar transacciones
+    # (anomalías, cargos recurrentes nuevos, tendencias); aquí sólo se leen.
+    insights = [schemas.dashboard.SavingsInsight.model_validate(i) for i in load_insights(db, user_id)]
+    insight_ahorro = "Aún no hay suficientes datos de gastos para generar un insight."
+    gasto_clasificado = {k: v for k, v in gasto_categorias.items() if k != PENDING_CATEGORY}
+    if insights:
+        insight_ahorro = insights[0].message
+    elif gasto_clasificado:
+        # Sin histórico todavía (ej. datos mock): insight simple sobre el gasto de esta consulta
+        try:
+            categoria_mayor_gasto = max(gasto_clasificado, key=gasto_clasificado.get)
+            monto_mayor_gasto = gasto_categorias[categoria_mayor_gasto]
+            insight_ahorro = f"Tu mayor área de gasto parece ser {categoria_mayor_gasto} ({monto_mayor_gasto:.2f} {currency}). ¡Una oportunidad para revisar!"
+        except ValueError:
+            # Esto no debería pasar si gasto_categorias no está vacío, pero por si acaso
+            insight_ahorro = "Error al calcular el insight de gastos."
+    return gasto_categorias, insights, insight_ahorro
+
+# Consultas a Plaid que vencieron el plazo de /data: siguen en segundo plano (la sincronización
+# guarda lo nuevo en la BD para la próxima vista) y aquí se retienen hasta que terminan.
+_late_fetches: Set["asyncio.Future[Any]"] = set()
+
+def _finish_in_background(task: "asyncio.Future[Any]") -> None:
+    def done(task: "asyncio.Future[Any]") -> None:
+        _late_fetches.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"ERROR: Falla en una consulta a Plaid que venció el plazo del dashboard: {task.exception()}")
+    _late_fetches.add(task)
+    task.add_done_callback(done)
+
+def _stored_transactions(db: Session, user_id: int) -> List[schemas.plaid.PlaidTransaction]:
+    """Transacciones del usuario ya guardadas en la BD (última sincronización que terminó)."""
+    rows = db.query(Transaction).filter(Transaction.user_id == user_id).order_by(Transaction.date.desc()).all()
+    return [schemas.plaid.PlaidTransaction.model_validate(row) for row in rows]
+
+async def _cached_accounts(db: Session, user_id: int) -> List[PlaidAccount]:
+    """Cuentas ya cacheadas de los Items del usuario (sin llamar a Plaid); los Items sin caché se omiten."""
+    accounts: List[PlaidAccount] = []
+    for (item_id,) in db.query(PlaidItem.item_id).filter(PlaidItem.user_id == user_id):
+        accounts.extend(await accounts_cache.peek(item_id) or [])
+    return accounts
+
+async def build_dashboard_data(
+    db: Session, current_user: models.user.User, client, currency: str,
+) -> schemas.dashboard.DashboardData:
+    """Genera el dashboard: transacciones y cuentas, categorización, insights y balance."""
     try:
-        # 1. Obtener transacciones (usará mock si Plaid no está listo/conectado)
+        # 1. Obtener transacciones y cuentas en paralelo (usará mock si Plaid no está listo/conectado)
+        # Las cuentas se sirven desde la caché TTL por Item: no añaden una llamada a Plaid en cada vista.
+        # Ambas tienen un plazo común (DASHBOARD_PLAID_DEADLINE_SECONDS): la que no llega a tiempo
+        # se sustituye por lo guardado (transacciones de la BD, cuentas cacheadas) y el resultado
+        # parcial no se cachea (complete=False).
         transaction_response: Optional[PlaidTransactionResponse] = None
-        try:
-            # Asumimos que get_transactions puede necesitar un cliente Plaid válido
-            # Si get_transactions maneja internamente la contingencia mock, esto funcionará.
-            # Si no, podríamos necesitar pasar get_plaid_client como dependencia aquí también.
-            transaction_response = await get_transactions(db=db, current_user=current_user)
-        except Exception as plaid_error:
-            print(f"ERROR: Falla al obtener transacciones de Plaid: {plaid_error}. Usando mock.")
+        accounts: List[PlaidAccount] = []
+        transactions_task = asyncio.ensure_future(
+            # get_transactions recorre todos los Items del usuario en paralelo y
+            # maneja internamente la contingencia mock (sin cliente o sin Items).
+            get_transactions(db=db, current_user=current_user, client=client)
+        )
+        accounts_task = asyncio.ensure_future(get_accounts(db=db, current_user=current_user, client=client))
+        await asyncio.wait((transactions_task, accounts_task), timeout=settings.DASHBOARD_PLAID_DEADLINE_SECONDS)
+        timed_out = False
+        for task in (transactions_task, accounts_task):
+            if not task.done():
+                timed_out = True
+                _finish_in_background(task)
+
+        if not transactions_task.done():
+            print(f"ADVERTENCIA: Plaid no respondió en {settings.DASHBOARD_PLAID_DEADLINE_SECONDS}s (transacciones). Usando las guardadas.")
+            transaction_response = PlaidTransactionResponse(
+                transactions=_stored_transactions(db, current_user.id), account_name="Linked Account (Plaid)",
+            )
+        elif transactions_task.exception() is not None:
+            print(f"ERROR: Falla al obtener transacciones de Plaid: {transactions_task.exception()}. Usando mock.")
             # Si falla la obtención real, usamos el mock directamente
             transaction_response = create_mock_transactions_response()
+        else:
+            transaction_response = transactions_task.result()
+        if not accounts_task.done():
+            print(f"ADVERTENCIA: Plaid no respondió en {settings.DASHBOARD_PLAID_DEADLINE_SECONDS}s (cuentas). Usando las cacheadas.")
+            accounts = await _cached_accounts(db, current_user.id)
+        elif accounts_task.exception() is not None:
+            print(f"ERROR: Falla al obtener cuentas de Plaid: {accounts_task.exception()}. Balance no disponible.")
+        else:
+            accounts = accounts_task.result()
 
         transactions = transaction_response.transactions if transaction_response else []
 
-        # 2. Procesar transacciones y categorizar gastos ASINCRÓNICAMENTE
-        gasto_categorias: Dict[str, float] = {}
-        categorization_tasks = []
-
-        # Crear tareas para categorizar todas las transacciones de gasto en paralelo
-        for t in transactions:
-            if t.amount > 0: # Gasto
-                categorization_tasks.append(categorize_transaction(t.name))
-            # Nota: No estamos almacenando la categoría en la transacción aquí,
-            # solo agregando para el dashboard. Considerar almacenar en BD en el futuro.
-
-        # Ejecutar todas las tareas de categorización en paralelo
-        if categorization_tasks:
-            print(f"DEBUG: Iniciando categorización para {len(categorization_tasks)} transacciones...")
-            results = await asyncio.gather(*categorization_tasks)
-            print(f"DEBUG: Categorización completada.")
-
-            # Procesar los resultados
-            task_index = 0
-            for t in transactions:
-                if t.amount > 0:
-                    category = results[task_index]
-                    if category and category not in ["Income", "Transfers", "Other"]:
-                        gasto_categorias[category] = gasto_categorias.get(category, 0) + t.amount
-                    task_index += 1
-        else:
-            print("DEBUG: No hay transacciones de gasto para categorizar.")
+        # 2. Categorizar gastos sin llamadas externas
+        # Las categorías ya guardadas se leen de la BD; luego se prueba el kNN local (CPU, en lote).
+        # Lo que éste no resuelve con confianza se encola para los workers de categorización
+        # (app/services/categorization_queue.py) y se cuenta como PENDING_CATEGORY.
+        spending = [t for t in transactions if t.amount > 0] # Gastos
+        stored = load_categories(db, current_user.id, [t.transaction_id for t in spending])
+
+        learn_from_plaid(transactions)
+        uncategorized = [t for t in spending if t.transaction_id not in stored]
+        local = predict_locally(uncategorized)
+        if local:
+            stored.update(local)
+            persist_in_background(current_user.id, [
+                (t.transaction_id, t.name, local[t.transaction_id], SOURCE_KNN) for t in uncategorized if t.transaction_id in local
+            ])
 
+        pending = [t for t in uncategorized if t.transaction_id not in stored]
+        # Un trabajo 'dead' no se resolverá solo: su gasto queda como "Uncategorized" (terminal), no pendiente
+        dead = dead_transaction_ids(db, current_user.id, [t.transaction_id for t in pending])
+        if dead:
+            stored.update({transaction_id: UNCATEGORIZED_CATEGORY for transaction_id in dead})
+            pending = [t for t in pending if t.transaction_id not in dead]
+        if pending:
+            print(f"DEBUG: {len(pending)} transacciones pendientes de la cola de categorización.")
+            enqueue_in_background(current_user.id, [(t.transaction_id, t.name) for t in pending])
 
-        # 3. Generar Insight de Ahorro (simple)
-        insight_ahorro = "Aún no hay suficientes datos de gastos para generar un insight."
-        if gasto_categorias:
-            try:
-                categoria_mayor_gasto = max(gasto_categorias, key=gasto_categorias.get)
-                monto_mayor_gasto = gasto_categorias[categoria_mayor_gasto]
-                insight_ahorro = f"Tu mayor área de gasto parece ser {categoria_mayor_gasto} (${monto_mayor_gasto:.2f}). ¡Una oportunidad para revisar!"
-            except ValueError:
-                # Esto no debería pasar si gasto_categorias no está vacío, pero por si acaso
-                insight_ahorro = "Error al calcular el insight de gastos."
+        # 3. Agregados por categoría e insights de ahorro
+        frame = TransactionFrame.from_transactions(spending, stored, default_category=PENDING_CATEGORY)
+        gasto_categorias, insights, insight_ahorro = summarize_spending(db, current_user.id, frame, currency)
 
         # 4. Seleccionar Tip del Día
         tip_dia = random.choice(FINANCIAL_TIPS)
 
-        # 5. Balance Simulado (Placeholder)
-        # Idealmente, obtener de Plaid Assets o calcular sumando transacciones
-        balance_simulado = 1234.56
+        # 5. Balance real de las cuentas enlazadas (activos menos deudas)
+        # Se mantiene el nombre 'balance_simulado' por compatibilidad con el frontend.
+        balance_simulado = total_balance(accounts, currency)
 
         # 6. Devolver Datos
         return schemas.dashboard.DashboardData(
             balance_simulado=balance_simulado,
             gasto_categorias=gasto_categorias,
             insight_ahorro=insight_ahorro,
-            tip_dia=tip_dia
+            insights=insights,
+            tip_dia=tip_dia,
+            cuentas=accounts,
+            complete=not pending and not timed_out,
+            currency=currency
         )
 
     except HTTPException as http_exc:
@@ -119,4 +252,218 @@ async def get_dashboard_data(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Could not generate dashboard data due to an internal error: {e}"
-        ) 
\ No newline at end of file
+        ) 
+
+# --- Eventos en Vivo (SSE) ---
+# Sustituye al sondeo periódico de /data: la conexión queda abierta y sólo recibe datos cuando
+# una sincronización o categorización del usuario termina, en este proceso o en otro
+# (services/live_updates.py). Los fragmentos se calculan sólo desde lo guardado en la BD (y las
+# cuentas ya cacheadas): un aviso nunca provoca una sincronización con Plaid.
+# Una conexión inactiva es una corrutina esperando en su cola acotada: no retiene sesión de BD,
+# hilo ni petición a Plaid, así que un worker mantiene miles. Eventos:
+#   snapshot  fragmentos completos al conectar (y tras reconectar)
+#   update    sólo los fragmentos que cambiaron respecto al último envío de esta conexión
+#   alert     alerta de presupuesto del outbox (BudgetAlertRead)
+#   resync    se perdieron avisos (cola llena): volver a pedir /data y /budgets/alerts
+#   error     {"status", "detail"} y la conexión se cierra (ej. 401 al caducar el access token:
+#             el cliente debe refrescarlo y reconectar)
+# y un comentario ': ping' cada SSE_HEARTBEAT_SECONDS para que proxies y clientes no la corten.
+
+# Campos de DashboardData de cada fragmento (tip_dia cambia en cada generación: no se envía)
+STREAM_FRAGMENTS = {
+    "aggregates": ("gasto_categorias", "complete", "currency"),
+    "insights": ("insights", "insight_ahorro"),
+    "balances": ("balance_simulado", "cuentas"),
+}
+
+# Última versión por usuario que ya invalidó su dashboard cacheado (/data): con varias conexiones
+# del mismo usuario, sólo la primera en procesarla lo descarta.
+_invalidated_version: Dict[int, int] = {}
+
+def _sse(event: str, data: Any) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode("utf-8")
+
+def _stored_dashboard(user_id: int, currency: str) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Agregados e insights del usuario sólo desde la BD: transacciones guardadas, sus categorías y
+    el estado de la cola (sin Plaid, kNN ni encolado, que son cosa de /data).
+    Devuelve los campos de DashboardData calculados (ya serializados) y los Items del usuario.
+    Abre su propia sesión.
+    """
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(
+                Transaction.transaction_id, Transaction.date, Transaction.amount, Transaction.pending,
+                Transaction.name, TransactionCategory.category, Transaction.iso_currency_code,
+            )
+            .outerjoin(TransactionCategory, TransactionCategory.transaction_id == Transaction.transaction_id)
+            .filter(Transaction.user_id == user_id, Transaction.amount > 0)
+            .all()
+        )
+        uncategorized = [row.transaction_id for row in rows if row.category is None]
+        dead = dead_transaction_ids(db, user_id, uncategorized)
+        frame = TransactionFrame.from_rows(
+            (
+                (row.date, row.amount, row.pending, row.name,
+                 UNCATEGORIZED_CATEGORY if row.transaction_id in dead else row.category, row.iso_currency_code)
+                for row in rows
+            ),
+            default_category=PENDING_CATEGORY,
+        )
+        gasto_categorias, insights, insight_ahorro = summarize_spending(db, user_id, frame, currency)
+        item_ids = [row[0] for row in db.query(PlaidItem.item_id).filter(PlaidItem.user_id == user_id)]
+        values = {
+            "gasto_categorias": gasto_categorias,
+            "complete": len(uncategorized) == len(dead),
+            "currency": currency,
+            "insights": [insight.model_dump(mode="json") for insight in insights],
+            "insight_ahorro": insight_ahorro,
+        }
+        return values, item_ids
+    finally:
+        db.close()
+
+async def _dashboard_fragments(user_id: int, currency: str) -> Dict[str, Any]:
+    """
+    Fragmentos del dashboard del usuario calculados desde la BD. Los saldos salen de las cuentas ya
+    cacheadas: si falta la de algún Item, el fragmento 'balances' no se envía (se queda el anterior).
+    """
+    try:
+        values, item_ids = await asyncio.to_thread(_stored_dashboard, user_id, currency)
+    except Exception as e:
+        print(f"ERROR: Falla calculando los fragmentos del dashboard del usuario {user_id}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not generate dashboard data.")
+    accounts: Optional[List[PlaidAccount]] = []
+    for item_id in item_ids:
+        cached = await accounts_cache.peek(item_id)
+        if cached is None:
+            accounts = None
+            break
+        accounts.extend(cached)
+    if accounts is not None:
+        values["balance_simulado"] = total_balance(accounts, currency)
+        values["cuentas"] = [account.model_dump(mode="json") for account in accounts]
+    return {
+        name: {field: values[field] for field in fields}
+        for name, fields in STREAM_FRAGMENTS.items() if all(field in values for field in fields)
+    }
+
+def _pending_alerts(user_id: int) -> List[Dict[str, Any]]:
+    db = SessionLocal()
+    try:
+        return claim_alerts(db, user_id)
+    finally:
+        db.close()
+
+def _current_version(user_id: int) -> int:
+    db = SessionLocal()
+    try:
+        return current_version(db, user_id)
+    finally:
+        db.close()
+
+async def _dashboard_stream(user_id: int, currency: str, expires_at: Optional[float]) -> AsyncIterator[bytes]:
+    subscription = dashboard_events.subscribe(user_id, settings.SSE_QUEUE_SIZE)
+    try:
+        yield f"retry: {settings.SSE_RETRY_MS}\n\n".encode("utf-8")
+        # Versión leída ANTES del snapshot: un cambio posterior lo detecta el sondeo
+        change_poller.note(user_id, await asyncio.to_thread(_current_version, user_id))
+        fragments = await _dashboard_fragments(user_id, currency)
+        sent = {name: json.dumps(value, sort_keys=True) for name, value in fragments.items()}
+        yield _sse("snapshot", fragments)
+        # Alertas disparadas mientras el usuario no tenía conexiones abiertas
+        for alert in await asyncio.to_thread(_pending_alerts, user_id):
+            yield _sse("alert", alert)
+
+        while True:
+            timeout = settings.SSE_HEARTBEAT_SECONDS
+            if expires_at is not None:
+                remaining = expires_at - time.time()
+                if remaining <= 0:
+                    raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
+                timeout = min(timeout, remaining)
+            event = await subscription.get(timeout)
+            if event is None:
+                yield b": ping\n\n"
+                continue
+            events = [event] + subscription.drain() # Varios avisos seguidos -> un solo recálculo
+            if subscription.overflowed:
+                subscription.overflowed = False
+                yield _sse("resync", {})
+            for pending in events:
+                for alert in pending["alerts"]:
+                    yield _sse("alert", alert)
+
+            newest = max(pending["version"] for pending in events)
+            if not newest or newest > _invalidated_version.get(user_id, 0):
+                _invalidated_version[user_id] = newest
+                await forget_dashboard(user_id) # Que /data tampoco sirva el dashboard anterior
+            fragments = await _dashboard_fragments(user_id, currency)
+            changed = {}
+            for name, value in fragments.items():
+                serialized = json.dumps(value, sort_keys=True)
+                if sent.get(name) != serialized:
+                    sent[name] = serialized
+                    changed[name] = value
+            if changed:
+                yield _sse("update", changed)
+    except HTTPException as e:
+        yield _sse("error", {"status": e.status_code, "detail": e.detail})
+    finally:
+        dashboard_events.unsubscribe(subscription)
+        if not dashboard_events.has_subscribers(user_id):
+            _invalidated_version.pop(user_id, None)
+
+@router.get("/stream")
+async def stream_dashboard(
+    currency: Optional[str] = Query(None, min_length=3, max_length=3, description="Moneda de los importes (por defecto BASE_CURRENCY)"),
+    principal: schemas.token.TokenPrincipal = Depends(get_token_principal)
+):
+    """
+    Server-Sent Events con los cambios del dashboard del usuario: un 'snapshot' al conectar y
+    después sólo los fragmentos que cambian (agregados, insights, saldos) cuando termina una
+    sincronización o categorización (de cualquier proceso), más las alertas de presupuesto.
+    La conexión se cierra con un evento 'error' (401) al caducar el access token.
+    """
+    currency = resolve_currency(currency)
+    return StreamingResponse(
+        _dashboard_stream(principal.id, currency, principal.exp),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}, # Sin buffering en nginx
+    )
+
+@router.get("/timeseries", response_model=schemas.dashboard.SpendingTimeSeries)
+async def get_spending_timeseries(
+    granularity: Literal["day", "week", "month"] = Query("month"),
+    start_date: Optional[datetime.date] = Query(None, description="Por defecto, TIMESERIES_DEFAULT_DAYS antes de end_date"),
+    end_date: Optional[datetime.date] = Query(None, description="Por defecto, hoy"),
+    window: int = Query(3, ge=1, le=52, description="Buckets de la media móvil"),
+    currency: Optional[str] = Query(None, min_length=3, max_length=3, description="Moneda de los importes (por defecto BASE_CURRENCY)"),
+    db: Session = Depends(get_db),
+    principal: schemas.token.TokenPrincipal = Depends(get_token_principal)
+):
+    """
+    Gasto por categoría a lo largo del tiempo (día, semana o mes), con media móvil y
+    variación respecto al periodo anterior. Se calcula en la base de datos sobre el
+    histórico de transacciones guardado, no sólo sobre la última consulta a Plaid.
+    Con importes en varias divisas, se convierten a 'currency' con el tipo de cada día.
+    """
+    currency = resolve_currency(currency)
+    end_date = end_date or datetime.date.today()
+    start_date = start_date or end_date - datetime.timedelta(days=settings.TIMESERIES_DEFAULT_DAYS)
+    if start_date > end_date:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="start_date must be before end_date.")
+    # Se cuenta sin generar los buckets: un rango enorme se rechaza sin construir la lista
+    if bucket_count(start_date, end_date, granularity) > settings.TIMESERIES_MAX_BUCKETS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Date range too large for granularity '{granularity}' (max {settings.TIMESERIES_MAX_BUCKETS} buckets)."
+        )
+
+    try:
+        # Consulta síncrona (SQLAlchemy) fuera del event loop
+        return await asyncio.to_thread(spending_timeseries, db, principal.id, start_date, end_date, granularity, window, currency)
+    except Exception as e:
+        print(f"ERROR: Falla al calcular la serie temporal de gasto para usuario {principal.id}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not compute spending time series.")
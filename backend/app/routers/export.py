@@ -0,0 +1,86 @@
+import os
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, status
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy.orm import Session
+from typing import Literal
+
+# Importaciones relativas
+from .. import schemas
+from ..schemas.export import ExportJobCreate, ExportJobRead
+from ..db.database import get_db
+from ..core.security import get_token_principal
+from ..models.export_job import ExportJob
+from ..services import export_service
+
+router = APIRouter()
+
+def _job_response(job: ExportJob) -> ExportJobRead:
+    response = ExportJobRead.model_validate(job)
+    if job.status == "done":
+        response.download_url = f"/export/jobs/{job.id}/download"
+    return response
+
+def _require_format(export_format: str) -> None:
+    if export_format == "parquet" and not export_service.parquet_available():
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Parquet export requires pyarrow on the server.")
+
+@router.get("/transactions")
+async def export_transactions(
+    format: Literal["csv", "parquet"] = Query("csv"),
+    principal: schemas.token.TokenPrincipal = Depends(get_token_principal)
+):
+    """
+    Descarga el histórico completo de transacciones del usuario, con su categoría, en CSV o Parquet.
+    Se genera en streaming por lotes desde un cursor del servidor (memoria acotada).
+    """
+    _require_format(format)
+    return StreamingResponse(
+        export_service.export_chunks(principal.id, format),
+        media_type=export_service.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{export_service.export_filename(format)}"'},
+    )
+
+@router.post("/jobs", response_model=ExportJobRead, status_code=status.HTTP_202_ACCEPTED)
+async def create_export_job(
+    request_body: ExportJobCreate,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    principal: schemas.token.TokenPrincipal = Depends(get_token_principal)
+):
+    """Encola una exportación grande; el archivo se descarga cuando el trabajo termina."""
+    _require_format(request_body.format)
+    job = export_service.create_job(db, principal.id, request_body.format)
+    background_tasks.add_task(export_service.run_job, job.id) # Síncrona: se ejecuta en el threadpool
+    return _job_response(job)
+
+@router.get("/jobs/{job_id}", response_model=ExportJobRead)
+async def get_export_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    principal: schemas.token.TokenPrincipal = Depends(get_token_principal)
+):
+    """Estado de un trabajo de exportación del usuario."""
+    job = db.get(ExportJob, job_id)
+    if job is None or job.user_id != principal.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Export job not found.")
+    if job.status in ("pending", "running") and export_service.recover_stale_jobs(db, job.id):
+        db.refresh(job) # Su worker se reinició: 'failed' en vez de sondear para siempre
+    return _job_response(job)
+
+@router.get("/jobs/{job_id}/download")
+async def download_export_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    principal: schemas.token.TokenPrincipal = Depends(get_token_principal)
+):
+    """Descarga el archivo generado por un trabajo terminado."""
+    job = db.get(ExportJob, job_id)
+    if job is None or job.user_id != principal.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Export job not found.")
+    if job.status != "done" or not job.file_path or not os.path.exists(job.file_path):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Export job is not ready (status: {job.status}).")
+    return FileResponse(
+        job.file_path,
+        media_type=export_service.MEDIA_TYPES[job.format],
+        filename=export_service.export_filename(job.format),
+    )
@@ -0,0 +1,27 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from ..services.warmup import readiness
+
+router = APIRouter()
+
+# --- Sondas para el orquestador (Kubernetes, balanceador) ---
+
+@router.get("/healthz")
+async def healthz():
+    """
+    Liveness: el proceso responde (el event loop no está bloqueado).
+    No consulta dependencias: una base de datos caída no debe provocar reinicios del worker.
+    """
+    return {"status": "ok"}
+
+@router.get("/readyz")
+async def readyz():
+    """
+    Readiness: 200 cuando el worker terminó el calentamiento y sus dependencias obligatorias
+    (base de datos) responden; 503 durante el arranque, el apagado o con la BD caída.
+    Las comprobaciones se reutilizan READINESS_CACHE_SECONDS.
+    """
+    ready, body = await readiness.status()
+    body["warmup"] = readiness.warmup
+    return JSONResponse(body, status_code=200 if ready else 503)
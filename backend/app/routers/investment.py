@@ -1,65 +1,115 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import functools
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
 from sqlalchemy.orm import Session
-from typing import Optional, Dict, List # Añadir List
+from typing import Optional, Dict, List, Literal # Añadir List
 
 # Importaciones relativas
 from .. import models
 from .. import schemas
 # No necesitamos get_db aquí si no consultamos la BD directamente
 # from ..db.database import get_db
-from ..core.security import get_current_user
+from ..core.config import settings
+from ..core.security import get_token_principal
+from ..services.projection_service import project_portfolio
+from ..services.fund_catalog import fund_catalog
 
 router = APIRouter()
 
-# --- Datos Estáticos para la Demo ESG ---
-# Define los datos aquí o cárgalos desde un archivo de configuración si prefieres
-ESG_DEMO_DATA: Dict = {
-    "fundName": "EcoFuture Leaders Fund (DEMO)",
-    "tickerSymbol": "EFLFX",
-    "description": "Invierte en empresas globales líderes en innovación sostenible y prácticas éticas. (Datos ilustrativos).",
-    "keyMetricLabel": "Rentabilidad Anualizada (5 Años - Ejemplo)",
-    "keyMetricValue": "11.5%",
-    "esgFocus": ["Energía Limpia", "Gobierno Corporativo", "Impacto Social"],
-    "disclaimer": "**DATOS SÓLO PARA FINES DEMOSTRATIVOS. NO ES UNA RECOMENDACIÓN DE INVERSIÓN.**"
+# --- Datos de la Demo de Inversión ---
+# El fondo destacado sale del catálogo ESG (app/data/esg_funds.json), cargado una vez al arrancar.
+# La respuesta sólo depende del tramo de edad y del interés ESG: se serializa una vez por perfil.
+
+INVESTMENT_INSIGHTS: Dict[Optional[str], str] = {
+    None: "Una cartera diversificada es clave para el crecimiento a largo plazo. Considera tu tolerancia al riesgo.",
+    "young": "Con un horizonte de tiempo largo, podrías considerar una mayor exposición a activos de crecimiento como acciones. (Ejemplo ilustrativo).",
+    "middle": "Balancear crecimiento y preservación de capital es importante. Revisa tu asignación de activos periódicamente. (Ejemplo ilustrativo).",
+    "senior": "En esta etapa, priorizar la preservación del capital y considerar inversiones que generen ingresos puede ser prudente. (Ejemplo ilustrativo).",
 }
 
+def _age_bracket(age: Optional[int]) -> Optional[str]:
+    if not age:
+        return None
+    if age < 35:
+        return "young"
+    if age < 55:
+        return "middle"
+    return "senior"
+
+@functools.lru_cache(maxsize=16)
+def _demo_data_json(age_bracket: Optional[str], esg_active: bool) -> bytes:
+    """Respuesta de /demo_data ya serializada para un perfil (tramo de edad, interés ESG)."""
+    fondo_esg_info: Optional[schemas.investment.ESGInvestmentInfo] = None
+    if esg_active and fund_catalog.featured is not None:
+        # Sólo los campos de ESGInvestmentInfo (sin las métricas numéricas del catálogo)
+        fondo_esg_info = schemas.investment.ESGInvestmentInfo.model_validate(fund_catalog.featured.model_dump())
+    return schemas.investment.InvestmentDemoData(
+        esg_info_active=esg_active,
+        fondo_esg_demo=fondo_esg_info,
+        insight_inversion=INVESTMENT_INSIGHTS[age_bracket]
+    ).model_dump_json().encode("utf-8")
+
 @router.get("/demo_data", response_model=schemas.investment.InvestmentDemoData)
 async def get_investment_demo_data(
-    current_user: models.user.User = Depends(get_current_user)
+    current_user: schemas.token.TokenPrincipal = Depends(get_token_principal)
 ):
     """
     Obtiene datos demostrativos para la sección de inversión,
     incluyendo información ESG si el usuario está interesado.
+    Sólo necesita 'age' y 'esg_interest', que viajan en el access token (sin BD).
     """
-
-    # 1. Generar Insight de Inversión Genérico (Basado en Reglas Simples)
-    insight_inversion = "Una cartera diversificada es clave para el crecimiento a largo plazo. Considera tu tolerancia al riesgo."
-    # Usar el perfil del usuario (si existe) para personalizar el insight
     age = getattr(current_user, 'age', None) # Obtener edad de forma segura
-    if age:
-        if age < 35:
-            insight_inversion = "Con un horizonte de tiempo largo, podrías considerar una mayor exposición a activos de crecimiento como acciones. (Ejemplo ilustrativo)."
-        elif age < 55:
-            insight_inversion = "Balancear crecimiento y preservación de capital es importante. Revisa tu asignación de activos periódicamente. (Ejemplo ilustrativo)."
-        else:
-            insight_inversion = "En esta etapa, priorizar la preservación del capital y considerar inversiones que generen ingresos puede ser prudente. (Ejemplo ilustrativo)."
+    esg_active = bool(getattr(current_user, 'esg_interest', False)) # Obtener interés ESG
+    return Response(content=_demo_data_json(_age_bracket(age), esg_active), media_type="application/json")
 
-    # 2. Preparar Datos ESG si aplica
-    fondo_esg_info: Optional[schemas.investment.ESGInvestmentInfo] = None
-    esg_active = getattr(current_user, 'esg_interest', False) # Obtener interés ESG
-    if esg_active:
-        # Crear el objeto Pydantic desde el diccionario estático
-        try:
-            fondo_esg_info = schemas.investment.ESGInvestmentInfo(**ESG_DEMO_DATA)
-        except Exception as e:
-            print(f"ERROR: Error creando objeto ESG Demo Data: {e}")
-            # Continuar sin los datos ESG si hay un error inesperado
+@router.get("/funds", response_model=schemas.investment.FundListResponse)
+async def list_funds(
+    tags: List[str] = Query([], description="Etiquetas esgFocus; el fondo debe tenerlas todas"),
+    sort_by: Literal["annualizedReturn5y", "expenseRatio", "esgScore", "riskLevel", "fundName"] = Query("esgScore"),
+    order: Literal["asc", "desc"] = Query("desc"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    current_user: schemas.token.TokenPrincipal = Depends(get_token_principal)
+):
+    """
+    Consulta el catálogo de fondos ESG: intersección de etiquetas, orden por métrica y paginación.
+    Usa los índices en memoria y devuelve la respuesta pre-serializada (cacheada por parámetros).
+    """
+    key = tuple(sorted({fund_catalog.normalize_tag(tag) for tag in tags if tag.strip()}))
+    content = fund_catalog.query_json(key, sort_by, order == "desc", page, page_size)
+    return Response(content=content, media_type="application/json")
 
-    # 3. Construir la Respuesta
-    response_data = schemas.investment.InvestmentDemoData(
-        esg_info_active=esg_active,
-        fondo_esg_demo=fondo_esg_info,
-        insight_inversion=insight_inversion
-    )
+@router.get("/funds/tags", response_model=List[str])
+async def list_fund_tags(current_user: schemas.token.TokenPrincipal = Depends(get_token_principal)):
+    """Etiquetas esgFocus disponibles en el catálogo (para los filtros del frontend)."""
+    return sorted(fund_catalog.tags.values())
 
-    return response_data 
\ No newline at end of file
+@router.get("/projection", response_model=schemas.investment.PortfolioProjection)
+async def get_portfolio_projection(
+    initial_amount: float = Query(0.0, ge=0, description="Patrimonio inicial"),
+    monthly_contribution: float = Query(200.0, ge=0, description="Aportación mensual"),
+    contribution_growth: float = Query(0.0, ge=-0.5, le=0.5, description="Crecimiento anual de la aportación (ej. 0.02)"),
+    years: int = Query(30, ge=1, le=60),
+    paths: int = Query(10000, ge=100),
+    seed: int = Query(42, ge=0, description="Semilla del RNG (misma semilla = mismo resultado)"),
+    target_amount: Optional[float] = Query(None, gt=0, description="Objetivo de patrimonio final (opcional)"),
+    current_user: schemas.token.TokenPrincipal = Depends(get_token_principal)
+):
+    """
+    Proyecta la cartera con miles de trayectorias Monte Carlo y devuelve bandas de percentiles
+    por año. El perfil de riesgo sale de 'age', 'primary_goal' y 'esg_interest' del access token.
+    Pensado para llamarse en cada movimiento de slider: vectorizado y cacheado por parámetros.
+    """
+    if paths > settings.PROJECTION_MAX_PATHS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"paths must be <= {settings.PROJECTION_MAX_PATHS}.")
+    try:
+        # Cálculo CPU (NumPy) fuera del event loop
+        return await asyncio.to_thread(
+            project_portfolio,
+            current_user.age, current_user.primary_goal, current_user.esg_interest,
+            round(initial_amount, 2), round(monthly_contribution, 2), round(contribution_growth, 4),
+            years, paths, seed, round(target_amount, 2) if target_amount is not None else None,
+        )
+    except Exception as e:
+        print(f"ERROR: Falla al proyectar la cartera del usuario {current_user.id}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not compute portfolio projection.")
@@ -1,3 +1,5 @@
+import os
+import asyncio
 import datetime
 from fastapi import APIRouter, Depends, HTTPException, status, Body
 from sqlalchemy.orm import Session
@@ -12,7 +14,6 @@ try:
     from plaid.model.link_token_create_request import LinkTokenCreateRequest
     from plaid.model.link_token_create_request_user import LinkTokenCreateRequestUser
     from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
-    from plaid.model.transactions_sync_request import TransactionsSyncRequest
     # Alternativa a Sync:
     # from plaid.model.transactions_get_request import TransactionsGetRequest
     # from plaid.model.transactions_get_request_options import TransactionsGetRequestOptions
@@ -29,7 +30,11 @@ from .. import models
 from .. import schemas
 from ..db.database import get_db
 from ..core.config import settings
-from ..core.security import get_current_user, encrypt_data, decrypt_data
+from ..core.security import get_current_user, encrypt_data
+from ..core.timing import instrument_plaid_client
+from ..models.plaid_item import PlaidItem
+from ..services import plaid_service
+from ..services.transaction_store import persist_transactions_in_background
 
 router = APIRouter()
 
@@ -41,8 +46,16 @@ PLAID_COUNTRY_CODES = [CountryCode(c) for c in os.getenv("PLAID_COUNTRY_CODES",
 # Ambiente Plaid (Sandbox, Development, Production)
 PLAID_ENV = getattr(plaid.Environment, settings.PLAID_ENV.capitalize(), plaid.Environment.Sandbox)
 
+# Cliente compartido por el proceso: su pool de conexiones HTTPS (urllib3) se reutiliza
+# entre peticiones en lugar de crear cliente y conexiones nuevas en cada una.
+_plaid_client = None
+
 # Función auxiliar o dependencia para obtener el cliente API
 def get_plaid_client():
+    global _plaid_client
+    if _plaid_client is not None:
+        return _plaid_client
+
     # Verificar si la librería Plaid se importó correctamente
     if plaid is None or plaid_api is None:
         print("ADVERTENCIA: Librería Plaid no disponible.")
@@ -62,9 +75,10 @@ def get_plaid_client():
             }
         )
         api_client = plaid.ApiClient(configuration)
-        client = plaid_api.PlaidApi(api_client)
+        instrument_plaid_client(api_client) # Tiempo del SDK en Server-Timing
+        _plaid_client = plaid_api.PlaidApi(api_client)
         # print(f"DEBUG: Cliente Plaid inicializado para el entorno: {PLAID_ENV}") # Debug
-        return client
+        return _plaid_client
     except Exception as e:
         print(f"ERROR: No se pudo inicializar el cliente Plaid: {e}")
         return None
@@ -133,14 +147,25 @@ async def set_access_token(
             print(f"ERROR CRÍTICO: Falla al encriptar access_token para usuario {current_user.id}")
             raise HTTPException(status_code=500, detail="Failed to secure access token due to encryption error.")
 
-        current_user.plaid_access_token_encrypted = encrypted_access_token
-        current_user.plaid_item_id = item_id
-        db.add(current_user)
+        # Cada institución enlazada es un Item propio; re-enlazar el mismo Item actualiza su token
+        plaid_item = db.query(PlaidItem).filter(PlaidItem.item_id == item_id).first()
+        if plaid_item is None:
+            plaid_item = PlaidItem(user_id=current_user.id, item_id=item_id, access_token_encrypted=encrypted_access_token)
+        elif plaid_item.user_id != current_user.id:
+            print(f"ERROR: Item {item_id} ya pertenece a otro usuario (solicitado por {current_user.id})")
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Plaid item is linked to another user.")
+        else:
+            plaid_item.access_token_encrypted = encrypted_access_token
+        db.add(plaid_item)
         db.commit()
-        db.refresh(current_user)
+        await plaid_service.accounts_cache.invalidate(item_id) # Forzar saldos frescos del Item re-enlazado
+        from .dashboard import forget_dashboard # Importación diferida: dashboard importa este módulo
+        await forget_dashboard(current_user.id) # El dashboard cacheado no incluye el nuevo Item
 
         return schemas.plaid.PlaidSetAccessTokenResponse(item_id=item_id)
 
+    except HTTPException:
+        raise
     except ApiException as e:
         # Imprimir más detalles del error de API
         body_detail = e.body if hasattr(e, 'body') else str(e)
@@ -159,78 +184,90 @@ async def get_transactions(
     client: Optional[plaid_api.PlaidApi] = Depends(get_plaid_client)
 ):
     """
-    Obtiene las transacciones recientes del usuario usando el access_token guardado.
-    Usa datos mock si no hay token o si hay errores.
+    Obtiene las transacciones recientes de todos los Items enlazados del usuario.
+    Consulta los Items en paralelo (con límite por usuario) y une los resultados
+    en un único flujo ordenado por fecha. Usa datos mock si no hay Items o si hay errores.
     """
     if client is None:
         print("ADVERTENCIA: get_transactions - Cliente Plaid no disponible. Devolviendo datos MOCK.")
         return create_mock_transactions_response()
 
-    encrypted_token = current_user.plaid_access_token_encrypted
-    if not encrypted_token:
-        print(f"ADVERTENCIA: Usuario {current_user.id} no tiene token Plaid. Devolviendo datos MOCK.")
-        return create_mock_transactions_response()
-
-    access_token = decrypt_data(encrypted_token)
-    if not access_token:
-        print(f"ERROR: Falla al desencriptar token para usuario {current_user.id}. Devolviendo datos MOCK.")
-        # Podríamos lanzar un error 500, pero devolver mocks puede ser mejor para MVP
+    items = db.query(PlaidItem).filter(PlaidItem.user_id == current_user.id).all()
+    if not items:
+        print(f"ADVERTENCIA: Usuario {current_user.id} no tiene Items de Plaid. Devolviendo datos MOCK.")
         return create_mock_transactions_response()
 
     try:
-        # Usar Transactions Sync para obtener cambios desde la última sincronización
-        # o todas las transacciones si es la primera vez (cursor=None)
-        # Para simplicidad en MVP, pediremos siempre las últimas transacciones
-        # (requiere más lógica de cursor para ser eficiente en producción)
-        request = TransactionsSyncRequest(access_token=access_token)
-        response = client.transactions_sync(request)
-
-        # La respuesta contiene 'added', 'modified', 'removed'. Procesamos 'added'.
-        transactions_data = response.get('added', [])
-
-        # --- Alternativa: Transactions Get (rango de fechas) ---
-        # start_date = (datetime.date.today() - datetime.timedelta(days=30))
-        # end_date = datetime.date.today()
-        # request = TransactionsGetRequest(
-        #     access_token=access_token,
-        #     start_date=start_date,
-        #     end_date=end_date,
-        # )
-        # response = client.transactions_get(request)
-        # transactions_data = response.get('transactions', [])
-        # --- Fin Alternativa ---
-
-        transactions_list: List[schemas.plaid.PlaidTransaction] = []
-        for t_dict in transactions_data:
-            try:
-                # Asegurarse de que los nombres de campo coincidan
-                # Plaid puede devolver campos adicionales, Pydantic los ignora por defecto
-                transactions_list.append(schemas.plaid.PlaidTransaction.model_validate(t_dict))
-            except Exception as validation_error:
-                print(f"Error validando transacción de Plaid: {validation_error}, Datos: {t_dict}")
-                continue # Omitir transacción inválida
-
-        # Obtener nombre de cuenta (simplificado)
-        account_name = "Linked Account (Plaid)" # Placeholder
-        # En una app real: client.accounts_get(AccountsGetRequest(access_token=access_token))
-
-        return schemas.plaid.PlaidTransactionResponse(
-            transactions=transactions_list,
-            account_name=account_name
+        # Transacciones y cuentas (desde caché TTL) en paralelo
+        (results, errors), (accounts, _) = await asyncio.gather(
+            plaid_service.fan_out_items(
+                current_user.id, items, lambda item: plaid_service.sync_item_transactions(client, item),
+                flight=plaid_service.transactions_flight, # Peticiones concurrentes comparten la sincronización
+            ),
+            plaid_service.get_accounts_for_items(client, current_user.id, items),
         )
-
-    except ApiException as e:
-        body_detail = e.body if hasattr(e, 'body') else str(e)
-        print(f"Error de Plaid API al obtener transacciones para user {current_user.id}: status={e.status}, body={body_detail}")
-        # Manejar errores comunes como ITEM_LOGIN_REQUIRED, etc.
-        if e.status == 400: # Podría ser un token inválido
-             print("ADVERTENCIA: Error 400 de Plaid (posible token inválido). Devolviendo datos MOCK.")
-             return create_mock_transactions_response()
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Could not retrieve transactions: {body_detail}")
     except Exception as e:
         print(f"Error inesperado al obtener transacciones para user {current_user.id}: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to retrieve transaction data.")
 
+    if not results:
+        # Todos los Items fallaron: mantener el comportamiento de un solo Item
+        first_error = next(iter(errors.values()))
+        if isinstance(first_error, ApiException):
+            body_detail = first_error.body if hasattr(first_error, 'body') else str(first_error)
+            print(f"Error de Plaid API al obtener transacciones para user {current_user.id}: status={first_error.status}, body={body_detail}")
+            # Manejar errores comunes como ITEM_LOGIN_REQUIRED, etc.
+            if first_error.status == 400: # Podría ser un token inválido
+                 print("ADVERTENCIA: Error 400 de Plaid (posible token inválido). Devolviendo datos MOCK.")
+                 return create_mock_transactions_response()
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Could not retrieve transactions: {body_detail}")
+        if isinstance(first_error, ValueError):
+            # Falla al desencriptar: devolver mocks puede ser mejor para MVP
+            return create_mock_transactions_response()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to retrieve transaction data.")
+
+    transactions_list = plaid_service.merge_transactions([sync.transactions for sync in results.values()])
+    # Acumular el histórico (sólo datos reales, nunca mocks) para las tendencias de gasto,
+    # incluidas las eliminaciones (ej. pendientes sustituidas por la transacción confirmada)
+    removed = [transaction_id for sync in results.values() for transaction_id in sync.removed]
+    persist_transactions_in_background(current_user.id, transactions_list, removed)
+
+    # Nombres reales de cuenta (accounts_get); si no hay cuentas, mantener un nombre genérico
+    account_names = {account.account_id: account.name for account in accounts}
+    for transaction in transactions_list:
+        transaction.account_name = account_names.get(transaction.account_id)
+    used_names = sorted({t.account_name for t in transactions_list if t.account_name})
+    account_name = ", ".join(used_names) if used_names else "Linked Account (Plaid)"
+
+    return schemas.plaid.PlaidTransactionResponse(
+        transactions=transactions_list,
+        account_name=account_name,
+        failed_items=list(errors.keys())
+    )
+
+@router.get("/accounts", response_model=List[schemas.plaid.PlaidAccount])
+async def get_accounts(
+    db: Session = Depends(get_db),
+    current_user: models.user.User = Depends(get_current_user),
+    client: Optional[plaid_api.PlaidApi] = Depends(get_plaid_client)
+):
+    """
+    Obtiene las cuentas y saldos de todos los Items del usuario.
+    Se sirven desde la caché TTL por Item; sólo los Items expirados consultan a Plaid.
+    """
+    if client is None:
+        print("ADVERTENCIA: get_accounts - Cliente Plaid no disponible. Devolviendo datos MOCK.")
+        return create_mock_accounts()
+
+    items = db.query(PlaidItem).filter(PlaidItem.user_id == current_user.id).all()
+    if not items:
+        return create_mock_accounts()
+
+    accounts, errors = await plaid_service.get_accounts_for_items(client, current_user.id, items)
+    if errors and not accounts:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail="Could not retrieve Plaid accounts.")
+    return accounts
+
 # Función auxiliar para datos mock
 def create_mock_transactions_response():
     """Genera una respuesta mock para /transactions."""
@@ -239,4 +276,10 @@ def create_mock_transactions_response():
          schemas.plaid.PlaidTransaction(transaction_id="mock_2", account_id="mock_acc", date=datetime.date.today() - datetime.timedelta(days=2), name="Mock Subway Card", amount=35.00, category=["Travel", "Public Transportation"], pending=False),
          schemas.plaid.PlaidTransaction(transaction_id="mock_3", account_id="mock_acc", date=datetime.date.today() - datetime.timedelta(days=3), name="Mock Salary Deposit", amount=-500.00, category=["Transfer", "Payroll"], pending=False), # Ingreso
     ]
-    return schemas.plaid.PlaidTransactionResponse(transactions=mock_transactions, account_name="Mock Linked Account") 
\ No newline at end of file
+    return schemas.plaid.PlaidTransactionResponse(transactions=mock_transactions, account_name="Mock Linked Account")
+
+def create_mock_accounts():
+    """Genera cuentas mock coherentes con create_mock_transactions_response."""
+    return [
+        schemas.plaid.PlaidAccount(account_id="mock_acc", name="Mock Linked Account", type="depository", subtype="checking", current_balance=1234.56, available_balance=1234.56, iso_currency_code="USD"),
+    ] 
\ No newline at end of file
@@ -10,19 +10,19 @@ from .. import schemas
 # from ..models.user import User
 # from ..schemas.user import UserReadProfile, UserProfileUpdate
 from ..db.database import get_db
-from ..core.security import get_current_user
+from ..core.security import get_current_user, get_token_principal, note_profile_version
 
 router = APIRouter()
 
 # --- Endpoint para obtener el perfil del usuario actual ---
 @router.get("/me", response_model=schemas.user.UserReadProfile)
-async def read_users_me(current_user: models.user.User = Depends(get_current_user)):
+async def read_users_me(principal: schemas.token.TokenPrincipal = Depends(get_token_principal)):
     """
     Obtiene el perfil del usuario actualmente autenticado.
+    Se sirve íntegramente desde el claim de perfil del access token (sin consultar la BD).
     """
-    # Pydantic se encarga de convertir el objeto User de SQLAlchemy
-    # al esquema UserReadProfile gracias a 'from_attributes=True' en el esquema.
-    return current_user
+    # El principal ya contiene los campos de UserReadProfile; Pydantic lo valida contra el esquema.
+    return principal
 
 # --- Endpoint para actualizar el perfil del usuario actual ---
 @router.put("/me", response_model=schemas.user.UserReadProfile)
@@ -59,6 +59,9 @@ async def update_user_me(
         # Considera devolver un error 400 o simplemente el usuario sin cambios.
         return current_user
 
+    # Nueva versión del perfil (incremento en la BD: dos actualizaciones a la vez no dan la misma)
+    current_user.profile_version = models.user.User.profile_version + 1
+
     # Guarda los cambios en la base de datos
     db.add(current_user) # Añade el objeto modificado a la sesión
     try:
@@ -72,4 +75,8 @@ async def update_user_me(
             detail="Could not update user profile."
         )
 
+    # La nueva profile_version invalida los access tokens con el perfil anterior;
+    # el cliente debe pedir un nuevo par en /auth/refresh.
+    await note_profile_version(current_user.id, current_user.profile_version)
+
     return current_user 
\ No newline at end of file
@@ -0,0 +1,41 @@
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+from datetime import date, datetime
+
+# Esquema para crear un presupuesto de categoría con sus umbrales de alerta
+class BudgetCreate(BaseModel):
+    category: str # Una de las categorías de gasto (ver ia_service.FINANCIAL_CATEGORIES)
+    amount: float = Field(..., gt=0) # Límite del periodo
+    period: Literal["month", "week"] = "month"
+    currency: Optional[str] = Field(None, min_length=3, max_length=3) # Por defecto, BASE_CURRENCY
+    thresholds: List[float] = Field([0.8, 1.0], min_length=1, max_length=10) # Fracciones del límite (0.8 = al 80%)
+
+# Presupuesto con el gasto acumulado de su periodo en curso
+class BudgetRead(BaseModel):
+    id: int
+    category: str
+    period: str
+    amount: float
+    currency: str
+    thresholds: List[float]
+    period_start: date # Inicio del periodo en curso
+    spent: float # Gasto del periodo en curso, en 'currency'
+    created_at: Optional[datetime] = None
+
+# Alerta disparada (desde el outbox)
+class BudgetAlertRead(BaseModel):
+    id: int
+    budget_id: int
+    kind: str # budget_threshold
+    category: str
+    period_start: date
+    threshold: float
+    spent: float
+    budget_amount: float
+    currency: str
+    message: str
+    created_at: Optional[datetime] = None
+    dispatched_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
@@ -1,10 +1,43 @@
 from pydantic import BaseModel
+import datetime
 from typing import Dict, Optional, List
+from .plaid import PlaidAccount
+
+# Insight de ahorro precalculado por el motor de insights
+class SavingsInsight(BaseModel):
+    kind: str # spike, recurring, trend, top_category
+    category: Optional[str] = None
+    message: str
+    score: float
+
+    class Config:
+        from_attributes = True
 
 class DashboardData(BaseModel):
-    balance_simulado: float # O usar Optional[float] = None
+    balance_simulado: float # Balance real de las cuentas enlazadas (nombre conservado por compatibilidad)
     gasto_categorias: Dict[str, float] # Ej: {"Comida": 150.20, "Transporte": 80.0}
     insight_ahorro: str
+    insights: List[SavingsInsight] = [] # Todos los insights vigentes (insight_ahorro es el más relevante)
     tip_dia: str
+    cuentas: List[PlaidAccount] = [] # Cuentas con sus saldos (desde la caché de accounts_get)
+    complete: bool = True # False si parte del gasto sigue en "Uncategorized (pending)"
+    currency: str = "USD" # Divisa de balance_simulado y gasto_categorias (convertidos con tipos diarios)
     # Opcional: añadir lista de transacciones recientes si se quiere mostrar
-    # transacciones_recientes: Optional[List[PlaidTransaction]] = None # Requeriría importar PlaidTransaction 
\ No newline at end of file
+    # transacciones_recientes: Optional[List[PlaidTransaction]] = None # Requeriría importar PlaidTransaction 
+
+# Serie de gasto de una categoría (listas alineadas con SpendingTimeSeries.buckets)
+class CategoryTimeSeries(BaseModel):
+    category: str
+    totals: List[float]
+    rolling_avg: List[float] # Media de los últimos 'window' buckets
+    change: List[Optional[float]] # Variación absoluta respecto al bucket anterior (mes a mes con granularity=month)
+    change_pct: List[Optional[float]] # Variación relativa (None si el bucket anterior es 0)
+
+class SpendingTimeSeries(BaseModel):
+    currency: str # Divisa de todos los importes (convertidos con el tipo de cambio de cada día)
+    granularity: str # day, week o month
+    start_date: datetime.date # Inicio del primer bucket
+    end_date: datetime.date
+    window: int
+    buckets: List[datetime.date] # Inicio de cada bucket
+    series: List[CategoryTimeSeries]
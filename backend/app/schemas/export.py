@@ -0,0 +1,21 @@
+from pydantic import BaseModel
+from typing import Optional, Literal
+from datetime import datetime
+
+# Esquema para pedir una exportación en segundo plano
+class ExportJobCreate(BaseModel):
+    format: Literal["csv", "parquet"] = "csv"
+
+# Estado de un trabajo de exportación
+class ExportJobRead(BaseModel):
+    id: str
+    format: str
+    status: str # pending, running, done, failed
+    rows: Optional[int] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    download_url: Optional[str] = None # Disponible cuando status == "done"
+
+    class Config:
+        from_attributes = True
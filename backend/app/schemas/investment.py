@@ -10,7 +10,42 @@ class ESGInvestmentInfo(BaseModel):
     esgFocus: List[str] # Ej: ["Energía Limpia", "Gobierno Corporativo"]
     disclaimer: str # **IMPORTANTE** Aclarar que es demo
 
+# Fondo del catálogo ESG (app/data/esg_funds.json) con sus métricas numéricas
+class FundInfo(ESGInvestmentInfo):
+    annualizedReturn5y: float # % anual (ej. 11.5)
+    expenseRatio: float # % anual de comisiones
+    esgScore: float # 0-100
+    riskLevel: int # 1 (bajo) a 5 (alto)
+
+class FundListResponse(BaseModel):
+    total: int # Fondos que cumplen el filtro (antes de paginar)
+    page: int
+    page_size: int
+    items: List[FundInfo]
+
 class InvestmentDemoData(BaseModel):
     esg_info_active: bool # Indica si el usuario marcó interés ESG
     fondo_esg_demo: Optional[ESGInvestmentInfo] = None # Datos del fondo si esg_info_active es True
-    insight_inversion: str # El insight genérico generado 
\ No newline at end of file
+    insight_inversion: str # El insight genérico generado 
+# --- Proyección Monte Carlo ---
+class RiskProfile(BaseModel):
+    name: str # conservador, equilibrado o crecimiento
+    equity_share: float # % en renta variable (0-1)
+    expected_return: float # Rentabilidad anual esperada
+    volatility: float # Volatilidad anual
+    esg: bool
+
+class ProjectionBand(BaseModel):
+    percentile: int # Ej: 5, 50, 95
+    values: List[float] # Patrimonio al final de cada año (índice 0 = hoy)
+
+class PortfolioProjection(BaseModel):
+    risk_profile: RiskProfile
+    years: List[int]
+    contributed: List[float] # Total aportado acumulado por año
+    bands: List[ProjectionBand]
+    target_amount: Optional[float] = None
+    probability_of_target: Optional[float] = None # % (0-100) de trayectorias que alcanzan target_amount
+    paths: int
+    seed: int
+    disclaimer: str = "**PROYECCIÓN ILUSTRATIVA BASADA EN SIMULACIONES. NO ES UNA RECOMENDACIÓN DE INVERSIÓN.**"
@@ -22,15 +22,39 @@ class PlaidTransaction(BaseModel):
     date: date # Usar date para la fecha de la transacción
     name: str
     amount: float # El monto de la transacción
+    iso_currency_code: Optional[str] = None # Moneda del monto (ej. USD)
     # La categoría de Plaid es una jerarquía, la simplificamos a una lista opcional
     category: Optional[List[str]] = None
     pending: bool
+    item_id: Optional[str] = None # Item de Plaid (institución) del que proviene
+    account_name: Optional[str] = None # Nombre de la cuenta (desde accounts_get)
+    # En una transacción confirmada, id de la pendiente a la que sustituye
+    pending_transaction_id: Optional[str] = None
 
     class Config:
         from_attributes = True # Para crear desde objetos de la librería Plaid
 
+# Resultado de Transactions Sync para un Item: añadidas/modificadas y ids eliminados
+class PlaidItemSync(BaseModel):
+    transactions: List[PlaidTransaction] = []
+    removed: List[str] = []
+
+# Esquema para una cuenta con su saldo (de accounts_get)
+class PlaidAccount(BaseModel):
+    account_id: str
+    item_id: Optional[str] = None
+    name: str
+    official_name: Optional[str] = None
+    type: Optional[str] = None # depository, credit, loan, investment...
+    subtype: Optional[str] = None
+    mask: Optional[str] = None
+    current_balance: Optional[float] = None
+    available_balance: Optional[float] = None
+    iso_currency_code: Optional[str] = None
+
 # Esquema para la respuesta del endpoint de transacciones
 class PlaidTransactionResponse(BaseModel):
     transactions: List[PlaidTransaction]
     # Podríamos añadir más info si fuera necesario, como detalles de cuenta
-    account_name: Optional[str] = None # Ejemplo 
\ No newline at end of file
+    account_name: Optional[str] = None # Ejemplo
+    failed_items: List[str] = [] # Items cuya consulta falló (el resto se devuelve igualmente) 
\ No newline at end of file
@@ -1,10 +1,33 @@
 from pydantic import BaseModel, EmailStr
 from typing import Optional
+from datetime import datetime
 
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None # Presente cuando se emite el par access/refresh
+    expires_in: Optional[int] = None # Segundos de vida del access token
 
 class TokenData(BaseModel):
     # Usamos email como 'subject' (sub) en nuestro token JWT
-    email: Optional[EmailStr] = None 
\ No newline at end of file
+    email: Optional[EmailStr] = None
+
+# Esquema para pedir un nuevo par de tokens
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+# Principal de sólo lectura construido únicamente desde el claim 'profile' del access token.
+# Sirve a endpoints que sólo leen el perfil (ej. /users/me, /investment/demo_data) sin tocar la BD.
+class TokenPrincipal(BaseModel):
+    id: int
+    email: EmailStr
+    age: Optional[int] = None
+    primary_goal: Optional[str] = None
+    esg_interest: bool = False
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    version: int # Versión del perfil (User.profile_version) embebida en el token
+    exp: Optional[int] = None # Caducidad del access token (claim 'exp', segundos desde epoch)
+
+    class Config:
+        frozen = True # Sólo lectura: no debe usarse para escribir en la BD
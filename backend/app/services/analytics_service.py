@@ -0,0 +1,307 @@
+import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Date, Float, String, bindparam, text
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.orm import Session
+
+from ..core.cache import cache
+from ..core.config import settings
+from ..schemas.dashboard import CategoryTimeSeries, SpendingTimeSeries
+from .fx_service import fx_rates
+from .ia_service import UNCATEGORIZED_CATEGORY
+from .live_updates import current_version
+from .transaction_frame import TransactionFrame
+
+# --- Series Temporales de Gasto por Categoría ---
+# La agregación se hace en la base de datos sobre las tablas 'transactions' y
+# 'transaction_categories': nunca se cargan transacciones individuales en Python.
+#   - PostgreSQL: date_trunc + generate_series (buckets sin gasto = 0) + funciones ventana
+#     (media móvil y variación respecto al bucket anterior).
+#   - SQLite (desarrollo): GROUP BY con strftime y las ventanas se calculan con NumPy
+#     sobre la matriz categoría x bucket ya agregada.
+#   - Varias divisas (o una distinta de la pedida): la BD agrupa por día, divisa y categoría;
+#     cada lote de esos totales diarios se convierte con los tipos del día (vectorizado, ver
+#     services/fx_service.py) y se suma a la matriz. La matriz convertida se cachea por moneda base.
+
+GRANULARITIES = ("day", "week", "month")
+
+# Categorías que no son gasto (mismo criterio que /dashboard/data)
+NON_SPENDING_CATEGORIES = ["Income", "Transfers", "Other"]
+
+def bucket_start(day: datetime.date, granularity: str) -> datetime.date:
+    """Inicio del bucket que contiene 'day' (las semanas empiezan en lunes, como date_trunc)."""
+    if granularity == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+def next_bucket_start(bucket: datetime.date, granularity: str) -> datetime.date:
+    """Inicio del bucket siguiente a 'bucket' (que ya es un inicio de bucket)."""
+    if granularity == "day":
+        return bucket + datetime.timedelta(days=1)
+    if granularity == "week":
+        return bucket + datetime.timedelta(weeks=1)
+    return (bucket.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+def bucket_count(start: datetime.date, end: datetime.date, granularity: str) -> int:
+    """Número de buckets de bucket_range(start, end, granularity), sin construir la lista."""
+    first = bucket_start(start, granularity)
+    if first > end:
+        return 0
+    if granularity == "day":
+        return (end - first).days + 1
+    if granularity == "week":
+        return (end - first).days // 7 + 1
+    return (end.year - first.year) * 12 + end.month - first.month + 1
+
+def bucket_range(start: datetime.date, end: datetime.date, granularity: str) -> List[datetime.date]:
+    """Inicios de todos los buckets entre start y end (ambos incluidos)."""
+    buckets = []
+    current = bucket_start(start, granularity)
+    while current <= end:
+        buckets.append(current)
+        current = next_bucket_start(current, granularity)
+    return buckets
+
+# PostgreSQL: todo el cálculo en una sola consulta
+_POSTGRES_TIMESERIES = text("""
+    WITH spending AS (
+        SELECT CAST(date_trunc(:granularity, t.date) AS date) AS bucket,
+               COALESCE(c.category, :uncategorized) AS category,
+               SUM(t.amount) AS total
+        FROM transactions t
+        LEFT JOIN transaction_categories c ON c.transaction_id = t.transaction_id
+        WHERE t.user_id = :user_id
+          AND t.date BETWEEN :start AND :end
+          AND t.amount > 0
+          AND COALESCE(c.category, :uncategorized) NOT IN :excluded
+        GROUP BY 1, 2
+    ),
+    buckets AS (
+        SELECT CAST(generate_series(CAST(:start AS timestamp), CAST(:last_bucket AS timestamp), CAST(:step AS interval)) AS date) AS bucket
+    ),
+    dense AS (
+        SELECT b.bucket, k.category, COALESCE(s.total, 0) AS total
+        FROM buckets b
+        CROSS JOIN (SELECT DISTINCT category FROM spending) k
+        LEFT JOIN spending s ON s.bucket = b.bucket AND s.category = k.category
+    ),
+    windowed AS (
+        SELECT bucket, category, total,
+               AVG(total) OVER (PARTITION BY category ORDER BY bucket ROWS BETWEEN :preceding PRECEDING AND CURRENT ROW) AS rolling_avg,
+               LAG(total) OVER (PARTITION BY category ORDER BY bucket) AS previous
+        FROM dense
+    )
+    SELECT bucket, category, total, rolling_avg,
+           total - previous AS change,
+           (total - previous) / NULLIF(previous, 0) AS change_pct
+    FROM windowed
+    ORDER BY category, bucket
+""").bindparams(bindparam("excluded", expanding=True), bindparam("start", type_=Date), bindparam("end", type_=Date), bindparam("last_bucket", type_=Date))
+
+# SQLite: sólo el GROUP BY; las ventanas se calculan con NumPy
+_SQLITE_BUCKET_EXPRESSIONS = {
+    "day": "date(t.date)",
+    "week": "date(t.date, 'weekday 0', '-6 days')", # Lunes de la semana
+    "month": "strftime('%Y-%m-01', t.date)",
+}
+
+def _sqlite_totals(granularity: str) -> TextClause:
+    return text(f"""
+        SELECT {_SQLITE_BUCKET_EXPRESSIONS[granularity]} AS bucket,
+               COALESCE(c.category, :uncategorized) AS category,
+               SUM(t.amount) AS total
+        FROM transactions t
+        LEFT JOIN transaction_categories c ON c.transaction_id = t.transaction_id
+        WHERE t.user_id = :user_id
+          AND t.date BETWEEN :start AND :end
+          AND t.amount > 0
+          AND COALESCE(c.category, :uncategorized) NOT IN :excluded
+        GROUP BY 1, 2
+    """).bindparams(bindparam("excluded", expanding=True), bindparam("start", type_=Date), bindparam("end", type_=Date))
+
+# Divisas del gasto del rango (NULL = BASE_CURRENCY)
+_CURRENCIES = text("""
+    SELECT DISTINCT t.iso_currency_code
+    FROM transactions t
+    WHERE t.user_id = :user_id
+      AND t.date BETWEEN :start AND :end
+      AND t.amount > 0
+""").bindparams(bindparam("start", type_=Date), bindparam("end", type_=Date))
+
+# Totales por día, divisa y categoría: la unidad mínima que se puede convertir con el tipo del día
+_DAILY_TOTALS_BY_CURRENCY = text("""
+    SELECT t.date AS date,
+           t.iso_currency_code AS currency,
+           COALESCE(c.category, :uncategorized) AS category,
+           SUM(t.amount) AS total
+    FROM transactions t
+    LEFT JOIN transaction_categories c ON c.transaction_id = t.transaction_id
+    WHERE t.user_id = :user_id
+      AND t.date BETWEEN :start AND :end
+      AND t.amount > 0
+      AND COALESCE(c.category, :uncategorized) NOT IN :excluded
+    GROUP BY 1, 2, 3
+""").bindparams(
+    bindparam("excluded", expanding=True), bindparam("start", type_=Date), bindparam("end", type_=Date),
+).columns(date=Date, currency=String, category=String, total=Float)
+
+# Matrices categoría x bucket ya convertidas, por usuario, moneda base, granularidad y rango
+# (se guardan como listas: la caché compartida sólo admite JSON). La clave lleva la versión del
+# dashboard del usuario (dashboard_changes): cada ingesta o categorización la sube y deja atrás
+# las entradas anteriores, en todos los workers
+_converted_totals_cache = cache.namespace(
+    "fx_timeseries", settings.FX_AGGREGATE_CACHE_TTL_SECONDS, value_type=Tuple[List[str], List[List[float]]],
+)
+
+def _optional(values: np.ndarray) -> List[Optional[float]]:
+    return [None if np.isnan(value) else float(value) for value in values]
+
+def _series_from_postgres(rows) -> List[CategoryTimeSeries]:
+    by_category: Dict[str, CategoryTimeSeries] = {}
+    for _, category, total, rolling_avg, change, change_pct in rows:
+        series = by_category.get(category)
+        if series is None:
+            series = by_category[category] = CategoryTimeSeries(category=category, totals=[], rolling_avg=[], change=[], change_pct=[])
+        series.totals.append(float(total))
+        series.rolling_avg.append(float(rolling_avg))
+        series.change.append(None if change is None else float(change))
+        series.change_pct.append(None if change_pct is None else float(change_pct))
+    return list(by_category.values())
+
+def _series_from_totals(rows, buckets: List[datetime.date], window: int) -> List[CategoryTimeSeries]:
+    """Construye la matriz categoría x bucket y calcula las ventanas con NumPy."""
+    if not rows:
+        return []
+    bucket_index = {bucket.isoformat(): i for i, bucket in enumerate(buckets)}
+    categories = sorted({row[1] for row in rows})
+    category_index = {category: i for i, category in enumerate(categories)}
+
+    totals = np.zeros((len(categories), len(buckets)), dtype=np.float64)
+    row_idx = np.fromiter((category_index[row[1]] for row in rows), dtype=np.intp, count=len(rows))
+    col_idx = np.fromiter((bucket_index[str(row[0])] for row in rows), dtype=np.intp, count=len(rows))
+    np.add.at(totals, (row_idx, col_idx), np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows)))
+    return _series_from_matrix(categories, totals, window)
+
+def _series_from_matrix(categories: List[str], totals: np.ndarray, window: int) -> List[CategoryTimeSeries]:
+    """Media móvil y variaciones de una matriz categoría x bucket (una fila por categoría)."""
+    buckets = totals.shape[1]
+
+    # Media móvil de los últimos 'window' buckets (menos al principio, como ROWS BETWEEN en SQL)
+    cumulative = np.cumsum(totals, axis=1)
+    shifted = np.zeros_like(cumulative)
+    if window < buckets:
+        shifted[:, window:] = cumulative[:, :-window]
+    counts = np.minimum(np.arange(1, buckets + 1), window)
+    rolling_avg = (cumulative - shifted) / counts
+
+    # Variación respecto al bucket anterior (el primero no tiene anterior)
+    change = np.full_like(totals, np.nan)
+    change[:, 1:] = np.diff(totals, axis=1)
+    previous = np.full_like(totals, np.nan)
+    previous[:, 1:] = totals[:, :-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change_pct = np.where(previous == 0, np.nan, change / previous)
+
+    return [
+        CategoryTimeSeries(
+            category=category,
+            totals=totals[i].tolist(),
+            rolling_avg=rolling_avg[i].tolist(),
+            change=_optional(change[i]),
+            change_pct=_optional(change_pct[i]),
+        )
+        for i, category in enumerate(categories)
+    ]
+
+def _converted_totals(
+    db: Session,
+    params: dict,
+    buckets: List[datetime.date],
+    granularity: str,
+    currency: str,
+) -> Tuple[List[str], np.ndarray]:
+    """
+    Matriz categoría x bucket en 'currency': los totales diarios por divisa se leen por lotes de
+    FX_BATCH_SIZE filas y cada lote se convierte y se agrega de una vez (TransactionFrame).
+    """
+    edges = buckets + [next_bucket_start(buckets[-1], granularity)]
+    by_category: Dict[str, np.ndarray] = {}
+    result = db.execute(_DAILY_TOTALS_BY_CURRENCY.execution_options(yield_per=settings.FX_BATCH_SIZE), params)
+    for batch in result.partitions():
+        frame = TransactionFrame.from_rows(
+            (day, total, False, "", category, row_currency) for day, row_currency, category, total in batch
+        ).in_currency(fx_rates, currency)
+        categories, matrix = frame.sum_by_category_and_window(edges)
+        for category, totals in zip(categories, matrix):
+            if category in by_category:
+                by_category[category] += totals
+            else:
+                by_category[category] = totals
+    categories = sorted(by_category)
+    if not categories:
+        return [], np.zeros((0, len(buckets)), dtype=np.float64)
+    return categories, np.vstack([by_category[category] for category in categories])
+
+def spending_timeseries(
+    db: Session,
+    user_id: int,
+    start: datetime.date,
+    end: datetime.date,
+    granularity: str,
+    window: int,
+    currency: Optional[str] = None,
+) -> SpendingTimeSeries:
+    """
+    Gasto por categoría en buckets de día/semana/mes, con media móvil y variaciones, en
+    'currency' (por defecto BASE_CURRENCY; debe tener tipos en fx_rates).
+    """
+    currency = (currency or settings.BASE_CURRENCY).upper()
+    buckets = bucket_range(start, end, granularity)
+    start = buckets[0] # Alinear al inicio del primer bucket para no cortarlo a la mitad
+    params = {
+        "user_id": user_id,
+        "start": start,
+        "end": end,
+        "uncategorized": UNCATEGORIZED_CATEGORY,
+        "excluded": NON_SPENDING_CATEGORIES,
+    }
+
+    currencies = {(code or settings.BASE_CURRENCY).upper() for code in db.execute(_CURRENCIES, params).scalars()}
+    if currencies - {currency}:
+        # Hay importes en otra divisa: no se pueden sumar en SQL tal cual
+        key = (f"{user_id}:{current_version(db, user_id)}:{currency}:{granularity}:"
+               f"{start.isoformat()}:{end.isoformat()}:{fx_rates.version}")
+        cached = _converted_totals_cache.get(key)
+        if cached is None:
+            categories, matrix = _converted_totals(db, params, buckets, granularity, currency)
+            _converted_totals_cache.set(key, (categories, matrix.tolist()))
+        else:
+            categories = cached[0]
+            matrix = np.asarray(cached[1], dtype=np.float64).reshape(len(categories), len(buckets))
+        series = _series_from_matrix(categories, matrix, window)
+    elif db.get_bind().dialect.name == "postgresql":
+        rows = db.execute(_POSTGRES_TIMESERIES, {
+            **params,
+            "granularity": granularity,
+            "last_bucket": buckets[-1],
+            "step": f"1 {granularity}",
+            "preceding": window - 1,
+        }).all()
+        series = _series_from_postgres(rows)
+    else:
+        rows = db.execute(_sqlite_totals(granularity), params).all()
+        series = _series_from_totals(rows, buckets, window)
+
+    return SpendingTimeSeries(
+        currency=currency,
+        granularity=granularity,
+        start_date=start,
+        end_date=end,
+        window=window,
+        buckets=buckets,
+        series=series,
+    )
@@ -0,0 +1,261 @@
+import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+
+from ..core.config import settings
+from ..models.budget import AlertOutbox, Budget, BudgetAlertRule, BudgetPeriodTotal
+from ..models.transaction import Transaction, TransactionCategory
+from .analytics_service import bucket_start, next_bucket_start
+from .fx_service import fx_rates, to_days
+from .transaction_frame import from_day
+
+# --- Presupuestos y Alertas Incrementales ---
+# Cada transacción de gasto se aplica UNA vez (la misma reclamación de transactions.stats_applied
+# que el motor de insights) y, en esa misma transacción de BD:
+#   1. Se buscan sólo los presupuestos de las categorías del lote (índice user_id, category).
+#   2. Los importes del lote se convierten a la divisa de cada presupuesto y se agrupan por
+#      periodo con NumPy: un incremento por tripleta (usuario, categoría, periodo) afectada.
+#   3. Cada incremento es un upsert atómico sobre 'budget_period_totals' que devuelve el total
+#      nuevo; un umbral se dispara si el total anterior estaba por debajo y el nuevo no.
+#   4. Las alertas disparadas se escriben en 'alert_outbox' (una por presupuesto, periodo y umbral).
+# El coste es proporcional al lote: no se recorre el histórico ni los demás presupuestos.
+# Si Plaid elimina una transacción aplicada o cambia su importe, fecha o divisa, se resta con los
+# valores con que se aplicó (transactions.applied_*) y vuelve a aplicarse con los nuevos.
+# Sólo se disparan alertas del periodo en curso: las transacciones antiguas (carga inicial del
+# histórico) actualizan sus totales pero no avisan de periodos ya cerrados.
+
+PERIODS = ("month", "week")
+
+PERIOD_NAMES = {"month": "este mes", "week": "esta semana"}
+
+def period_starts(days: np.ndarray, period: str) -> np.ndarray:
+    """Inicio del periodo (días desde 1970-01-01) de cada día: lunes de la semana o día 1 del mes."""
+    days = np.asarray(days, dtype=np.int64)
+    if period == "week":
+        return days - (days + 3) % 7 # 1970-01-01 fue jueves
+    months = days.astype("datetime64[D]").astype("datetime64[M]")
+    return months.astype("datetime64[D]").astype(np.int64)
+
+def current_period_start(period: str, today: Optional[datetime.date] = None) -> datetime.date:
+    return bucket_start(today or datetime.date.today(), period)
+
+def _insert(db: Session, table):
+    """INSERT del dialecto (con ON CONFLICT): PostgreSQL o SQLite."""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+# --- Totales y Disparo de Alertas ---
+
+def _increment_total(db: Session, budget_id: int, period_start: datetime.date, delta: float) -> float:
+    """Suma 'delta' al total del periodo (creándolo si no existe) y devuelve el total nuevo."""
+    statement = _insert(db, BudgetPeriodTotal).values(budget_id=budget_id, period_start=period_start, total=delta)
+    statement = statement.on_conflict_do_update(
+        index_elements=["budget_id", "period_start"],
+        set_={"total": BudgetPeriodTotal.total + statement.excluded.total, "updated_at": func.now()},
+    ).returning(BudgetPeriodTotal.total)
+    return float(db.execute(statement).scalar_one())
+
+def _alert_message(budget: Budget, threshold: float, spent: float) -> str:
+    when = PERIOD_NAMES.get(budget.period, budget.period)
+    if threshold >= 1:
+        return (f"Has superado tu presupuesto de {budget.category} {when}: "
+                f"{spent:.2f} de {budget.amount:.2f} {budget.currency}.")
+    return (f"Llevas {spent:.2f} {budget.currency} en {budget.category} {when}, "
+            f"el {spent / budget.amount:.0%} de tu presupuesto de {budget.amount:.2f} {budget.currency}.")
+
+def _fire_alerts(db: Session, budget: Budget, period_start: datetime.date, previous: float, total: float) -> int:
+    """Escribe en el outbox los umbrales cruzados por el paso de 'previous' a 'total'."""
+    rows = [
+        {
+            "user_id": budget.user_id,
+            "budget_id": budget.id,
+            "kind": "budget_threshold",
+            "category": budget.category,
+            "period_start": period_start,
+            "threshold": rule.threshold,
+            "spent": total,
+            "budget_amount": budget.amount,
+            "currency": budget.currency,
+            "message": _alert_message(budget, rule.threshold, total),
+        }
+        for rule in budget.rules
+        if previous < rule.threshold * budget.amount <= total
+    ]
+    if not rows:
+        return 0
+    statement = _insert(db, AlertOutbox).on_conflict_do_nothing(
+        index_elements=["budget_id", "period_start", "threshold"]
+    )
+    db.execute(statement, rows)
+    return len(rows)
+
+def _budget_deltas(
+    db: Session,
+    user_id: int,
+    rows: Sequence[Tuple[datetime.date, str, float, Optional[str]]],
+) -> Iterator[Tuple[Budget, datetime.date, float]]:
+    """(presupuesto, inicio del periodo, importe) de las filas, en la divisa de cada presupuesto afectado."""
+    if not rows:
+        return
+    budgets = (
+        db.query(Budget)
+        .filter(Budget.user_id == user_id, Budget.category.in_({row[1] for row in rows}))
+        .all()
+    )
+    if not budgets:
+        return
+
+    days = to_days(row[0] for row in rows)
+    amounts = np.asarray([row[2] for row in rows], dtype=np.float64)
+    currency_codes = fx_rates.codes(row[3] for row in rows)
+    categories = np.asarray([row[1] for row in rows], dtype=object)
+    for budget in budgets:
+        selected = categories == budget.category
+        converted = fx_rates.convert(amounts[selected], currency_codes[selected], days[selected], budget.currency)
+        known = ~np.isnan(converted)
+        if not known.any():
+            continue
+        starts, index = np.unique(period_starts(days[selected][known], budget.period), return_inverse=True)
+        deltas = np.bincount(index, weights=converted[known])
+        for start, delta in zip(starts, deltas):
+            yield budget, from_day(start), float(delta)
+
+def evaluate_transactions(
+    db: Session,
+    user_id: int,
+    rows: Sequence[Tuple[datetime.date, str, float, Optional[str]]],
+) -> int:
+    """
+    Aplica a los presupuestos del usuario las transacciones de gasto recién reclamadas
+    (fecha, categoría, importe, divisa) y escribe las alertas disparadas. Sin commit: forma
+    parte de la transacción que marca las filas como aplicadas.
+
+    Returns:
+        Número de alertas escritas en el outbox.
+    """
+    fired = 0
+    for budget, period_start, delta in _budget_deltas(db, user_id, rows):
+        total = _increment_total(db, budget.id, period_start, delta)
+        if period_start == current_period_start(budget.period):
+            fired += _fire_alerts(db, budget, period_start, total - delta, total)
+    if fired:
+        print(f"DEBUG: {fired} alertas de presupuesto en el outbox del usuario {user_id}.")
+    return fired
+
+def subtract_transactions(
+    db: Session,
+    user_id: int,
+    rows: Sequence[Tuple[datetime.date, str, float, Optional[str]]],
+) -> None:
+    """
+    Resta de los presupuestos transacciones aplicadas antes, con la (fecha, categoría, importe,
+    divisa) con que se aplicaron. Las alertas ya escritas se conservan: si el total vuelve a
+    cruzar el umbral en el mismo periodo, el outbox no las repite. Sin commit.
+    """
+    for budget, period_start, delta in _budget_deltas(db, user_id, rows):
+        _increment_total(db, budget.id, period_start, -delta)
+
+# --- Gestión de Presupuestos ---
+
+def _period_spending(db: Session, budget: Budget, period_start: datetime.date) -> float:
+    """
+    Gasto ya aplicado de la categoría en un periodo, en la divisa del presupuesto. Sólo se usa
+    al crear el presupuesto (una consulta por rango de fechas del periodo, no del histórico).
+    """
+    rows = db.execute(
+        select(Transaction.date, Transaction.amount, Transaction.iso_currency_code)
+        .join(TransactionCategory, TransactionCategory.transaction_id == Transaction.transaction_id)
+        .where(
+            Transaction.user_id == budget.user_id,
+            Transaction.date >= period_start,
+            Transaction.date < next_bucket_start(period_start, budget.period),
+            Transaction.stats_applied.is_(True),
+            TransactionCategory.category == budget.category,
+        )
+    ).all()
+    if not rows:
+        return 0.0
+    converted = fx_rates.convert(
+        np.asarray([row[1] for row in rows], dtype=np.float64),
+        fx_rates.codes(row[2] for row in rows),
+        to_days(row[0] for row in rows),
+        budget.currency,
+    )
+    return float(np.nansum(converted))
+
+def create_budget(
+    db: Session,
+    user_id: int,
+    category: str,
+    amount: float,
+    period: str,
+    currency: Optional[str],
+    thresholds: Iterable[float],
+) -> Tuple[Budget, datetime.date, float]:
+    """
+    Crea el presupuesto con sus umbrales e inicializa el total del periodo en curso con el gasto
+    ya aplicado (los umbrales que ya se superan se disparan en ese momento).
+    Devuelve (presupuesto, inicio del periodo en curso, gasto acumulado), como list_budgets.
+    """
+    budget = Budget(
+        user_id=user_id,
+        category=category,
+        period=period,
+        amount=amount,
+        currency=(currency or settings.BASE_CURRENCY).upper(),
+        rules=[BudgetAlertRule(threshold=threshold) for threshold in sorted(set(thresholds))],
+    )
+    db.add(budget)
+    db.flush()
+    period_start = current_period_start(period)
+    spent = _period_spending(db, budget, period_start)
+    db.add(BudgetPeriodTotal(budget_id=budget.id, period_start=period_start, total=spent))
+    _fire_alerts(db, budget, period_start, 0.0, spent)
+    db.commit()
+    db.refresh(budget)
+    return budget, period_start, spent
+
+def list_budgets(db: Session, user_id: int) -> List[Tuple[Budget, datetime.date, float]]:
+    """Presupuestos del usuario con el inicio y el total de su periodo en curso."""
+    budgets = db.query(Budget).filter(Budget.user_id == user_id).order_by(Budget.id).all()
+    current = {period: current_period_start(period) for period in PERIODS}
+    totals: Dict[Tuple[int, datetime.date], float] = {}
+    if budgets:
+        totals = {
+            (row.budget_id, row.period_start): row.total for row in db.query(BudgetPeriodTotal).filter(
+                BudgetPeriodTotal.budget_id.in_([budget.id for budget in budgets]),
+                BudgetPeriodTotal.period_start.in_(list(current.values())),
+            )
+        }
+    return [
+        (budget, current[budget.period], totals.get((budget.id, current[budget.period]), 0.0))
+        for budget in budgets
+    ]
+
+def delete_budget(db: Session, user_id: int, budget_id: int) -> bool:
+    """Borra el presupuesto con sus umbrales, totales y alertas. False si no existe."""
+    budget = db.query(Budget).filter(Budget.id == budget_id, Budget.user_id == user_id).first()
+    if budget is None:
+        return False
+    # Explícito (no sólo ON DELETE CASCADE): SQLite no aplica las claves foráneas por defecto
+    db.query(BudgetPeriodTotal).filter(BudgetPeriodTotal.budget_id == budget_id).delete(synchronize_session=False)
+    db.query(AlertOutbox).filter(AlertOutbox.budget_id == budget_id).delete(synchronize_session=False)
+    db.delete(budget)
+    db.commit()
+    return True
+
+def load_alerts(db: Session, user_id: int, limit: int = 50) -> List[AlertOutbox]:
+    """Últimas alertas del usuario (entregadas o no), de la más reciente a la más antigua."""
+    return (
+        db.query(AlertOutbox)
+        .filter(AlertOutbox.user_id == user_id)
+        .order_by(AlertOutbox.created_at.desc(), AlertOutbox.id.desc())
+        .limit(limit)
+        .all()
+    )
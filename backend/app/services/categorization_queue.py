@@ -0,0 +1,360 @@
+import asyncio
+import datetime
+import os
+import random
+import socket
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import and_, func, insert, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..db.database import SessionLocal, engine
+from ..models.categorization_job import CategorizationJob
+from ..models.transaction import TransactionCategory
+from .categorization_store import save_categories
+from .ia_service import categorize_with_source, knn_categorizer, SOURCE_KNN, SOURCE_LOCAL, SOURCE_MODEL, SOURCE_NONE, SOURCE_THROTTLED
+
+# --- Cola Persistente de Categorización ---
+# Las transacciones nuevas se encolan en la tabla categorization_jobs (una fila por transacción)
+# y los workers las categorizan fuera de la petición: kNN local en lote y, para el resto, el
+# modelo de Hugging Face (ia_service). Cada worker reclama un lote con un único UPDATE:
+#   - PostgreSQL: UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED) RETURNING,
+#     así varios workers (y procesos) nunca reclaman el mismo trabajo ni se esperan entre sí.
+#   - SQLite: la misma sentencia sin FOR UPDATE; SQLite serializa las escrituras y el UPDATE es atómico.
+# Un fallo (o un resultado sin valor, SOURCE_NONE) se reintenta con backoff exponencial;
+# tras CATEGORIZATION_MAX_ATTEMPTS el trabajo pasa a 'dead' (se reencola con el CLI). Un trabajo
+# 'dead' es terminal: el dashboard cuenta su gasto como UNCATEGORIZED_CATEGORY, no como pendiente.
+# La categoría local (SOURCE_LOCAL: el breaker de Hugging Face está abierto) es sólo un fallback:
+# no se guarda ni cuenta como intento; el trabajo se reprograma (defer_jobs) hasta que el modelo
+# vuelva o hasta CATEGORIZATION_LOCAL_MAX_AGE_SECONDS, y sólo entonces se acepta como definitiva.
+# Con el limitador saturado (SOURCE_THROTTLED) el trabajo también se reprograma sin gastar intento:
+# una carga masiva no debe acabar en 'dead' sólo por el throttling.
+# Un trabajo 'running' cuyo worker murió se vuelve a reclamar tras CATEGORIZATION_LEASE_SECONDS.
+# Los workers se ejecutan con: python -m app.jobs.categorization_worker
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_DEAD = "dead"
+
+ClaimedJob = Tuple[int, int, str, str, int, datetime.datetime] # (id, user_id, transaction_id, name, attempts, created_at)
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+# --- Encolado ---
+
+def _insert_ignoring_duplicates(db: Session, rows: List[dict]) -> None:
+    """INSERT que ignora las transacciones ya encoladas (ON CONFLICT DO NOTHING), en un executemany."""
+    table = CategorizationJob.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        statement = postgresql.insert(table).on_conflict_do_nothing(index_elements=["transaction_id"])
+    elif dialect == "sqlite":
+        statement = sqlite.insert(table).on_conflict_do_nothing(index_elements=["transaction_id"])
+    else:
+        existing = {
+            row[0] for row in db.query(CategorizationJob.transaction_id)
+            .filter(CategorizationJob.transaction_id.in_([row["transaction_id"] for row in rows])).all()
+        }
+        statement, rows = insert(table), [row for row in rows if row["transaction_id"] not in existing]
+    if rows:
+        db.execute(statement, rows)
+
+def enqueue(db: Session, user_id: int, entries: Sequence[Tuple[str, str]]) -> int:
+    """
+    Encola (transaction_id, name) para categorizar, salvo las ya categorizadas o encoladas.
+    No hace commit: se confirma con la transacción de quien llama.
+
+    Returns:
+        Número de transacciones candidatas a encolar.
+    """
+    entries = {transaction_id: name for transaction_id, name in entries if transaction_id and name}
+    if not entries:
+        return 0
+    categorized = {
+        row[0] for row in db.query(TransactionCategory.transaction_id)
+        .filter(TransactionCategory.transaction_id.in_(list(entries))).all()
+    }
+    now = _utcnow()
+    rows = [
+        {"transaction_id": transaction_id, "user_id": user_id, "name": name,
+         "status": STATUS_PENDING, "attempts": 0, "available_at": now}
+        for transaction_id, name in entries.items() if transaction_id not in categorized
+    ]
+    if rows:
+        _insert_ignoring_duplicates(db, rows)
+    return len(rows)
+
+def enqueue_now(user_id: int, entries: Sequence[Tuple[str, str]]) -> int:
+    """Encola con su propia sesión (para llamar en un hilo, fuera de la petición)."""
+    db = SessionLocal()
+    try:
+        count = enqueue(db, user_id, entries)
+        db.commit()
+        return count
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR: No se pudieron encolar categorizaciones para usuario {user_id}: {e}")
+        return 0
+    finally:
+        db.close()
+
+# Referencias fuertes a los encolados en segundo plano (evita que el GC las cancele)
+_background: Set[asyncio.Task] = set()
+
+def enqueue_in_background(user_id: int, entries: Sequence[Tuple[str, str]]) -> None:
+    """Encola sin añadir latencia a la petición."""
+    if not entries:
+        return
+    task = asyncio.ensure_future(asyncio.to_thread(enqueue_now, user_id, list(entries)))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+# --- Reclamación y Cierre (síncronos, en un hilo) ---
+
+def claim_jobs(worker_id: str, limit: int) -> List[ClaimedJob]:
+    """Reclama hasta 'limit' trabajos disponibles (pendientes o con la reserva caducada)."""
+    now = _utcnow()
+    lease_expired = now - datetime.timedelta(seconds=settings.CATEGORIZATION_LEASE_SECONDS)
+    claimable = (
+        select(CategorizationJob.id)
+        .where(or_(
+            and_(CategorizationJob.status == STATUS_PENDING, CategorizationJob.available_at <= now),
+            and_(CategorizationJob.status == STATUS_RUNNING, CategorizationJob.locked_at < lease_expired),
+        ))
+        .order_by(CategorizationJob.available_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    statement = (
+        update(CategorizationJob)
+        .where(CategorizationJob.id.in_(claimable))
+        .values(status=STATUS_RUNNING, locked_at=now, locked_by=worker_id, attempts=CategorizationJob.attempts + 1)
+        .returning(
+            CategorizationJob.id, CategorizationJob.user_id, CategorizationJob.transaction_id,
+            CategorizationJob.name, CategorizationJob.attempts, CategorizationJob.created_at,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    with engine.begin() as connection:
+        return [tuple(row) for row in connection.execute(statement)]
+
+def complete_jobs(job_ids: List[int]) -> None:
+    if not job_ids:
+        return
+    with engine.begin() as connection:
+        connection.execute(
+            update(CategorizationJob)
+            .where(CategorizationJob.id.in_(job_ids))
+            .values(status=STATUS_DONE, locked_at=None, locked_by=None, last_error=None)
+        )
+
+def backoff_seconds(attempts: int) -> float:
+    """Backoff exponencial con jitter: base * 2^(intentos-1), acotado."""
+    delay = settings.CATEGORIZATION_BACKOFF_SECONDS * (2 ** max(attempts - 1, 0))
+    return min(delay, settings.CATEGORIZATION_BACKOFF_MAX_SECONDS) * random.uniform(0.8, 1.2)
+
+def fail_jobs(failures: List[Tuple[ClaimedJob, str]]) -> int:
+    """
+    Reprograma los trabajos fallidos o los pasa a 'dead' si agotaron los intentos.
+
+    Returns:
+        Número de trabajos enviados a 'dead'.
+    """
+    if not failures:
+        return 0
+    now = _utcnow()
+    dead = 0
+    with engine.begin() as connection:
+        for (job_id, _, transaction_id, _, attempts, _), error in failures:
+            values = {"locked_at": None, "locked_by": None, "last_error": error[:1000]}
+            if attempts >= settings.CATEGORIZATION_MAX_ATTEMPTS:
+                dead += 1
+                values["status"] = STATUS_DEAD
+                print(f"ERROR: Categorización de {transaction_id} descartada tras {attempts} intentos: {error}")
+            else:
+                values["status"] = STATUS_PENDING
+                values["available_at"] = now + datetime.timedelta(seconds=backoff_seconds(attempts))
+            connection.execute(update(CategorizationJob).where(CategorizationJob.id == job_id).values(**values))
+    return dead
+
+def defer_jobs(jobs: List[ClaimedJob], delay_seconds: float, reason: str) -> None:
+    """
+    Reprograma trabajos que no obtuvieron respuesta del modelo por una causa pasajera (breaker
+    abierto, limitador saturado) para dentro de ~delay_seconds, sin gastar el intento que sumó
+    la reclamación.
+    """
+    if not jobs:
+        return
+    now = _utcnow()
+    with engine.begin() as connection:
+        for job_id, _, _, _, attempts, _ in jobs:
+            connection.execute(
+                update(CategorizationJob).where(CategorizationJob.id == job_id).values(
+                    status=STATUS_PENDING, attempts=max(attempts - 1, 0), locked_at=None, locked_by=None,
+                    available_at=now + datetime.timedelta(seconds=delay_seconds * random.uniform(0.8, 1.2)),
+                    last_error=reason,
+                )
+            )
+
+def _local_is_final(job: ClaimedJob) -> bool:
+    """True si el trabajo lleva encolado lo bastante para aceptar la categoría local."""
+    created_at = job[5]
+    if created_at is None:
+        return True
+    if created_at.tzinfo is None: # SQLite devuelve fechas sin zona (guardadas en UTC)
+        created_at = created_at.replace(tzinfo=datetime.timezone.utc)
+    return (_utcnow() - created_at).total_seconds() >= settings.CATEGORIZATION_LOCAL_MAX_AGE_SECONDS
+
+def dead_transaction_ids(db: Session, user_id: int, transaction_ids: Sequence[str]) -> Set[str]:
+    """Transacciones (de entre las dadas) cuyo trabajo está en 'dead': no se categorizarán solas."""
+    if not transaction_ids:
+        return set()
+    return {
+        row[0] for row in db.query(CategorizationJob.transaction_id).filter(
+            CategorizationJob.user_id == user_id,
+            CategorizationJob.status == STATUS_DEAD,
+            CategorizationJob.transaction_id.in_(list(transaction_ids)),
+        )
+    }
+
+def requeue_dead(limit: Optional[int] = None) -> int:
+    """Devuelve los trabajos 'dead' a la cola con los intentos a cero."""
+    dead = select(CategorizationJob.id).where(CategorizationJob.status == STATUS_DEAD)
+    if limit:
+        dead = dead.limit(limit)
+    with engine.begin() as connection:
+        result = connection.execute(
+            update(CategorizationJob)
+            .where(CategorizationJob.id.in_(dead))
+            .values(status=STATUS_PENDING, attempts=0, available_at=_utcnow(), last_error=None)
+        )
+        return result.rowcount
+
+def queue_stats() -> Dict[str, int]:
+    """Número de trabajos por estado."""
+    with engine.connect() as connection:
+        rows = connection.execute(
+            select(CategorizationJob.status, func.count()).group_by(CategorizationJob.status)
+        ).all()
+    return {status: count for status, count in rows}
+
+# --- Procesamiento ---
+
+def _persist_results(results: List[Tuple[ClaimedJob, str, str]]) -> None:
+    """Guarda las categorías (por usuario) y marca los trabajos como terminados."""
+    by_user: Dict[int, List[Tuple[str, str, str, str]]] = {}
+    for (_, user_id, transaction_id, name, _, _), category, source in results:
+        by_user.setdefault(user_id, []).append((transaction_id, name, category, source))
+    for user_id, entries in by_user.items():
+        save_categories(user_id, entries)
+    complete_jobs([job[0] for job, _, _ in results])
+
+    # Las respuestas del modelo amplían el vocabulario de comercios del índice kNN
+    model_entries = [(job[3], category) for job, category, source in results if source == SOURCE_MODEL]
+    if model_entries and knn_categorizer.learn([n for n, _ in model_entries], [c for _, c in model_entries]):
+        knn_categorizer.rebuild()
+
+async def process_jobs(jobs: List[ClaimedJob]) -> Tuple[int, int]:
+    """
+    Categoriza un lote reclamado: kNN local primero (una sola multiplicación de matrices)
+    y el modelo en paralelo para lo que el kNN no resuelve con confianza.
+
+    Returns:
+        (trabajos terminados, trabajos fallidos o reprogramados).
+    """
+    results: List[Tuple[ClaimedJob, str, str]] = []
+    remaining: List[ClaimedJob] = []
+    for job, (category, _) in zip(jobs, knn_categorizer.predict([job[3] for job in jobs])):
+        if category is not None:
+            results.append((job, category, SOURCE_KNN))
+        else:
+            remaining.append(job)
+
+    failures: List[Tuple[ClaimedJob, str]] = []
+    deferred: List[ClaimedJob] = []
+    throttled: List[ClaimedJob] = []
+    outcomes = await asyncio.gather(*(categorize_with_source(job[3]) for job in remaining), return_exceptions=True)
+    for job, outcome in zip(remaining, outcomes):
+        if isinstance(outcome, BaseException):
+            failures.append((job, f"{type(outcome).__name__}: {outcome}"))
+        elif outcome[1] == SOURCE_THROTTLED:
+            throttled.append(job) # Limitador saturado: no es un fallo del modelo
+        elif outcome[1] == SOURCE_NONE:
+            failures.append((job, f"Sin resultado del modelo ({outcome[0]})"))
+        elif outcome[1] == SOURCE_LOCAL and not _local_is_final(job):
+            deferred.append(job) # Caída pasajera del modelo: no fijar para siempre la categoría local
+        else:
+            results.append((job, outcome[0], outcome[1]))
+
+    if results:
+        await asyncio.to_thread(_persist_results, results)
+    if failures:
+        await asyncio.to_thread(fail_jobs, failures)
+    if deferred:
+        await asyncio.to_thread(
+            defer_jobs, deferred, settings.CATEGORIZATION_LOCAL_RETRY_SECONDS,
+            "Modelo no disponible: categoría local descartada, se reintentará",
+        )
+    if throttled:
+        await asyncio.to_thread(
+            defer_jobs, throttled, settings.CATEGORIZATION_THROTTLED_RETRY_SECONDS,
+            "Limitador de Hugging Face saturado, se reintentará",
+        )
+    return len(results), len(failures) + len(deferred) + len(throttled)
+
+async def run_worker(
+    worker_id: str,
+    stop: asyncio.Event,
+    batch_size: Optional[int] = None,
+    poll_seconds: Optional[float] = None,
+    once: bool = False,
+) -> int:
+    """
+    Bucle de un worker: reclama un lote, lo procesa y repite; con la cola vacía espera
+    poll_seconds (o hasta 'stop'). Con once=True termina al vaciar la cola.
+
+    Returns:
+        Número de trabajos procesados.
+    """
+    batch_size = batch_size or settings.CATEGORIZATION_BATCH_SIZE
+    poll_seconds = settings.CATEGORIZATION_POLL_SECONDS if poll_seconds is None else poll_seconds
+    processed = 0
+    while not stop.is_set():
+        try:
+            jobs = await asyncio.to_thread(claim_jobs, worker_id, batch_size)
+            if jobs:
+                done, failed = await process_jobs(jobs)
+                processed += done + failed
+                continue
+        except Exception as e:
+            print(f"ERROR: Worker de categorización {worker_id}: {e}")
+        if once:
+            break
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+    return processed
+
+async def run_worker_pool(
+    concurrency: int,
+    stop: asyncio.Event,
+    batch_size: Optional[int] = None,
+    poll_seconds: Optional[float] = None,
+    once: bool = False,
+) -> int:
+    """Ejecuta 'concurrency' workers en el loop actual hasta que se active 'stop'."""
+    name = worker_name()
+    print(f"DEBUG: Cola de categorización: {concurrency} workers en {name}.")
+    processed = await asyncio.gather(*(
+        run_worker(f"{name}/{n}", stop, batch_size, poll_seconds, once) for n in range(max(concurrency, 1))
+    ))
+    return sum(processed)
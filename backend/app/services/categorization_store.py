@@ -0,0 +1,103 @@
+import asyncio
+from typing import Dict, List, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from ..db.database import SessionLocal
+from ..models.transaction import TransactionCategory
+from ..schemas.plaid import PlaidTransaction
+from .insight_service import apply_transactions
+from .live_updates import publish_changes
+from .ia_service import knn_categorizer, label_from_plaid_category, SOURCE_MODEL, SOURCE_LOCAL, SOURCE_KNN
+
+# Orígenes que se persisten; el resto (sin resultado real) lo reintenta la cola de categorización
+PERSISTED_SOURCES = {SOURCE_MODEL, SOURCE_LOCAL, SOURCE_KNN}
+
+# --- Lectura / Escritura ---
+
+def load_categories(db: Session, user_id: int, transaction_ids: List[str]) -> Dict[str, str]:
+    """Devuelve {transaction_id: categoría} para las transacciones ya categorizadas del usuario."""
+    if not transaction_ids:
+        return {}
+    rows = (
+        db.query(TransactionCategory.transaction_id, TransactionCategory.category)
+        .filter(TransactionCategory.user_id == user_id, TransactionCategory.transaction_id.in_(transaction_ids))
+        .all()
+    )
+    return {transaction_id: category for transaction_id, category in rows}
+
+def save_categories(user_id: int, entries: List[Tuple[str, str, str, str]]) -> List[Tuple[str, str, str, str]]:
+    """
+    Guarda categorías nuevas. Cada entrada es (transaction_id, name, category, source).
+    Abre su propia sesión porque se ejecuta fuera de la petición (en segundo plano o en los
+    workers de la cola, en un hilo).
+
+    Returns:
+        Las entradas que no existían y se insertaron.
+    """
+    entries = [entry for entry in entries if entry[3] in PERSISTED_SOURCES]
+    if not entries:
+        return []
+    db = SessionLocal()
+    try:
+        ids = [entry[0] for entry in entries]
+        existing = {
+            row[0] for row in db.query(TransactionCategory.transaction_id)
+            .filter(TransactionCategory.transaction_id.in_(ids)).all()
+        }
+        inserted = []
+        for transaction_id, name, category, source in entries:
+            if transaction_id in existing:
+                continue
+            existing.add(transaction_id)
+            db.add(TransactionCategory(transaction_id=transaction_id, user_id=user_id, name=name, category=category, source=source))
+            inserted.append((transaction_id, name, category, source))
+        db.commit()
+        # Las transacciones recién categorizadas entran en las estadísticas de insights
+        apply_transactions(db, user_id, [entry[0] for entry in inserted])
+        if inserted:
+            publish_changes(db, user_id, "categories")
+        return inserted
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR: No se pudieron guardar categorías para usuario {user_id}: {e}")
+        return []
+    finally:
+        db.close()
+
+# --- Categorizador kNN Local ---
+
+def learn_from_plaid(transactions: List[PlaidTransaction]) -> None:
+    """Alimenta el índice kNN con las transacciones que traen categoría de Plaid."""
+    labeled = [(t.name, label_from_plaid_category(t.category)) for t in transactions if t.category]
+    if labeled and knn_categorizer.learn([name for name, _ in labeled], [label for _, label in labeled]):
+        _spawn(asyncio.to_thread(knn_categorizer.rebuild))
+
+def predict_locally(transactions: List[PlaidTransaction]) -> Dict[str, str]:
+    """
+    Categoriza en lote con el índice kNN (una multiplicación de matrices, sin llamadas externas).
+    Devuelve sólo las transacciones con confianza suficiente: {transaction_id: categoría}.
+    """
+    if not transactions:
+        return {}
+    predictions = knn_categorizer.predict([t.name for t in transactions])
+    return {
+        t.transaction_id: category
+        for t, (category, _) in zip(transactions, predictions)
+        if category is not None
+    }
+
+# --- Escritura en Segundo Plano ---
+
+# Referencias fuertes a las tareas de segundo plano (evita que el GC las cancele)
+_background: Set[asyncio.Task] = set()
+
+def _spawn(coroutine) -> None:
+    background = asyncio.ensure_future(coroutine)
+    _background.add(background)
+    background.add_done_callback(_background.discard)
+
+def persist_in_background(user_id: int, entries: List[Tuple[str, str, str, str]]) -> None:
+    """Guarda categorías ya resueltas (ej. kNN) sin bloquear la petición."""
+    if entries:
+        _spawn(asyncio.to_thread(save_categories, user_id, entries))
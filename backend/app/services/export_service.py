@@ -0,0 +1,347 @@
+import csv
+import datetime
+import gzip
+import io
+import os
+import uuid
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # Sin pyarrow sólo está disponible la exportación CSV
+    pa = None
+    pq = None
+
+from sqlalchemy import Select, Table, and_, delete, func, or_, select, update
+
+from ..core.config import settings
+from ..db.database import engine, SessionLocal
+from ..models.export_job import ExportJob
+from ..models.transaction import Transaction, TransactionCategory
+
+# --- Exportación de Transacciones (CSV / Parquet) ---
+# Se lee el histórico del usuario con un cursor del lado del servidor (stream_results) en lotes
+# de EXPORT_BATCH_SIZE filas y se escribe cada lote en cuanto llega: la memoria usada no depende
+# del tamaño del histórico. Parquet conserva los tipos (fechas, importes, booleanos).
+# Los trabajos en segundo plano no sobreviven a un reinicio del worker: maintain_jobs() (al
+# arrancar cada worker y con python -m app.jobs.export_cleanup) marca como 'failed' los que
+# llevan más de EXPORT_JOB_STALE_SECONDS sin latido (run_job renueva updated_at en cada lote) y
+# borra archivos y trabajos terminados hace más de EXPORT_RETENTION_SECONDS. Un trabajo sólo
+# termina ('done'/'failed') si sigue 'running': uno ya recuperado no vuelve a cambiar de estado.
+
+FORMATS = ("csv", "parquet")
+MEDIA_TYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+# Columnas exportadas, en orden: las de la transacción y su categoría asignada
+TRANSACTION_COLUMNS = ["transaction_id", "date", "name", "amount", "iso_currency_code", "pending", "account_id", "item_id"]
+COLUMN_NAMES = TRANSACTION_COLUMNS + ["category", "category_source"]
+
+PARQUET_SCHEMA = pa.schema([
+    ("transaction_id", pa.string()),
+    ("date", pa.date32()),
+    ("name", pa.string()),
+    ("amount", pa.float64()),
+    ("iso_currency_code", pa.string()),
+    ("pending", pa.bool_()),
+    ("account_id", pa.string()),
+    ("item_id", pa.string()),
+    ("category", pa.string()),
+    ("category_source", pa.string()),
+]) if pa is not None else None
+
+def parquet_available() -> bool:
+    return pa is not None
+
+def rows_statement(source: Table = Transaction.__table__) -> Select:
+    """
+    SELECT de las columnas exportadas sobre 'source' (la tabla de transacciones o una
+    partición con su misma estructura), con la categoría asignada.
+    """
+    source_columns = [source.c[name] for name in TRANSACTION_COLUMNS]
+    return (
+        select(*source_columns, TransactionCategory.category, TransactionCategory.source.label("category_source"))
+        .select_from(source)
+        .outerjoin(TransactionCategory, TransactionCategory.transaction_id == source.c.transaction_id)
+        .order_by(source.c.date, source.c.transaction_id)
+    )
+
+def _keyset_batches(statement: Select, batch_size: int) -> Iterator[Sequence[tuple]]:
+    """Lotes de 'statement' (de rows_statement) paginando por su orden (date, transaction_id), una consulta por lote."""
+    date_column = statement.selected_columns["date"]
+    id_column = statement.selected_columns["transaction_id"]
+    date_index, id_index = TRANSACTION_COLUMNS.index("date"), TRANSACTION_COLUMNS.index("transaction_id")
+    page = statement
+    while True:
+        with engine.connect() as conn:
+            batch = conn.execute(page.limit(batch_size)).all()
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            return
+        last_date, last_id = batch[-1][date_index], batch[-1][id_index]
+        page = statement.where(or_(date_column > last_date, and_(date_column == last_date, id_column > last_id)))
+
+def iter_row_batches(statement: Select, batch_size: int) -> Iterator[Sequence[tuple]]:
+    """
+    Lotes de filas (tuplas) de 'statement' con un cursor del lado del servidor.
+    Usa su propia conexión: el streaming de la respuesta sigue después de cerrar la sesión de la petición.
+    SQLite no tiene cursores del servidor y un SELECT a medio leer bloquea las escrituras de las demás
+    conexiones (ej. el latido de run_job): allí se pagina por la clave de orden, sin lecturas abiertas.
+    """
+    if engine.dialect.name == "sqlite":
+        yield from _keyset_batches(statement, batch_size)
+        return
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(statement)
+        for batch in result.partitions(batch_size):
+            yield batch
+
+def user_row_batches(user_id: int, batch_size: int) -> Iterator[Sequence[tuple]]:
+    """Lotes del histórico completo de un usuario."""
+    return iter_row_batches(rows_statement().where(Transaction.user_id == user_id), batch_size)
+
+# --- Escritores por Formato ---
+
+def _csv_chunks(batches: Iterator[Sequence[tuple]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMN_NAMES)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+class _ChunkSink(io.RawIOBase):
+    """Destino de escritura que acumula lo escrito para entregarlo por trozos (streaming)."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _record_batch(batch: Sequence[tuple]):
+    columns = list(zip(*batch)) if batch else [[] for _ in COLUMN_NAMES]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, PARQUET_SCHEMA)],
+        schema=PARQUET_SCHEMA,
+    )
+
+def _parquet_chunks(batches: Iterator[Sequence[tuple]]) -> Iterator[bytes]:
+    """Un row group por lote; cada row group se entrega en cuanto se escribe."""
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, PARQUET_SCHEMA, compression="zstd")
+    try:
+        for batch in batches:
+            writer.write_batch(_record_batch(batch))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain() # Footer
+
+def export_chunks(user_id: int, export_format: str, batch_size: Optional[int] = None) -> Iterator[bytes]:
+    """Bytes del archivo de exportación, generados lote a lote."""
+    batches = user_row_batches(user_id, batch_size or settings.EXPORT_BATCH_SIZE)
+    if export_format == "parquet":
+        if pa is None:
+            raise RuntimeError("pyarrow no está instalado: exportación Parquet no disponible.")
+        return _parquet_chunks(batches)
+    return _csv_chunks(batches)
+
+def write_file(path: str, export_format: str, batches: Iterator[Sequence[tuple]]) -> int:
+    """
+    Escribe los lotes en 'path' de forma atómica (archivo temporal + rename) y devuelve
+    el número de filas. Si 'path' termina en .gz el CSV se comprime con gzip.
+    """
+    rows = 0
+
+    def counted():
+        nonlocal rows
+        for batch in batches:
+            rows += len(batch)
+            yield batch
+
+    chunks = _parquet_chunks(counted()) if export_format == "parquet" else _csv_chunks(counted())
+    temp_path = path + ".tmp"
+    try:
+        with (gzip.open(temp_path, "wb") if path.endswith(".gz") else open(temp_path, "wb")) as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(temp_path, path) # El archivo sólo aparece completo
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return rows
+
+def export_filename(export_format: str) -> str:
+    return f"transactions_{datetime.date.today():%Y%m%d}.{export_format}"
+
+# --- Trabajos en Segundo Plano ---
+
+def create_job(db, user_id: int, export_format: str) -> ExportJob:
+    job = ExportJob(id=uuid.uuid4().hex, user_id=user_id, format=export_format, status="pending")
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+class JobAbandoned(Exception):
+    """El trabajo dejó de estar 'running' (recover_stale_jobs lo dio por perdido): se abandona la escritura."""
+
+def _update_running(db, job_id: str, **values) -> bool:
+    """Actualiza el trabajo sólo si sigue 'running'. False si ya no lo está."""
+    updated = db.execute(
+        update(ExportJob)
+        .where(ExportJob.id == job_id, ExportJob.status == "running")
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return bool(updated)
+
+def _with_heartbeat(db, job_id: str, batches: Iterator[Sequence[tuple]]) -> Iterator[Sequence[tuple]]:
+    """Renueva el latido del trabajo antes de cada lote; si ya no está 'running', lanza JobAbandoned."""
+    for batch in batches:
+        if not _update_running(db, job_id, updated_at=_utcnow()):
+            raise JobAbandoned(job_id)
+        yield batch
+
+def run_job(job_id: str) -> None:
+    """Genera el archivo de un trabajo (se ejecuta en un hilo, con su propia sesión)."""
+    db = SessionLocal()
+    try:
+        # Sólo un trabajo 'pending' pasa a 'running' (uno ya recuperado como 'failed' no se ejecuta)
+        claimed = db.execute(
+            update(ExportJob)
+            .where(ExportJob.id == job_id, ExportJob.status == "pending")
+            .values(status="running", updated_at=_utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        job = db.get(ExportJob, job_id) if claimed else None
+        if job is None:
+            return
+
+        os.makedirs(settings.EXPORT_DIR, exist_ok=True)
+        path = os.path.join(settings.EXPORT_DIR, f"{job.id}.{job.format}")
+        try:
+            batches = _with_heartbeat(db, job.id, user_row_batches(job.user_id, settings.EXPORT_BATCH_SIZE))
+            rows = write_file(path, job.format, batches)
+        except JobAbandoned:
+            print(f"ADVERTENCIA: Exportación {job.id} dada por perdida mientras se escribía; se abandona.")
+            return
+        except Exception as e:
+            print(f"ERROR: Falla en la exportación {job.id} del usuario {job.user_id}: {e}")
+            _update_running(db, job.id, status="failed", error=str(e), finished_at=_utcnow(), updated_at=_utcnow())
+            return
+        # Termina sólo si sigue 'running': si se recuperó como 'failed', el archivo no lo reclama nadie
+        if _update_running(db, job.id, status="done", file_path=path, rows=rows, finished_at=_utcnow(), updated_at=_utcnow()):
+            print(f"DEBUG: Exportación {job.id} terminada: {rows} filas en {path}")
+        else:
+            print(f"ADVERTENCIA: Exportación {job.id} dada por perdida antes de terminar; se descarta {path}.")
+            _remove_file(path)
+    finally:
+        db.close()
+
+# --- Recuperación y Limpieza ---
+
+STALE_JOB_ERROR = "El trabajo se interrumpió (reinicio del servidor); vuelve a solicitar la exportación."
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def recover_stale_jobs(db, job_id: Optional[str] = None) -> int:
+    """
+    Marca como 'failed' los trabajos 'pending'/'running' sin latido (updated_at) desde hace más
+    de EXPORT_JOB_STALE_SECONDS (su hilo ya no existe). Con 'job_id', sólo ese trabajo.
+    Un trabajo largo que sigue escribiendo lotes renueva su latido y no se toca.
+    """
+    now = _utcnow()
+    statement = (
+        update(ExportJob)
+        .where(
+            ExportJob.status.in_(("pending", "running")),
+            func.coalesce(ExportJob.updated_at, ExportJob.created_at)
+            < now - datetime.timedelta(seconds=settings.EXPORT_JOB_STALE_SECONDS),
+        )
+        .values(status="failed", error=STALE_JOB_ERROR, finished_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if job_id is not None:
+        statement = statement.where(ExportJob.id == job_id)
+    recovered = db.execute(statement).rowcount
+    db.commit()
+    return recovered
+
+def _remove_file(path: Optional[str]) -> None:
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"ADVERTENCIA: No se pudo borrar el archivo de exportación {path}: {e}")
+
+def cleanup_expired_jobs(db) -> int:
+    """
+    Borra los archivos y los trabajos terminados (done o failed) hace más de
+    EXPORT_RETENTION_SECONDS, y los temporales que dejó una escritura interrumpida.
+    """
+    cutoff = _utcnow() - datetime.timedelta(seconds=settings.EXPORT_RETENTION_SECONDS)
+    expired = db.execute(
+        select(ExportJob.id, ExportJob.file_path)
+        .where(ExportJob.status.in_(("done", "failed")), ExportJob.finished_at < cutoff)
+    ).all()
+    for _, path in expired:
+        _remove_file(path)
+    if expired:
+        db.execute(
+            delete(ExportJob).where(ExportJob.id.in_([job_id for job_id, _ in expired]))
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+
+    if os.path.isdir(settings.EXPORT_DIR):
+        stale_before = _utcnow().timestamp() - settings.EXPORT_JOB_STALE_SECONDS
+        for entry in os.scandir(settings.EXPORT_DIR):
+            if entry.name.endswith(".tmp") and entry.stat().st_mtime < stale_before:
+                _remove_file(entry.path)
+    return len(expired)
+
+def maintain_jobs() -> Tuple[int, int]:
+    """Recuperación y limpieza con su propia sesión. Devuelve (recuperados, borrados); nunca lanza."""
+    db = SessionLocal()
+    try:
+        recovered = recover_stale_jobs(db)
+        removed = cleanup_expired_jobs(db)
+        if recovered or removed:
+            print(f"DEBUG: Exportaciones: {recovered} trabajos interrumpidos marcados como fallidos, {removed} caducados borrados.")
+        return recovered, removed
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR: Falla en el mantenimiento de exportaciones: {e}")
+        return 0, 0
+    finally:
+        db.close()
@@ -0,0 +1,114 @@
+import functools
+import json
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..core.config import settings
+from ..schemas.investment import FundInfo
+
+# --- Catálogo de Fondos ESG en Memoria ---
+# Se carga una sola vez desde un archivo JSON local y se indexa para consultas rápidas:
+#   - Índices bitmap por etiqueta de 'esgFocus' (bits empaquetados, uint8): la intersección
+#     de etiquetas es un AND bit a bit sobre N/8 bytes.
+#   - Índices ordenados (permutaciones precalculadas) por cada métrica: ordenar y paginar
+#     el resultado filtrado es una selección vectorizada, sin sort por consulta.
+#   - Cada fondo se serializa a JSON al cargar; las respuestas se montan concatenando bytes
+#     y se cachean por parámetros de consulta.
+
+# Campos por los que se puede ordenar
+SORTABLE_FIELDS = ("annualizedReturn5y", "expenseRatio", "esgScore", "riskLevel", "fundName")
+
+
+class FundCatalog:
+
+    def __init__(self, path: str, cache_size: int):
+        self.path = path
+        self.funds: List[FundInfo] = []
+        self.featured: Optional[FundInfo] = None
+        self.tags: Dict[str, str] = {} # etiqueta normalizada -> etiqueta original
+        self._bitmaps: Dict[str, np.ndarray] = {} # etiqueta normalizada -> bits empaquetados
+        self._all: np.ndarray = np.zeros(0, dtype=np.uint8)
+        self._orders: Dict[Tuple[str, bool], np.ndarray] = {} # (campo, descendente) -> permutación
+        self._serialized: List[bytes] = []
+        self.query_json = functools.lru_cache(maxsize=cache_size)(self._query_json)
+
+    @staticmethod
+    def normalize_tag(tag: str) -> str:
+        return " ".join(tag.lower().split())
+
+    def load(self) -> None:
+        """Lee el archivo y reconstruye índices y serializaciones. Si falla, el catálogo queda vacío."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            disclaimer = data.get("disclaimer", "")
+            funds, featured = [], None
+            for entry in data.get("funds", []):
+                fund = FundInfo(
+                    keyMetricLabel="Rentabilidad Anualizada (5 Años - Ejemplo)",
+                    keyMetricValue=f"{entry['annualizedReturn5y']:.1f}%",
+                    disclaimer=disclaimer,
+                    **{k: v for k, v in entry.items() if k != "featured"},
+                )
+                funds.append(fund)
+                if entry.get("featured") and featured is None:
+                    featured = fund
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"ERROR: No se pudo cargar el catálogo de fondos ESG desde {self.path}: {e}")
+            funds, featured = [], None
+
+        count = len(funds)
+        tags: Dict[str, str] = {}
+        members: Dict[str, np.ndarray] = {}
+        for i, fund in enumerate(funds):
+            for tag in fund.esgFocus:
+                key = self.normalize_tag(tag)
+                tags.setdefault(key, tag)
+                members.setdefault(key, np.zeros(count, dtype=bool))[i] = True
+
+        orders = {}
+        for field in SORTABLE_FIELDS:
+            values = [getattr(fund, field) for fund in funds]
+            if field == "fundName":
+                ascending = np.array(sorted(range(count), key=lambda i: values[i].lower()), dtype=np.intp)
+                descending = ascending[::-1].copy()
+            else:
+                array = np.asarray(values, dtype=np.float64)
+                ascending = np.argsort(array, kind="stable")
+                descending = np.argsort(-array, kind="stable")
+            orders[(field, False)] = ascending
+            orders[(field, True)] = descending
+
+        self.funds = funds
+        self.featured = featured or (funds[0] if funds else None)
+        self.tags = tags
+        self._bitmaps = {key: np.packbits(mask) for key, mask in members.items()}
+        self._all = np.packbits(np.ones(count, dtype=bool))
+        self._orders = orders
+        self._serialized = [fund.model_dump_json().encode("utf-8") for fund in funds]
+        self.query_json.cache_clear()
+        print(f"DEBUG: Catálogo ESG cargado: {count} fondos, {len(tags)} etiquetas.")
+
+    def query(self, tags: Tuple[str, ...], sort_by: str, descending: bool) -> np.ndarray:
+        """Índices de los fondos que tienen TODAS las etiquetas, en el orden pedido."""
+        mask = self._all
+        for tag in tags:
+            bitmap = self._bitmaps.get(self.normalize_tag(tag))
+            if bitmap is None:
+                return np.zeros(0, dtype=np.intp) # Etiqueta desconocida: ningún fondo la tiene
+            mask = np.bitwise_and(mask, bitmap)
+        selected = np.unpackbits(mask, count=len(self.funds)).view(bool)
+        order = self._orders[(sort_by, descending)]
+        return order[selected[order]]
+
+    def _query_json(self, tags: Tuple[str, ...], sort_by: str, descending: bool, page: int, page_size: int) -> bytes:
+        """Respuesta de /investment/funds ya serializada (cacheada por parámetros)."""
+        matches = self.query(tags, sort_by, descending)
+        start = (page - 1) * page_size
+        items = b",".join(self._serialized[i] for i in matches[start:start + page_size])
+        header = f'{{"total":{len(matches)},"page":{page},"page_size":{page_size},"items":['.encode("utf-8")
+        return header + items + b"]}"
+
+fund_catalog = FundCatalog(settings.FUND_CATALOG_PATH, settings.FUND_CATALOG_CACHE_SIZE)
+fund_catalog.load()
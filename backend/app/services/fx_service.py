@@ -0,0 +1,119 @@
+import csv
+import datetime
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from ..core.config import settings
+
+# --- Tipos de Cambio Diarios en Memoria ---
+# Se cargan una sola vez desde un CSV local (fecha,divisa,tipo; tipo = unidades de la divisa por
+# 1 unidad de FX_RATES_QUOTE_CURRENCY) a una matriz NumPy día x divisa:
+#   - Fila = días desde la primera fecha del archivo, columna = código de divisa ('currencies').
+#   - Los días sin publicación (fines de semana, festivos) repiten el último tipo conocido; antes
+#     de la primera fecha se usa el primer tipo y después de la última, el último.
+# Convertir es indexar la matriz con los arrays de días y códigos de las filas: un lote entero
+# se convierte con unas pocas operaciones vectorizadas, sin bucles por fila en Python.
+# Los cruces entre dos divisas cualesquiera pasan por la divisa de referencia del archivo.
+
+_EPOCH = np.datetime64("1970-01-01", "D")
+
+
+def to_days(dates: Iterable[datetime.date]) -> np.ndarray:
+    """Días desde 1970-01-01 (mismo criterio que TransactionFrame.days)."""
+    return (np.asarray(list(dates), dtype="datetime64[D]") - _EPOCH).astype(np.int32)
+
+
+class FxRates:
+
+    def __init__(self, path: str, quote_currency: str):
+        self.path = path
+        self.quote_currency = quote_currency.upper()
+        self.currencies: List[str] = [self.quote_currency] # código -> divisa
+        self._index: Dict[str, int] = {self.quote_currency: 0}
+        self.start_day = 0
+        self.rates = np.ones((1, 1), dtype=np.float64) # día x divisa
+        self.version = "empty" # Cambia al recargar: forma parte de las claves de caché de los agregados
+
+    def load(self) -> None:
+        """Lee el archivo y reconstruye la matriz. Si falla, sólo queda la divisa de referencia."""
+        try:
+            days: List[int] = []
+            currency_names: List[str] = []
+            values: List[float] = []
+            with open(self.path, encoding="utf-8", newline="") as f:
+                lines = (line for line in f if line.strip() and not line.startswith("#"))
+                for row in csv.DictReader(lines):
+                    rate = float(row["rate"])
+                    if not rate > 0:
+                        raise ValueError(f"tipo no válido para {row['currency']} el {row['date']}: {rate}")
+                    days.append(datetime.date.fromisoformat(row["date"]).toordinal())
+                    currency_names.append(row["currency"].strip().upper())
+                    values.append(rate)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"ERROR: No se pudieron cargar los tipos de cambio desde {self.path}: {e}")
+            days, currency_names, values = [], [], []
+
+        currencies = [self.quote_currency] + sorted(set(currency_names) - {self.quote_currency})
+        index = {currency: code for code, currency in enumerate(currencies)}
+        if not days:
+            self.currencies, self._index = currencies, index
+            self.start_day, self.rates, self.version = 0, np.ones((1, len(currencies))), "empty"
+            return
+
+        ordinals = np.asarray(days, dtype=np.int64)
+        first, last = int(ordinals.min()), int(ordinals.max())
+        rates = np.full((last - first + 1, len(currencies)), np.nan)
+        rates[:, 0] = 1.0
+        rates[ordinals - first, [index[currency] for currency in currency_names]] = values
+
+        # Relleno hacia delante: cada día toma la última fila publicada de su columna
+        published = ~np.isnan(rates)
+        rows = np.where(published, np.arange(rates.shape[0])[:, None], 0)
+        np.maximum.accumulate(rows, axis=0, out=rows)
+        columns = np.arange(len(currencies))
+        rates = rates[rows, columns]
+        # Antes de la primera publicación de una divisa: su primer tipo
+        leading = np.isnan(rates)
+        if leading.any():
+            first_rows = published.argmax(axis=0)
+            rates[leading] = rates[first_rows, columns][np.nonzero(leading)[1]]
+
+        self.currencies, self._index = currencies, index
+        self.start_day = first - datetime.date(1970, 1, 1).toordinal()
+        self.rates = rates
+        self.version = f"{datetime.date.fromordinal(last).isoformat()}:{len(values)}"
+        print(f"DEBUG: Tipos de cambio cargados: {len(currencies)} divisas hasta {datetime.date.fromordinal(last)}.")
+
+    # --- Consultas ---
+
+    def supports(self, currency: str) -> bool:
+        return currency.upper() in self._index
+
+    def code(self, currency: Optional[str]) -> int:
+        """Código de la divisa (-1 si no hay tipos para ella). None = BASE_CURRENCY."""
+        return self._index.get((currency or settings.BASE_CURRENCY).upper(), -1)
+
+    def codes(self, currencies: Iterable[Optional[str]]) -> np.ndarray:
+        """Códigos de una lista corta de divisas (ej. las distintas de un frame), int16."""
+        return np.asarray([self.code(currency) for currency in currencies], dtype=np.int16)
+
+    def convert(self, amounts: np.ndarray, codes: np.ndarray, days: np.ndarray, currency: str) -> np.ndarray:
+        """
+        Convierte cada importe de su divisa (codes) a 'currency' con el tipo de su día (days,
+        días desde 1970-01-01). Los importes en divisas sin tipos quedan como NaN.
+        """
+        target = self.code(currency)
+        if target < 0:
+            raise ValueError(f"Divisa sin tipos de cambio: {currency}")
+        rows = np.clip(np.asarray(days, dtype=np.int64) - self.start_day, 0, self.rates.shape[0] - 1)
+        codes = np.asarray(codes)
+        known = codes >= 0
+        source = self.rates[rows, np.where(known, codes, 0)]
+        converted = np.asarray(amounts, dtype=np.float64) * (self.rates[rows, target] / source)
+        converted[~known] = np.nan
+        return converted
+
+
+fx_rates = FxRates(settings.FX_RATES_PATH, settings.FX_RATES_QUOTE_CURRENCY)
+fx_rates.load()
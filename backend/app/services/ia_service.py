@@ -1,11 +1,27 @@
+import asyncio
+import json
+import re
+import threading
+import time
+import zlib
+from contextlib import contextmanager
 import httpx
-from typing import Optional, List
+import numpy as np
+from typing import Optional, List, Dict, Any, Tuple, Sequence
 import os # Para getenv si no usas settings directamente
+try:
+    import fcntl # Bloqueo entre workers al reescribir el índice kNN (no disponible en Windows)
+except ImportError:
+    fcntl = None
 
 # Importar settings
 # Asumiendo que este archivo está en app/services/
 try:
     from ..core.config import settings
+    from ..core.rate_limit import huggingface_limiter, RateLimitExceeded
+    from ..core.circuit_breaker import CircuitBreaker, OPEN as BREAKER_OPEN
+    from ..core.cache import cache
+    from ..core.timing import timed, INFERENCE
 except ImportError:
     # Fallback si la estructura es diferente o para pruebas unitarias aisladas
     print("ADVERTENCIA: No se pudo importar settings desde ..core.config. Usando os.getenv directamente.")
@@ -13,6 +29,16 @@ except ImportError:
     class MockSettings:
         HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
     settings = MockSettings()
+    huggingface_limiter = None # Sin limitador en pruebas aisladas
+    CircuitBreaker = None # Sin circuit breaker en pruebas aisladas
+    BREAKER_OPEN = "open"
+    cache = None # Sin caché compartida en pruebas aisladas
+    from contextlib import nullcontext
+    INFERENCE = "inference"
+    def timed(component): # Sin desglose de tiempos en pruebas aisladas
+        return nullcontext()
+    class RateLimitExceeded(Exception):
+        pass
 
 # Categorías financieras objetivo para la clasificación
 FINANCIAL_CATEGORIES: List[str] = [
@@ -33,13 +59,536 @@ FINANCIAL_CATEGORIES: List[str] = [
     "Other"
 ]
 
+# Categoría explícita cuando no se pudo consultar el modelo por saturación del limitador.
+# A diferencia de "Other", no se descarta en el dashboard: el gasto queda visible como pendiente de clasificar.
+UNCATEGORIZED_CATEGORY = "Uncategorized"
+
 # URL del modelo Zero-Shot recomendado en Hugging Face
 HF_ZERO_SHOT_MODEL_URL = os.getenv("HF_MODEL_URL", "https://api-inference.huggingface.co/models/facebook/bart-large-mnli")
 # Alternativa (más pequeño/rápido, potencialmente menos preciso):
 # HF_ZERO_SHOT_MODEL_URL = "https://api-inference.huggingface.co/models/valhalla/distilbart-mnli-12-3"
 
-# Límite de reintentos o timeout
-REQUEST_TIMEOUT = 15.0 # Segundos
+# Presupuesto de latencia por categorización (incluye todos los intentos)
+HF_REQUEST_DEADLINE_SECONDS = float(getattr(settings, "HF_REQUEST_DEADLINE_SECONDS", 3.0))
+# Si el primer intento no respondió tras este tiempo, se lanza un intento "hedged" en paralelo
+HF_HEDGE_DELAY_SECONDS = float(getattr(settings, "HF_HEDGE_DELAY_SECONDS", 0.8))
+# Intentos máximos (original + hedges/reintentos) dentro del presupuesto
+HF_MAX_ATTEMPTS = int(getattr(settings, "HF_MAX_ATTEMPTS", 2))
+
+# Circuit breaker alrededor del cliente de inferencia: con el endpoint caído o cargando
+# el modelo, se categoriza localmente de inmediato en vez de ocupar workers esperando.
+hf_breaker = CircuitBreaker(
+    "huggingface",
+    failure_rate_threshold=settings.HF_BREAKER_FAILURE_RATE,
+    slow_call_seconds=settings.HF_BREAKER_SLOW_CALL_SECONDS,
+    slow_call_rate_threshold=settings.HF_BREAKER_SLOW_CALL_RATE,
+    window_size=settings.HF_BREAKER_WINDOW_SIZE,
+    min_calls=settings.HF_BREAKER_MIN_CALLS,
+    open_seconds=settings.HF_BREAKER_OPEN_SECONDS,
+    half_open_max_calls=settings.HF_BREAKER_HALF_OPEN_PROBES,
+) if CircuitBreaker is not None else None
+
+# Cliente HTTP compartido (pool de conexiones reutilizado entre categorizaciones)
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(timeout=HF_REQUEST_DEADLINE_SECONDS)
+    return _http_client
+
+# --- Categorización Local (Fallback) ---
+# Reglas por palabra clave sobre la descripción. Se usan cuando el modelo remoto
+# no está disponible (breaker abierto, presupuesto agotado, errores de red).
+LOCAL_CATEGORY_KEYWORDS: Dict[str, List[str]] = {
+    "Food and Drink": ["cafe", "coffee", "starbucks", "restaurant", "pizza", "burger", "mcdonald", "kfc", "bar", "grocery", "market", "bakery", "food", "sushi", "taco"],
+    "Transportation": ["uber", "lyft", "taxi", "subway", "metro", "bus", "transit", "gas", "shell", "chevron", "parking", "toll", "fuel"],
+    "Shopping": ["amazon", "walmart", "target", "store", "shop", "mall", "ebay", "best buy", "ikea"],
+    "Bills & Utilities": ["electric", "water", "utility", "internet", "comcast", "verizon", "at&t", "phone", "bill", "insurance"],
+    "Entertainment": ["netflix", "spotify", "hulu", "cinema", "movie", "theater", "steam", "playstation", "xbox", "concert"],
+    "Housing": ["rent", "mortgage", "hoa", "apartment", "lease"],
+    "Health & Wellness": ["pharmacy", "cvs", "walgreens", "doctor", "clinic", "hospital", "dental", "gym", "fitness"],
+    "Education": ["tuition", "university", "college", "school", "course", "udemy", "coursera", "books"],
+    "Income": ["payroll", "salary", "deposit", "direct dep", "refund", "interest earned"],
+    "Transfers": ["transfer", "venmo", "zelle", "paypal", "wire"],
+    "Fees & Charges": ["fee", "charge", "overdraft", "penalty", "atm"],
+    "Travel": ["airline", "airlines", "united", "delta", "hotel", "airbnb", "expedia", "booking"],
+    "Personal Care": ["salon", "barber", "spa", "beauty", "cosmetic"],
+    "Gifts & Donations": ["donation", "charity", "gift", "gofundme"],
+}
+
+_LOCAL_RULES = [
+    (category, re.compile(r"\b(" + "|".join(re.escape(k) for k in keywords) + r")\b"))
+    for category, keywords in LOCAL_CATEGORY_KEYWORDS.items()
+]
+
+def categorize_locally(description: str) -> str:
+    """Categoriza con reglas locales por palabra clave (sin llamadas externas). "Other" si no hay coincidencia."""
+    text = (description or "").lower()
+    for category, pattern in _LOCAL_RULES:
+        if pattern.search(text):
+            return category
+    return "Other"
+
+# --- Categorizador kNN Local (Vocabulario de Comercios Aprendido) ---
+# Aprende de transacciones ya etiquetadas (categoría de Plaid y resultados del modelo).
+# Cada nombre se convierte en un vector de n-gramas de caracteres con hashing (tamaño fijo),
+# normalizado L2; una consulta por lotes es una sola multiplicación de matrices (similitud coseno)
+# seguida de un voto ponderado entre los k vecinos más cercanos. Si la confianza no supera el
+# umbral, se consulta el modelo remoto.
+
+# Jerarquía de Plaid -> nuestras categorías (primero (categoría, subcategoría), luego la categoría)
+PLAID_SUBCATEGORY_MAP: Dict[Tuple[str, str], str] = {
+    ("Travel", "Public Transportation"): "Transportation",
+    ("Travel", "Taxi"): "Transportation",
+    ("Travel", "Car Service"): "Transportation",
+    ("Travel", "Gas Stations"): "Transportation",
+    ("Travel", "Parking"): "Transportation",
+    ("Transfer", "Payroll"): "Income",
+    ("Transfer", "Deposit"): "Income",
+    ("Payment", "Rent"): "Housing",
+    ("Service", "Utilities"): "Bills & Utilities",
+    ("Service", "Telecommunication Services"): "Bills & Utilities",
+    ("Service", "Personal Care"): "Personal Care",
+    ("Service", "Education"): "Education",
+    ("Service", "Financial"): "Fees & Charges",
+}
+PLAID_CATEGORY_MAP: Dict[str, str] = {
+    "Food and Drink": "Food and Drink",
+    "Travel": "Travel",
+    "Transfer": "Transfers",
+    "Payment": "Bills & Utilities",
+    "Shops": "Shopping",
+    "Recreation": "Entertainment",
+    "Healthcare": "Health & Wellness",
+    "Bank Fees": "Fees & Charges",
+    "Interest": "Income",
+    "Community": "Gifts & Donations",
+}
+
+def label_from_plaid_category(category: Optional[Sequence[str]]) -> Optional[str]:
+    """Traduce la jerarquía de categorías de Plaid a una de FINANCIAL_CATEGORIES (o None)."""
+    if not category:
+        return None
+    if len(category) > 1 and (category[0], category[1]) in PLAID_SUBCATEGORY_MAP:
+        return PLAID_SUBCATEGORY_MAP[(category[0], category[1])]
+    return PLAID_CATEGORY_MAP.get(category[0])
+
+_NON_ALPHA = re.compile(r"[^a-z&]+")
+
+def normalize_merchant_name(name: str) -> str:
+    """Minúsculas, sin dígitos ni puntuación (ej. '#1234', fechas), espacios colapsados."""
+    return " ".join(_NON_ALPHA.sub(" ", (name or "").lower()).split())
+
+
+class _IndexState:
+    """Índice kNN ya cargado desde disco. No se modifica: rebuild() construye otro y lo sustituye."""
+
+    def __init__(self, version: int = 0, segments: Tuple[str, ...] = (), vectors: Tuple[np.ndarray, ...] = (),
+                 labels: Optional[np.ndarray] = None, rows: Optional[Dict[str, int]] = None):
+        self.version = version
+        self.segments = segments # Prefijos de archivo de cada segmento, en orden de escritura
+        self.vectors = vectors # Una matriz memory-mapped por segmento
+        # Etiqueta por fila (todas las filas de todos los segmentos); -1 = sustituida por un segmento posterior
+        self.labels = labels if labels is not None else np.zeros(0, dtype=np.int16)
+        self.rows = rows if rows is not None else {} # Nombre -> fila vigente
+
+
+class NearestNeighbourCategorizer:
+    """
+    Índice kNN de nombres de comercio etiquetados, persistido en disco por segmentos.
+
+    Archivos en index_dir:
+      - index.json: versión y lista de segmentos vigentes (en orden)
+      - <segmento>names.json / labels.npy / vectors.npy: nombres normalizados, índice de categoría
+        (int16) y matriz (filas, dim) float32 normalizada (se abre con memory-map). Un segmento no
+        se modifica una vez escrito.
+    Las etiquetas nuevas se guardan en un buffer en memoria (consultable al instante) y rebuild() las
+    escribe como un segmento nuevo cada rebuild_every etiquetas. Si un nombre reaparece en un segmento
+    posterior, gana la etiqueta más reciente y la fila antigua deja de votar. Al superar max_segments
+    segmentos, el siguiente rebuild() los compacta en uno.
+    """
+
+    NGRAM_SIZES = (2, 3, 4)
+    MANIFEST = "index.json"
+    SEGMENT_FILES = ("names.json", "labels.npy", "vectors.npy")
+
+    def __init__(self, index_dir: str, dim: int, k: int, threshold: float, rebuild_every: int, max_segments: int = 16):
+        self.index_dir = index_dir
+        self.dim = dim
+        self.k = max(1, k)
+        self.threshold = threshold
+        self.rebuild_every = max(1, rebuild_every)
+        self.max_segments = max(1, max_segments)
+        self._lock = threading.Lock()
+        self._category_index = {category: i for i, category in enumerate(FINANCIAL_CATEGORIES)}
+
+        # Índice en disco (memory-mapped)
+        self._state = _IndexState()
+        # Etiquetas aún no incorporadas al índice en disco: nombre -> categoría
+        self._pending: Dict[str, int] = {}
+        self._pending_matrix: Optional[np.ndarray] = None
+        self._pending_labels: Optional[np.ndarray] = None
+        # Lo que consulta predict(): (vectores por segmento, etiquetas, matriz pendiente, etiquetas pendientes).
+        # Se sustituye entero con una sola asignación, así predict() nunca mezcla estados sin tomar el lock.
+        self._snapshot: Tuple[Tuple[np.ndarray, ...], np.ndarray, Optional[np.ndarray], Optional[np.ndarray]] = (
+            (), self._state.labels, None, None,
+        )
+
+    # --- Vectorización ---
+
+    def vectorize(self, names: Sequence[str]) -> np.ndarray:
+        """Hashing de n-gramas de caracteres -> matriz (len(names), dim) float32 normalizada."""
+        matrix = np.zeros((len(names), self.dim), dtype=np.float32)
+        rows: List[int] = []
+        buckets: List[int] = []
+        for row, name in enumerate(names):
+            text = f" {name} "
+            for n in self.NGRAM_SIZES:
+                for i in range(len(text) - n + 1):
+                    rows.append(row)
+                    buckets.append(zlib.crc32(text[i:i + n].encode("utf-8")))
+        if rows:
+            np.add.at(matrix, (np.asarray(rows), np.asarray(buckets, dtype=np.uint32) % self.dim), 1.0)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+    # --- Persistencia ---
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.index_dir, filename)
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        """Bloqueo entre workers sobre index_dir (compartido para leer, exclusivo para escribir)."""
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self._path(".lock"), "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _read_manifest(self) -> Tuple[int, Tuple[str, ...]]:
+        """(versión, segmentos) del índice en disco. Un índice anterior a los segmentos cuenta como uno solo."""
+        try:
+            with open(self._path(self.MANIFEST), encoding="utf-8") as f:
+                manifest = json.load(f)
+            return int(manifest["version"]), tuple(manifest["segments"])
+        except FileNotFoundError:
+            return 0, ("",) if os.path.exists(self._path("vectors.npy")) else ()
+
+    def _load_segment(self, prefix: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        with open(self._path(prefix + "names.json"), encoding="utf-8") as f:
+            names = json.load(f)
+        labels = np.load(self._path(prefix + "labels.npy")).astype(np.int16)
+        vectors = np.load(self._path(prefix + "vectors.npy"), mmap_mode="r")
+        if labels.shape[0] != len(names):
+            raise ValueError(f"el segmento '{prefix}' tiene {labels.shape[0]} etiquetas para {len(names)} nombres")
+        if vectors.shape != (len(names), self.dim):
+            print(f"ADVERTENCIA: Segmento kNN '{prefix}' en {self.index_dir} inconsistente o con otra dimensión; se revectoriza en memoria.")
+            vectors = self.vectorize(names)
+        return names, labels, vectors
+
+    def _extend_state(self, state: _IndexState, version: int, segments: Tuple[str, ...]) -> _IndexState:
+        """Carga sólo los segmentos que faltan en state; si el índice se compactó, lo carga entero."""
+        if segments[:len(state.segments)] != state.segments:
+            state = _IndexState()
+        if segments == state.segments:
+            return _IndexState(version, state.segments, state.vectors, state.labels, state.rows)
+        vectors = list(state.vectors)
+        labels = [state.labels]
+        rows = dict(state.rows)
+        replaced: List[int] = []
+        offset = state.labels.shape[0]
+        for prefix in segments[len(state.segments):]:
+            names, segment_labels, segment_vectors = self._load_segment(prefix)
+            for row, name in enumerate(names, start=offset):
+                previous = rows.get(name)
+                if previous is not None:
+                    replaced.append(previous)
+                rows[name] = row
+            vectors.append(segment_vectors)
+            labels.append(segment_labels)
+            offset += len(names)
+        all_labels = np.concatenate(labels) # Copia nueva: el estado anterior sigue intacto para predict()
+        if replaced:
+            all_labels[replaced] = -1
+        return _IndexState(version, segments, tuple(vectors), all_labels, rows)
+
+    def _swap(self, state: _IndexState, consumed: Optional[Dict[str, int]] = None) -> bool:
+        """Publica state (si no hay ya uno más reciente) y retira del buffer las etiquetas ya escritas."""
+        with self._lock:
+            swapped = state.version >= self._state.version
+            if swapped:
+                self._state = state
+            for name, label in (consumed or {}).items():
+                if self._pending.get(name) == label:
+                    del self._pending[name]
+            self._publish_locked()
+            return swapped
+
+    def load(self) -> None:
+        """Abre el índice de disco con memory-map (sin copiarlo a memoria)."""
+        if not os.path.isdir(self.index_dir):
+            return
+        try:
+            with self._file_lock(exclusive=False):
+                version, segments = self._read_manifest()
+                state = self._extend_state(self._state, version, segments)
+        except Exception as e:
+            print(f"ERROR: No se pudo cargar el índice kNN desde {self.index_dir}: {e}")
+            return
+        if self._swap(state) and state.segments:
+            print(f"DEBUG: Índice kNN cargado ({len(state.rows)} comercios, {len(state.segments)} segmentos) desde {self.index_dir}")
+
+    def _publish_locked(self) -> None:
+        """Publica para predict() el estado actual (llamar con el lock tomado)."""
+        if self._pending:
+            pending_names = list(self._pending.keys())
+            self._pending_matrix = self.vectorize(pending_names)
+            self._pending_labels = np.fromiter(self._pending.values(), dtype=np.int16, count=len(pending_names))
+        else:
+            self._pending_matrix = None
+            self._pending_labels = None
+        self._snapshot = (self._state.vectors, self._state.labels, self._pending_matrix, self._pending_labels)
+
+    def _atomic_write(self, filename: str, write) -> None:
+        tmp_path = self._path(filename + ".tmp")
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, self._path(filename))
+
+    def _write_segment(self, version: int, names: List[str], labels: np.ndarray, vectors: np.ndarray) -> str:
+        prefix = f"seg-{version:06d}."
+        self._atomic_write(prefix + "names.json", lambda f: f.write(json.dumps(names).encode("utf-8")))
+        self._atomic_write(prefix + "labels.npy", lambda f: np.save(f, labels))
+        self._atomic_write(prefix + "vectors.npy", lambda f: np.save(f, vectors))
+        return prefix
+
+    def _write_compacted(self, state: _IndexState, version: int, names: List[str], labels: np.ndarray) -> str:
+        """Funde las filas vigentes de todos los segmentos y las etiquetas nuevas en un único segmento."""
+        relabelled = set(names)
+        kept = sorted((row, name) for name, row in state.rows.items() if name not in relabelled)
+        kept_rows = np.array([row for row, _ in kept], dtype=np.int64)
+        old_vectors = np.concatenate([np.asarray(v) for v in state.vectors]) if state.vectors else np.zeros((0, self.dim), dtype=np.float32)
+        return self._write_segment(
+            version,
+            [name for _, name in kept] + names,
+            np.concatenate([state.labels[kept_rows], labels]),
+            np.concatenate([old_vectors[kept_rows], self.vectorize(names)]),
+        )
+
+    def _remove_unused_segments(self, segments: Tuple[str, ...]) -> None:
+        """Borra los archivos de segmentos que ya no están en el manifiesto (tras compactar)."""
+        for entry in os.listdir(self.index_dir):
+            for suffix in self.SEGMENT_FILES:
+                if entry.endswith(suffix) and entry[:-len(suffix)] not in segments:
+                    try:
+                        os.remove(self._path(entry))
+                    except OSError as e:
+                        print(f"ADVERTENCIA: No se pudo borrar el segmento kNN {entry}: {e}")
+
+    def rebuild(self) -> None:
+        """
+        Escribe las etiquetas pendientes como un segmento nuevo del índice en disco; no reescribe
+        los segmentos existentes salvo al compactar. Antes carga los segmentos que otros workers
+        hayan añadido, para no perder sus filas. El bloqueo entre workers y la escritura ocurren
+        fuera de self._lock: learn() y predict() no esperan al disco, sólo a la sustitución final.
+        """
+        with self._lock:
+            pending = dict(self._pending)
+        if not pending:
+            return
+        with self._file_lock(exclusive=True): # Un solo worker escribe a la vez
+            version, segments = self._read_manifest()
+            state = self._extend_state(self._state, version, segments)
+            names = []
+            for name, label in pending.items():
+                row = state.rows.get(name)
+                if row is None or int(state.labels[row]) != label:
+                    names.append(name) # Nuevo, o etiqueta más reciente que la del disco
+            if names:
+                version += 1
+                labels = np.array([pending[name] for name in names], dtype=np.int16)
+                compact = len(segments) >= self.max_segments
+                if compact:
+                    segments = (self._write_compacted(state, version, names, labels),)
+                else:
+                    segments = segments + (self._write_segment(version, names, labels, self.vectorize(names)),)
+                manifest = json.dumps({"version": version, "segments": list(segments)}).encode("utf-8")
+                self._atomic_write(self.MANIFEST, lambda f: f.write(manifest))
+                state = self._extend_state(state, version, segments)
+                if compact:
+                    self._remove_unused_segments(segments)
+        self._swap(state, consumed=pending)
+
+    # --- Aprendizaje y Consulta ---
+
+    def learn(self, names: Sequence[str], categories: Sequence[Optional[str]]) -> bool:
+        """
+        Añade etiquetas (nombre, categoría) al buffer. Ignora categorías desconocidas, "Other" y vacías.
+        Devuelve True si conviene llamar a rebuild().
+        """
+        with self._lock:
+            state = self._state
+            changed = False
+            for name, category in zip(names, categories):
+                normalized = normalize_merchant_name(name)
+                label = self._category_index.get(category) if category and category != "Other" else None
+                if not normalized or label is None:
+                    continue
+                row = state.rows.get(normalized)
+                if self._pending.get(normalized) == label or (row is not None and int(state.labels[row]) == label and normalized not in self._pending):
+                    continue
+                self._pending[normalized] = label
+                changed = True
+            if changed:
+                self._publish_locked()
+            return len(self._pending) >= self.rebuild_every
+
+    @property
+    def size(self) -> int:
+        return len(self._state.rows) + len(self._pending)
+
+    def predict(self, names: Sequence[str]) -> List[Tuple[Optional[str], float]]:
+        """
+        Devuelve [(categoría o None, confianza)] por nombre. None si la confianza < threshold.
+        La confianza es la cuota ponderada del voto ganador multiplicada por la similitud máxima.
+        """
+        if not names:
+            return []
+        # Una sola lectura: rebuild() (en otro hilo) puede estar sustituyendo el índice
+        segments, labels, pending_matrix, pending_labels = self._snapshot
+        if pending_matrix is not None:
+            # Las filas pendientes se consultan aparte (índice en disco intacto)
+            all_labels = np.concatenate([labels, pending_labels])
+        else:
+            all_labels = labels
+        if all_labels.shape[0] == 0:
+            return [(None, 0.0)] * len(names)
+
+        queries = self.vectorize([normalize_merchant_name(name) for name in names])
+        blocks = [queries @ np.asarray(vectors).T for vectors in segments if vectors.shape[0]]
+        if pending_matrix is not None:
+            blocks.append(queries @ pending_matrix.T)
+        similarities = np.hstack(blocks)
+        replaced = all_labels < 0
+        if replaced.any():
+            # Filas sustituidas por un segmento posterior: no votan
+            similarities[:, replaced] = -1.0
+            all_labels = np.where(replaced, 0, all_labels)
+
+        k = min(self.k, similarities.shape[1])
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        top_similarities = np.clip(np.take_along_axis(similarities, top, axis=1), 0.0, None)
+        # Pesos cúbicos: los vecinos poco parecidos apenas cuentan en el voto
+        weights = top_similarities ** 3
+        votes = np.zeros((len(names), len(FINANCIAL_CATEGORIES)), dtype=np.float32)
+        np.add.at(votes, (np.arange(len(names))[:, None], all_labels[top]), weights)
+
+        winners = votes.argmax(axis=1)
+        totals = weights.sum(axis=1)
+        share = np.divide(votes[np.arange(len(names)), winners], totals, out=np.zeros_like(totals), where=totals > 0)
+        confidence = share * top_similarities.max(axis=1)
+
+        results: List[Tuple[Optional[str], float]] = []
+        for winner, score in zip(winners, confidence):
+            category = FINANCIAL_CATEGORIES[winner] if score >= self.threshold else None
+            results.append((category, float(score)))
+        return results
+
+
+knn_categorizer = NearestNeighbourCategorizer(
+    index_dir=getattr(settings, "CATEGORIZER_INDEX_DIR", os.path.join("var", "categorizer")),
+    dim=int(getattr(settings, "CATEGORIZER_DIM", 512)),
+    k=int(getattr(settings, "CATEGORIZER_K", 5)),
+    threshold=float(getattr(settings, "CATEGORIZER_CONFIDENCE_THRESHOLD", 0.6)),
+    rebuild_every=int(getattr(settings, "CATEGORIZER_REBUILD_EVERY", 256)),
+    max_segments=int(getattr(settings, "CATEGORIZER_MAX_SEGMENTS", 16)),
+)
+knn_categorizer.load() # Memory-map del índice al arrancar
+
+# --- Llamada Remota con Hedging y Presupuesto ---
+
+class _NonRetryableError(Exception):
+    """Error del modelo que no se corrige reintentando (ej. 401, 400)."""
+
+async def _post_inference(headers: Dict[str, str], payload: Dict[str, Any], timeout: float) -> Any:
+    response = await get_http_client().post(HF_ZERO_SHOT_MODEL_URL, headers=headers, json=payload, timeout=timeout)
+
+    # Debugging de la respuesta
+    # print(f"DEBUG HF Status: {response.status_code}")
+    # print(f"DEBUG HF Response: {response.text}")
+
+    if 400 <= response.status_code < 500 and response.status_code != 429:
+        print(f"ERROR: HTTP {response.status_code} de Hugging Face API. Respuesta: {response.text}")
+        raise _NonRetryableError(response.status_code)
+    response.raise_for_status() # Lanza excepción para errores HTTP 5xx / 429
+    return response.json()
+
+async def _hedged_inference(headers: Dict[str, str], payload: Dict[str, Any]) -> Any:
+    """
+    Ejecuta la inferencia dentro de HF_REQUEST_DEADLINE_SECONDS.
+    Si el intento en curso tarda más de HF_HEDGE_DELAY_SECONDS (o falla), lanza otro en paralelo
+    hasta HF_MAX_ATTEMPTS; devuelve la primera respuesta válida y cancela el resto.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + HF_REQUEST_DEADLINE_SECONDS
+    pending: set = set()
+    attempts = 0
+    last_error: Optional[BaseException] = None
+
+    async def launch() -> bool:
+        nonlocal attempts
+        if attempts >= HF_MAX_ATTEMPTS:
+            return False
+        # Los hedges también consumen del limitador, pero nunca esperan turno
+        if attempts > 0 and huggingface_limiter is not None and not await huggingface_limiter.try_acquire():
+            return False
+        attempts += 1
+        pending.add(asyncio.ensure_future(_post_inference(headers, payload, max(0.01, deadline - loop.time()))))
+        return True
+
+    await launch()
+    next_hedge_at = loop.time() + HF_HEDGE_DELAY_SECONDS
+    try:
+        while pending:
+            now = loop.time()
+            if now >= deadline:
+                break
+            done, _ = await asyncio.wait(
+                pending, timeout=min(next_hedge_at, deadline) - now, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                pending.discard(task)
+                error = task.exception()
+                if error is None:
+                    return task.result()
+                if isinstance(error, _NonRetryableError):
+                    raise error
+                last_error = error
+                await launch() # Reintento inmediato si queda presupuesto
+            if not done and loop.time() >= next_hedge_at:
+                await launch()
+                next_hedge_at = loop.time() + HF_HEDGE_DELAY_SECONDS
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if last_error is not None and not pending:
+        raise last_error
+    raise asyncio.TimeoutError(f"Presupuesto de {HF_REQUEST_DEADLINE_SECONDS}s agotado")
+
+# Origen de cada categoría: sólo 'model' y 'local' son resultados que vale la pena persistir
+SOURCE_MODEL = "model"
+SOURCE_LOCAL = "local"
+SOURCE_KNN = "knn"
+SOURCE_NONE = "none" # Sin resultado real (configuración, entrada inválida, respuesta inesperada)
+SOURCE_THROTTLED = "throttled" # Limitador de Hugging Face saturado: no se llegó a consultar el modelo
+
+# Categorías del modelo por descripción normalizada, compartidas entre workers (y entre usuarios):
+# el mismo comercio no vuelve a consultar a Hugging Face mientras dure el TTL.
+category_cache = cache.namespace("categories", settings.CATEGORY_CACHE_TTL_SECONDS, value_type=str) if cache is not None else None
 
 async def categorize_transaction(description: str) -> str:
     """
@@ -49,17 +598,55 @@ async def categorize_transaction(description: str) -> str:
         description: El texto de la descripción de la transacción.
 
     Returns:
-        La categoría predicha (str). Devuelve "Other" si falla la categorización/configuración.
+        La categoría predicha (str). Ver categorize_with_source para el detalle de fallbacks.
+    """
+    category, _ = await categorize_with_source(description)
+    return category
+
+async def categorize_with_source(description: str) -> Tuple[str, str]:
+    """
+    Categoriza una descripción y devuelve también el origen del resultado.
+
+    La llamada está protegida por un circuit breaker y acotada por HF_REQUEST_DEADLINE_SECONDS
+    (con intentos hedged). Si el breaker está abierto o la llamada falla, se usa la
+    categorización local por palabras clave.
+
+    Returns:
+        (categoría, origen). Devuelve ("Other", SOURCE_NONE) si falla la configuración,
+        y (UNCATEGORIZED_CATEGORY, SOURCE_THROTTLED) si el limitador de Hugging Face está saturado.
     """
     api_key = settings.HUGGINGFACE_API_KEY
 
     if not api_key:
         print("ADVERTENCIA: HUGGINGFACE_API_KEY no configurada. Devolviendo categoría 'Other'.")
-        return "Other"
+        return "Other", SOURCE_NONE
     
     if not description or not isinstance(description, str) or len(description.strip()) == 0:
         print("ADVERTENCIA: Descripción de transacción inválida o vacía. Devolviendo categoría 'Other'.")
-        return "Other"
+        return "Other", SOURCE_NONE
+
+    cache_key = normalize_merchant_name(description)
+    if category_cache is not None and cache_key:
+        cached = await category_cache.aget(cache_key)
+        if cached is not None:
+            return cached, SOURCE_MODEL
+
+    if hf_breaker is not None and hf_breaker.state == BREAKER_OPEN:
+        # Breaker abierto: no ocupar el worker (ni tokens del limitador) con un upstream caído
+        return categorize_locally(description), SOURCE_LOCAL
+
+    # El token se obtiene ANTES de reservar la sonda del breaker: si el limitador está
+    # saturado no llega a reservarse nada que haya que liberar.
+    if huggingface_limiter is not None:
+        try:
+            await huggingface_limiter.acquire() # Espera su turno o lanza RateLimitExceeded
+        except RateLimitExceeded as e:
+            # Degradación explícita: no llamar al modelo y dejar la transacción sin clasificar
+            print(f"ADVERTENCIA: {e}. '{description}' queda como '{UNCATEGORIZED_CATEGORY}'.")
+            return UNCATEGORIZED_CATEGORY, SOURCE_THROTTLED
+
+    if hf_breaker is not None and not hf_breaker.allow_request():
+        return categorize_locally(description), SOURCE_LOCAL
 
     headers = {"Authorization": f"Bearer {api_key}"}
     payload = {
@@ -68,47 +655,56 @@ async def categorize_transaction(description: str) -> str:
             "candidate_labels": FINANCIAL_CATEGORIES,
             "multi_label": False # Asumimos una sola categoría por transacción
             },
-        "options": {"wait_for_model": True} # Esperar a que el modelo esté listo
+        # No esperar a que el modelo cargue: un 503 rápido cuenta como fallo para el breaker
+        "options": {"wait_for_model": False}
     }
 
+    recorded = False # Si la llamada termina sin registrar resultado, se libera la sonda (finally)
+    started = time.monotonic()
     try:
-        async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT) as client:
-            response = await client.post(HF_ZERO_SHOT_MODEL_URL, headers=headers, json=payload)
-            
-            # Debugging de la respuesta
-            # print(f"DEBUG HF Status: {response.status_code}")
-            # print(f"DEBUG HF Response: {response.text}")
-            
-            response.raise_for_status() # Lanza excepción para errores HTTP 4xx/5xx
-
-            result = response.json()
-            if result and isinstance(result, dict) and 'labels' in result and 'scores' in result and result['labels']:
-                # El modelo devuelve las etiquetas ordenadas por puntuación descendente
-                best_category = result['labels'][0]
-                best_score = result['scores'][0]
-                # print(f"DEBUG: Categoría predicha para '{description}': {best_category} (Score: {best_score:.2f})")
-                
-                # Asegurarse de que la categoría devuelta esté en nuestra lista (por si acaso)
-                if best_category in FINANCIAL_CATEGORIES:
-                    return best_category
-                else:
-                    print(f"ADVERTENCIA: Categoría predicha '{best_category}' no está en FINANCIAL_CATEGORIES. Devolviendo 'Other'.")
-                    return "Other"
-            else:
-                print(f"ADVERTENCIA: Respuesta inesperada o vacía de HF API para '{description}'. Respuesta: {result}")
-                return "Other"
-
-    except httpx.HTTPStatusError as e:
-        # Manejar errores específicos como 401 (Unauthorized), 503 (Model loading), etc.
-        print(f"ERROR: HTTP {e.response.status_code} de Hugging Face API para '{description}'. Respuesta: {e.response.text}")
-        return "Other"
-    except httpx.RequestError as e:
-        # Errores de red, timeout, etc.
-        print(f"ERROR: Error de red al contactar Hugging Face API para '{description}': {e}")
-        return "Other"
+        with timed(INFERENCE):
+            result = await _hedged_inference(headers, payload)
+        if hf_breaker is not None:
+            hf_breaker.record_success(time.monotonic() - started)
+            recorded = True
+    except _NonRetryableError:
+        # Error de configuración/petición (ej. 401): no es una caída del upstream
+        return "Other", SOURCE_NONE
+    except (httpx.HTTPStatusError, httpx.RequestError, asyncio.TimeoutError) as e:
+        # Manejar errores como 503 (Model loading), red, timeout o presupuesto agotado
+        if hf_breaker is not None:
+            hf_breaker.record_failure()
+            recorded = True
+        print(f"ERROR: Falla de Hugging Face API para '{description}': {e!r}. Usando categorización local.")
+        return categorize_locally(description), SOURCE_LOCAL
     except Exception as e:
         # Otros errores inesperados (ej. JSONDecodeError)
         import traceback
+        if hf_breaker is not None:
+            hf_breaker.record_failure()
+            recorded = True
         print(f"ERROR: Error inesperado durante la categorización IA para '{description}': {e}")
         traceback.print_exc() # Imprimir traceback completo para depuración
-        return "Other" 
\ No newline at end of file
+        return categorize_locally(description), SOURCE_LOCAL
+    finally:
+        # Incluye la cancelación (CancelledError no hereda de Exception)
+        if hf_breaker is not None and not recorded:
+            hf_breaker.release_probe()
+
+    if result and isinstance(result, dict) and 'labels' in result and 'scores' in result and result['labels']:
+        # El modelo devuelve las etiquetas ordenadas por puntuación descendente
+        best_category = result['labels'][0]
+        best_score = result['scores'][0]
+        # print(f"DEBUG: Categoría predicha para '{description}': {best_category} (Score: {best_score:.2f})")
+
+        # Asegurarse de que la categoría devuelta esté en nuestra lista (por si acaso)
+        if best_category in FINANCIAL_CATEGORIES:
+            if category_cache is not None and cache_key:
+                await category_cache.aset(cache_key, best_category)
+            return best_category, SOURCE_MODEL
+        else:
+            print(f"ADVERTENCIA: Categoría predicha '{best_category}' no está en FINANCIAL_CATEGORIES. Devolviendo 'Other'.")
+            return "Other", SOURCE_NONE
+    else:
+        print(f"ADVERTENCIA: Respuesta inesperada o vacía de HF API para '{description}'. Respuesta: {result}")
+        return "Other", SOURCE_NONE
@@ -0,0 +1,371 @@
+import datetime
+import math
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, exists, func, select, update
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..models.insight import CategoryStats, MerchantStats, UserInsight
+from ..models.transaction import Transaction, TransactionCategory
+from .analytics_service import NON_SPENDING_CATEGORIES
+from .budget_service import evaluate_transactions, subtract_transactions
+from .ia_service import normalize_merchant_name
+
+# --- Motor de Insights de Ahorro ---
+# Cada transacción de gasto categorizada se suma UNA vez (transactions.stats_applied) a unas
+# estadísticas incrementales por usuario y categoría / comercio (algoritmo de Welford).
+# Tras cada actualización se recalculan los insights del usuario recorriendo sólo esas
+# estadísticas (O(categorías + comercios)), y se guardan en 'user_insights': el dashboard
+# únicamente los lee, sin escanear el histórico.
+# Las mismas transacciones reclamadas actualizan los presupuestos y sus alertas
+# (services/budget_service.py) dentro de la misma transacción de BD.
+# Si Plaid elimina una transacción aplicada o cambia sus datos, revert_transactions la resta
+# (Welford inverso) con los valores guardados en transactions.applied_* antes de reescribirla.
+
+# Suavizado de las medias exponenciales de totales mensuales
+EWMA_FAST_ALPHA = 0.5
+EWMA_SLOW_ALPHA = 0.2
+
+# Periodicidades reconocidas como cargo recurrente: (nombre, días mínimos, días máximos)
+RECURRING_PERIODS = [("semanal", 6, 8), ("mensual", 26, 35), ("anual", 350, 380)]
+
+def welford(count: int, mean: float, m2: float, value: float) -> Tuple[int, float, float]:
+    """Añade 'value' a (n, media, M2) en O(1) y de forma numéricamente estable."""
+    count += 1
+    delta = value - mean
+    mean += delta / count
+    m2 += delta * (value - mean)
+    return count, mean, m2
+
+def welford_remove(count: int, mean: float, m2: float, value: float) -> Tuple[int, float, float]:
+    """Quita de (n, media, M2) un 'value' añadido antes con welford() (operación inversa)."""
+    if count <= 1:
+        return 0, 0.0, 0.0
+    count -= 1
+    delta = value - mean
+    mean -= delta / count
+    m2 -= delta * (value - mean)
+    return count, mean, max(m2, 0.0)
+
+def std(count: int, m2: float) -> float:
+    """Desviación típica muestral a partir de (n, M2)."""
+    return math.sqrt(m2 / (count - 1)) if count > 1 else 0.0
+
+def _month(day: datetime.date) -> datetime.date:
+    return day.replace(day=1)
+
+def _next_month(month: datetime.date) -> datetime.date:
+    return (month.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+# --- Actualización Incremental ---
+
+def _close_month(stats: CategoryStats) -> None:
+    """Cierra el mes en curso: su total entra en las estadísticas mensuales y en las EWMA."""
+    total = stats.current_month_total or 0.0
+    if stats.months:
+        stats.month_ewma_fast = EWMA_FAST_ALPHA * total + (1 - EWMA_FAST_ALPHA) * stats.month_ewma_fast
+        stats.month_ewma_slow = EWMA_SLOW_ALPHA * total + (1 - EWMA_SLOW_ALPHA) * stats.month_ewma_slow
+    else:
+        stats.month_ewma_fast = stats.month_ewma_slow = total
+    stats.months, stats.month_mean, stats.month_m2 = welford(stats.months, stats.month_mean, stats.month_m2, total)
+    stats.current_month_total = 0.0
+
+def _update_category(stats: CategoryStats, day: datetime.date, amount: float) -> None:
+    # Anomalía: se compara con la media ANTERIOR a este importe
+    if stats.count >= settings.INSIGHT_MIN_SAMPLES:
+        deviation = std(stats.count, stats.m2)
+        if deviation > 0:
+            z = (amount - stats.mean) / deviation
+            if z >= settings.INSIGHT_SPIKE_Z and (stats.last_spike_date is None or day >= stats.last_spike_date):
+                stats.last_spike_date, stats.last_spike_amount, stats.last_spike_z = day, amount, z
+    stats.count, stats.mean, stats.m2 = welford(stats.count, stats.mean, stats.m2, amount)
+
+    # Totales mensuales (las transacciones de meses ya cerrados sólo cuentan para la media por transacción)
+    month = _month(day)
+    if stats.current_month is None:
+        stats.current_month = month
+    elif month > stats.current_month:
+        # Los meses intermedios sin gasto también cierran (con total 0), hasta un año
+        for _ in range(12):
+            _close_month(stats)
+            stats.current_month = _next_month(stats.current_month)
+            if stats.current_month >= month:
+                break
+        stats.current_month = month
+    if month == stats.current_month:
+        stats.current_month_total = (stats.current_month_total or 0.0) + amount
+
+def _update_merchant(stats: MerchantStats, day: datetime.date, amount: float) -> None:
+    stats.count, stats.amount_mean, stats.amount_m2 = welford(stats.count, stats.amount_mean, stats.amount_m2, amount)
+    if day > stats.last_seen:
+        stats.intervals, stats.interval_mean, stats.interval_m2 = welford(
+            stats.intervals, stats.interval_mean, stats.interval_m2, float((day - stats.last_seen).days)
+        )
+        stats.last_seen = day
+    stats.first_seen = min(stats.first_seen, day)
+
+def _revert_category(stats: CategoryStats, day: datetime.date, amount: float) -> None:
+    # Los meses ya cerrados sólo guardan agregados (media, EWMA): su total no se puede corregir
+    stats.count, stats.mean, stats.m2 = welford_remove(stats.count, stats.mean, stats.m2, amount)
+    if stats.current_month == _month(day):
+        stats.current_month_total = (stats.current_month_total or 0.0) - amount
+    if stats.last_spike_date == day and stats.last_spike_amount == amount:
+        stats.last_spike_date = stats.last_spike_amount = stats.last_spike_z = None
+
+def _revert_merchant(stats: MerchantStats, amount: float) -> None:
+    # Los intervalos entre cargos se conservan: dependen de cargos vecinos que no se guardan
+    stats.count, stats.amount_mean, stats.amount_m2 = welford_remove(stats.count, stats.amount_mean, stats.amount_m2, amount)
+
+def _claim_transactions(
+    db: Session, user_id: int, transaction_ids: List[str],
+) -> List[Tuple[str, datetime.date, str, float, Optional[str]]]:
+    """
+    Marca como aplicadas (de forma atómica) las transacciones de gasto ya categorizadas y
+    aún no contadas, y las devuelve. Así cada una se suma una sola vez aunque la guarden
+    a la vez el almacén de transacciones y el de categorías.
+    """
+    categorized = exists().where(and_(
+        TransactionCategory.transaction_id == Transaction.transaction_id,
+        TransactionCategory.category.notin_(NON_SPENDING_CATEGORIES),
+    ))
+    statement = (
+        update(Transaction)
+        .where(
+            Transaction.user_id == user_id,
+            Transaction.transaction_id.in_(transaction_ids),
+            Transaction.stats_applied.is_(False),
+            Transaction.pending.is_(False), # Las pendientes reaparecen con otro id al confirmarse
+            Transaction.amount > 0,
+            categorized,
+        )
+        .values(
+            stats_applied=True,
+            applied_date=Transaction.date,
+            applied_amount=Transaction.amount,
+            applied_currency=Transaction.iso_currency_code,
+        )
+        .returning(Transaction.transaction_id, Transaction.date, Transaction.name, Transaction.amount,
+                   Transaction.iso_currency_code)
+        .execution_options(synchronize_session=False)
+    )
+    return [tuple(row) for row in db.execute(statement).all()]
+
+def apply_transactions(db: Session, user_id: int, transaction_ids: List[str]) -> int:
+    """
+    Suma a las estadísticas y presupuestos del usuario las transacciones indicadas que estén
+    listas (guardadas y categorizadas) y recalcula sus insights si hubo cambios.
+
+    Returns:
+        Número de transacciones aplicadas.
+    """
+    if not transaction_ids:
+        return 0
+    try:
+        claimed = _claim_transactions(db, user_id, transaction_ids)
+        if not claimed:
+            db.rollback()
+            return 0
+        categories = dict(
+            db.query(TransactionCategory.transaction_id, TransactionCategory.category)
+            .filter(TransactionCategory.transaction_id.in_([row[0] for row in claimed])).all()
+        )
+        names = {category for category in categories.values()}
+        merchants = {normalize_merchant_name(row[2]) for row in claimed} - {""}
+
+        category_stats: Dict[str, CategoryStats] = {
+            stats.category: stats for stats in db.query(CategoryStats)
+            .filter(CategoryStats.user_id == user_id, CategoryStats.category.in_(names))
+            .with_for_update().all()
+        }
+        merchant_stats: Dict[str, MerchantStats] = {
+            stats.merchant: stats for stats in db.query(MerchantStats)
+            .filter(MerchantStats.user_id == user_id, MerchantStats.merchant.in_(merchants))
+            .with_for_update().all()
+        }
+
+        # En orden cronológico: los totales mensuales e intervalos dependen del orden
+        for transaction_id, day, name, amount, _ in sorted(claimed, key=lambda row: row[1]):
+            category = categories[transaction_id]
+            stats = category_stats.get(category)
+            if stats is None:
+                stats = category_stats[category] = CategoryStats(
+                    user_id=user_id, category=category, count=0, mean=0.0, m2=0.0,
+                    current_month_total=0.0, months=0, month_mean=0.0, month_m2=0.0,
+                    month_ewma_fast=0.0, month_ewma_slow=0.0,
+                )
+                db.add(stats)
+            _update_category(stats, day, amount)
+
+            merchant = normalize_merchant_name(name)
+            if not merchant:
+                continue
+            stats = merchant_stats.get(merchant)
+            if stats is None:
+                stats = merchant_stats[merchant] = MerchantStats(
+                    user_id=user_id, merchant=merchant, category=category, count=0,
+                    amount_mean=0.0, amount_m2=0.0, intervals=0, interval_mean=0.0, interval_m2=0.0,
+                    first_seen=day, last_seen=day,
+                )
+                db.add(stats)
+            _update_merchant(stats, day, amount)
+
+        db.flush()
+        evaluate_transactions(db, user_id, [(row[1], categories[row[0]], row[3], row[4]) for row in claimed])
+        refresh_insights(db, user_id)
+        db.commit()
+        return len(claimed)
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR: No se pudieron actualizar las estadísticas de insights del usuario {user_id}: {e}")
+        return 0
+
+def revert_transactions(db: Session, user_id: int, transaction_ids: List[str]) -> int:
+    """
+    Resta de las estadísticas y presupuestos del usuario las transacciones indicadas que ya
+    estén aplicadas, con los valores con que se aplicaron, y las deja pendientes de aplicar.
+    Se llama antes de borrarlas o de reescribir su importe, fecha, divisa o nombre; sin commit:
+    forma parte de la transacción de la ingesta.
+
+    Returns:
+        Número de transacciones revertidas.
+    """
+    if not transaction_ids:
+        return 0
+    applied = db.execute(
+        select(
+            Transaction.transaction_id,
+            func.coalesce(Transaction.applied_date, Transaction.date),
+            TransactionCategory.category,
+            func.coalesce(Transaction.applied_amount, Transaction.amount),
+            Transaction.applied_currency,
+            Transaction.name,
+        )
+        .join(TransactionCategory, TransactionCategory.transaction_id == Transaction.transaction_id)
+        .where(
+            Transaction.user_id == user_id,
+            Transaction.transaction_id.in_(transaction_ids),
+            Transaction.stats_applied.is_(True),
+        )
+        .with_for_update(of=Transaction)
+    ).all()
+    if not applied:
+        return 0
+    db.execute(
+        update(Transaction)
+        .where(Transaction.user_id == user_id, Transaction.transaction_id.in_([row[0] for row in applied]))
+        .values(stats_applied=False, applied_date=None, applied_amount=None, applied_currency=None)
+        .execution_options(synchronize_session=False)
+    )
+
+    category_stats: Dict[str, CategoryStats] = {
+        stats.category: stats for stats in db.query(CategoryStats)
+        .filter(CategoryStats.user_id == user_id, CategoryStats.category.in_({row[2] for row in applied}))
+        .with_for_update().all()
+    }
+    merchant_stats: Dict[str, MerchantStats] = {
+        stats.merchant: stats for stats in db.query(MerchantStats)
+        .filter(MerchantStats.user_id == user_id, MerchantStats.merchant.in_({normalize_merchant_name(row[5]) for row in applied}))
+        .with_for_update().all()
+    }
+    for _, day, category, amount, _, name in applied:
+        if category in category_stats:
+            _revert_category(category_stats[category], day, amount)
+        merchant = normalize_merchant_name(name)
+        if merchant in merchant_stats:
+            _revert_merchant(merchant_stats[merchant], amount)
+
+    db.flush()
+    subtract_transactions(db, user_id, [(row[1], row[2], row[3], row[4]) for row in applied])
+    refresh_insights(db, user_id)
+    return len(applied)
+
+# --- Generación de Insights (O(categorías + comercios)) ---
+
+def _recurring_period(stats: MerchantStats) -> Optional[str]:
+    if stats.intervals < 2 or std(stats.intervals, stats.interval_m2) > settings.INSIGHT_RECURRING_INTERVAL_TOLERANCE_DAYS:
+        return None
+    if std(stats.count, stats.amount_m2) > 0.1 * stats.amount_mean + 1.0: # Importe estable
+        return None
+    for period, low, high in RECURRING_PERIODS:
+        if low <= stats.interval_mean <= high:
+            return period
+    return None
+
+def compute_insights(
+    user_id: int,
+    category_stats: List[CategoryStats],
+    merchant_stats: List[MerchantStats],
+    today: datetime.date,
+) -> List[UserInsight]:
+    """Evalúa las estadísticas (sin tocar transacciones) y devuelve los insights ordenados por relevancia."""
+    insights: List[UserInsight] = []
+    recent = today - datetime.timedelta(days=settings.INSIGHT_RECENT_DAYS)
+
+    for stats in category_stats:
+        # Gasto inusual
+        if stats.last_spike_date and stats.last_spike_date >= recent:
+            insights.append(UserInsight(
+                user_id=user_id, kind="spike", category=stats.category, score=stats.last_spike_z,
+                relevant_until=stats.last_spike_date + datetime.timedelta(days=settings.INSIGHT_RECENT_DAYS),
+                message=(
+                    f"Gasto inusual en {stats.category}: ${stats.last_spike_amount:.2f} el {stats.last_spike_date:%d/%m}, "
+                    f"muy por encima de tu media de ${stats.mean:.2f}. ¿Era un gasto previsto?"
+                ),
+            ))
+        # Tendencia al alza (media rápida claramente por encima de la lenta)
+        if stats.months >= 3 and stats.month_ewma_slow > 0:
+            ratio = stats.month_ewma_fast / stats.month_ewma_slow
+            if ratio >= settings.INSIGHT_TREND_RATIO:
+                insights.append(UserInsight(
+                    user_id=user_id, kind="trend", category=stats.category, score=2.0 * ratio,
+                    message=(
+                        f"Tu gasto en {stats.category} viene subiendo: unos ${stats.month_ewma_fast:.2f} al mes "
+                        f"frente a ${stats.month_ewma_slow:.2f} habituales. ¡Una oportunidad para revisar!"
+                    ),
+                ))
+
+    for stats in merchant_stats:
+        # Cargo recurrente nuevo (suscripciones que quizás no se usan)
+        period = _recurring_period(stats)
+        if period and stats.first_seen >= today - datetime.timedelta(days=settings.INSIGHT_NEW_RECURRING_DAYS):
+            insights.append(UserInsight(
+                user_id=user_id, kind="recurring", category=stats.category, score=2.5,
+                message=(
+                    f"Nuevo cargo {period} detectado: '{stats.merchant}' (~${stats.amount_mean:.2f}). "
+                    "Revisa si realmente usas esta suscripción."
+                ),
+            ))
+
+    # Respaldo: la categoría con mayor gasto mensual medio
+    if category_stats:
+        top = max(category_stats, key=lambda s: s.month_mean if s.months else s.current_month_total)
+        amount = top.month_mean if top.months else top.current_month_total
+        insights.append(UserInsight(
+            user_id=user_id, kind="top_category", category=top.category, score=0.5,
+            message=f"Tu mayor área de gasto parece ser {top.category} (${amount:.2f} al mes). ¡Una oportunidad para revisar!",
+        ))
+
+    insights.sort(key=lambda insight: insight.score, reverse=True)
+    return insights[:settings.INSIGHT_MAX_PER_USER]
+
+def refresh_insights(db: Session, user_id: int) -> None:
+    """Sustituye los insights guardados del usuario (sin hacer commit)."""
+    category_stats = db.query(CategoryStats).filter(CategoryStats.user_id == user_id).all()
+    merchant_stats = db.query(MerchantStats).filter(MerchantStats.user_id == user_id).all()
+    insights = compute_insights(user_id, category_stats, merchant_stats, datetime.date.today())
+    db.query(UserInsight).filter(UserInsight.user_id == user_id).delete(synchronize_session=False)
+    db.add_all(insights)
+
+# --- Lectura (dashboard) ---
+
+def load_insights(db: Session, user_id: int) -> List[UserInsight]:
+    """Insights vigentes del usuario, del más al menos relevante."""
+    today = datetime.date.today()
+    return (
+        db.query(UserInsight)
+        .filter(UserInsight.user_id == user_id)
+        .filter((UserInsight.relevant_until.is_(None)) | (UserInsight.relevant_until >= today))
+        .order_by(UserInsight.score.desc())
+        .all()
+    )
@@ -0,0 +1,155 @@
+import asyncio
+import threading
+from typing import Any, Dict, List
+
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+
+from ..core.config import settings
+from ..core.pubsub import PubSub
+from ..db.database import SessionLocal
+from ..models.budget import AlertOutbox
+from ..models.dashboard_change import DashboardChange
+from ..schemas.budget import BudgetAlertRead
+
+# --- Avisos en Vivo para el Dashboard ---
+# Tras guardar transacciones, categorías o presupuestos se incrementa la versión del dashboard del
+# usuario (tabla dashboard_changes) y se publica un aviso en 'dashboard_events'; las conexiones de
+# /dashboard/stream lo reciben, recalculan los fragmentos desde la BD y envían sólo los que cambiaron.
+# El pub/sub es por proceso: los cambios hechos en otro proceso (workers de la cola de
+# categorización, otros workers de la API) los detecta el sondeo de change_poller, una consulta
+# cada SSE_CHANGE_POLL_SECONDS por proceso para todos los usuarios con conexiones abiertas.
+# Las alertas del outbox de presupuestos viajan en el mismo aviso: se marcan como entregadas
+# (dispatched_at) sólo al publicarlas a alguna conexión abierta; si no hay ninguna, quedan
+# pendientes y se envían al abrir la siguiente conexión.
+
+dashboard_events = PubSub("dashboard")
+
+def claim_alerts(db: Session, user_id: int) -> List[Dict[str, Any]]:
+    """Marca como entregadas las alertas pendientes del usuario (atómico) y las devuelve serializadas."""
+    columns = AlertOutbox.__table__.c
+    statement = (
+        update(AlertOutbox)
+        .where(AlertOutbox.user_id == user_id, AlertOutbox.dispatched_at.is_(None))
+        .values(dispatched_at=func.now())
+        .returning(*columns)
+        .execution_options(synchronize_session=False)
+    )
+    rows = db.execute(statement).all()
+    db.commit()
+    alerts = [BudgetAlertRead.model_validate(dict(row._mapping)).model_dump(mode="json") for row in rows]
+    return sorted(alerts, key=lambda alert: alert["id"])
+
+def _insert(db: Session, table):
+    """INSERT del dialecto (con ON CONFLICT): PostgreSQL o SQLite."""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+def bump_version(db: Session, user_id: int, reason: str) -> int:
+    """Incrementa (atómico) la versión del dashboard del usuario y la devuelve."""
+    table = DashboardChange.__table__
+    statement = _insert(db, table).values(user_id=user_id, version=1, reason=reason)
+    statement = statement.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={"version": table.c.version + 1, "reason": statement.excluded.reason, "changed_at": func.now()},
+    ).returning(table.c.version)
+    version = db.execute(statement).scalar_one()
+    db.commit()
+    return version
+
+def current_version(db: Session, user_id: int) -> int:
+    """Versión actual del dashboard del usuario (0 si nunca cambió)."""
+    return db.query(DashboardChange.version).filter(DashboardChange.user_id == user_id).scalar() or 0
+
+def _publish(db: Session, user_id: int, reason: str, version: int) -> None:
+    try:
+        alerts = claim_alerts(db, user_id)
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR: No se pudieron reclamar las alertas del usuario {user_id}: {e}")
+        alerts = []
+    dashboard_events.publish(user_id, {"reason": reason, "version": version, "alerts": alerts})
+
+def publish_changes(db: Session, user_id: int, reason: str) -> None:
+    """
+    Registra que el dashboard del usuario cambió ('reason': transactions, categories, budgets) y
+    avisa a sus conexiones abiertas en este proceso, con las alertas pendientes. Las de otros
+    procesos lo reciben por el sondeo de change_poller.
+    """
+    try:
+        version = bump_version(db, user_id, reason)
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR: No se pudo registrar el cambio del dashboard del usuario {user_id}: {e}")
+        version = 0 # Sin versión: las conexiones de este proceso se avisan igualmente
+    if not dashboard_events.has_subscribers(user_id):
+        return
+    if version:
+        change_poller.note(user_id, version) # Que el sondeo no lo vuelva a publicar
+    _publish(db, user_id, reason, version)
+
+
+class ChangePoller:
+    """
+    Sondeo de dashboard_changes para los usuarios con conexiones abiertas en este proceso:
+    publica en 'dashboard_events' las versiones que todavía no se habían visto aquí.
+    """
+
+    BATCH_SIZE = 500 # Usuarios por consulta (IN)
+
+    def __init__(self, events: PubSub, interval_seconds: float):
+        self.events = events
+        self.interval_seconds = interval_seconds
+        self._lock = threading.Lock() # note() llega también desde hilos (publish_changes)
+        self._versions: Dict[int, int] = {} # Última versión vista por usuario
+        self.polls = 0
+
+    def note(self, user_id: int, version: int) -> bool:
+        """Registra 'version' como vista. Devuelve True si era nueva para este proceso."""
+        with self._lock:
+            if version <= self._versions.get(user_id, 0):
+                return False
+            self._versions[user_id] = version
+            return True
+
+    def poll_once(self) -> int:
+        """Una pasada (síncrona, en un hilo). Devuelve cuántos usuarios tenían cambios."""
+        user_ids = self.events.keys()
+        with self._lock:
+            # Sin conexiones abiertas no hace falta recordar la versión: se vuelve a leer al conectar
+            for user_id in set(self._versions) - set(user_ids):
+                del self._versions[user_id]
+        if not user_ids:
+            return 0
+        self.polls += 1
+        changed = 0
+        db = SessionLocal()
+        try:
+            for start in range(0, len(user_ids), self.BATCH_SIZE):
+                rows = db.query(DashboardChange.user_id, DashboardChange.version, DashboardChange.reason).filter(
+                    DashboardChange.user_id.in_(user_ids[start:start + self.BATCH_SIZE])
+                ).all()
+                for user_id, version, reason in rows:
+                    if self.note(user_id, version):
+                        changed += 1
+                        _publish(db, user_id, reason, version)
+        finally:
+            db.close()
+        return changed
+
+    async def run(self, stop: asyncio.Event) -> None:
+        """Sondea cada interval_seconds hasta que se activa 'stop'. Los errores no lo detienen."""
+        while not stop.is_set():
+            try:
+                await asyncio.to_thread(self.poll_once)
+            except Exception as e:
+                print(f"ERROR: Falla sondeando cambios del dashboard: {e}")
+            try:
+                await asyncio.wait_for(stop.wait(), self.interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+change_poller = ChangePoller(dashboard_events, settings.SSE_CHANGE_POLL_SECONDS)
@@ -0,0 +1,166 @@
+import datetime
+import os
+import re
+from typing import List, Optional
+
+from sqlalchemy import MetaData, delete, func, select, text
+
+from ..core.config import settings
+from ..db.database import engine
+from ..models.transaction import Transaction, TransactionCategory
+from . import export_service
+
+# --- Mantenimiento de la Tabla de Transacciones ---
+# PostgreSQL: 'transactions' está particionada por mes (ver migración f1c9a2d4b637).
+#   - ensure_future_partitions crea por adelantado las particiones de los próximos meses.
+#   - archive_old_partitions separa (DETACH) las particiones más antiguas que la retención,
+#     las vuelca a un archivo comprimido y las elimina (DROP): sin DELETE masivos ni bloat.
+# Otros motores (SQLite): tabla única; la retención archiva y borra por rangos de fechas.
+# Cada ejecución escribe sus archivos con su propio sello de tiempo (transactions_AAAAMM_<run>): las
+# filas de un mes ya archivado que lleguen tarde van a un archivo nuevo, nunca sobre el anterior.
+
+PARTITION_PATTERN = re.compile(r"^transactions_p(\d{4})(\d{2})$")
+
+def is_partitioned() -> bool:
+    return engine.dialect.name == "postgresql"
+
+def _month(day: datetime.date) -> datetime.date:
+    return day.replace(day=1)
+
+def _add_months(month: datetime.date, months: int) -> datetime.date:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+def retention_cutoff(retention_months: int, today: Optional[datetime.date] = None) -> datetime.date:
+    """Primer día del mes más antiguo que se conserva: lo anterior se archiva."""
+    return _add_months(_month(today or datetime.date.today()), -retention_months)
+
+def archive_run_id() -> str:
+    """Sello (UTC, al segundo) que distingue los archivos de cada ejecución de la retención."""
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+def _archive_path(archive_dir: str, month: datetime.date, run: str) -> str:
+    """Ruta del archivo de un mes en esta ejecución. Nunca se sobrescribe un archivo existente."""
+    extension = "parquet" if export_service.parquet_available() else "csv.gz"
+    path = os.path.join(archive_dir, f"transactions_{month:%Y%m}_{run}.{extension}")
+    if os.path.exists(path):
+        raise FileExistsError(f"El archivo {path} ya existe; no se sobrescribe un archivo de transacciones.")
+    return path
+
+def _archive_format() -> str:
+    return "parquet" if export_service.parquet_available() else "csv"
+
+def ensure_future_partitions(months_ahead: int) -> int:
+    """Crea las particiones que falten hasta 'months_ahead' meses vista. Devuelve cuántas creó."""
+    if not is_partitioned():
+        return 0
+    with engine.begin() as conn:
+        created = conn.execute(
+            text("SELECT transactions_ensure_partitions(CAST(:from_month AS date), :months_ahead)"),
+            {"from_month": _month(datetime.date.today()), "months_ahead": months_ahead},
+        ).scalar()
+    if created:
+        print(f"DEBUG: Creadas {created} particiones nuevas de transactions.")
+    return created or 0
+
+def list_partitions() -> List[datetime.date]:
+    """Meses con partición propia adjunta a 'transactions' (PostgreSQL)."""
+    with engine.connect() as conn:
+        names = conn.execute(text("""
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            WHERE parent.relname = 'transactions'
+        """)).scalars().all()
+    months = []
+    for name in names:
+        match = PARTITION_PATTERN.match(name)
+        if match:
+            months.append(datetime.date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+def _archive_partition(month: datetime.date, archive_dir: str, run: str, dry_run: bool) -> int:
+    name = f"transactions_p{month:%Y%m}"
+    path = _archive_path(archive_dir, month, run)
+    if dry_run:
+        print(f"DEBUG: [dry-run] Se archivaría la partición {name} en {path}")
+        return 0
+
+    # 1. Separar la partición: a partir de aquí no recibe escrituras y no se pierde nada al volcarla
+    with engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE transactions DETACH PARTITION "{name}"'))
+    try:
+        # 2. Volcar al archivo comprimido (cursor del servidor, por lotes)
+        partition = Transaction.__table__.to_metadata(MetaData(), name=name)
+        rows = export_service.write_file(
+            path, _archive_format(),
+            export_service.iter_row_batches(export_service.rows_statement(partition), settings.EXPORT_BATCH_SIZE),
+        )
+        # 3. Eliminar sus categorías y la partición completa (DROP: sin DELETE fila a fila ni VACUUM)
+        with engine.begin() as conn:
+            conn.execute(delete(TransactionCategory).where(
+                TransactionCategory.transaction_id.in_(select(partition.c.transaction_id))
+            ))
+            conn.execute(text(f'DROP TABLE "{name}"'))
+    except Exception:
+        # Si el volcado falla, la partición vuelve a su sitio intacta
+        with engine.begin() as conn:
+            conn.execute(text(
+                f"ALTER TABLE transactions ATTACH PARTITION \"{name}\" FOR VALUES FROM ('{month}') TO ('{_add_months(month, 1)}')"
+            ))
+        raise
+    print(f"DEBUG: Partición {name} archivada en {path} ({rows} filas).")
+    return rows
+
+def _archive_month_rows(month: datetime.date, archive_dir: str, run: str, dry_run: bool) -> int:
+    """Modo tabla única: archiva y borra las filas de un mes."""
+    next_month = _add_months(month, 1)
+    in_month = (Transaction.date >= month) & (Transaction.date < next_month)
+    path = _archive_path(archive_dir, month, run)
+    with engine.connect() as conn:
+        if conn.execute(select(Transaction.transaction_id).where(in_month).limit(1)).first() is None:
+            return 0 # Mes sin transacciones: no se genera archivo
+    if dry_run:
+        print(f"DEBUG: [dry-run] Se archivarían las transacciones de {month:%Y-%m} en {path}")
+        return 0
+    rows = export_service.write_file(
+        path, _archive_format(),
+        export_service.iter_row_batches(export_service.rows_statement().where(in_month), settings.EXPORT_BATCH_SIZE),
+    )
+    with engine.begin() as conn:
+        conn.execute(delete(TransactionCategory).where(
+            TransactionCategory.transaction_id.in_(select(Transaction.transaction_id).where(in_month))
+        ))
+        conn.execute(delete(Transaction).where(in_month))
+    print(f"DEBUG: Transacciones de {month:%Y-%m} archivadas en {path} ({rows} filas).")
+    return rows
+
+def archive_old_partitions(retention_months: int, archive_dir: str, dry_run: bool = False) -> int:
+    """
+    Archiva (archivo comprimido por mes) y elimina las transacciones anteriores a la retención.
+
+    Returns:
+        Número de filas archivadas.
+    """
+    cutoff = retention_cutoff(retention_months)
+    os.makedirs(archive_dir, exist_ok=True)
+    run = archive_run_id()
+    archived = 0
+
+    if is_partitioned():
+        for month in list_partitions():
+            if month < cutoff:
+                archived += _archive_partition(month, archive_dir, run, dry_run)
+        # Las filas antiguas que cayeron en la partición DEFAULT se tratan como en tabla única
+        with engine.connect() as conn:
+            oldest = conn.execute(text("SELECT min(date) FROM transactions_default WHERE date < :cutoff"), {"cutoff": cutoff}).scalar()
+    else:
+        with engine.connect() as conn:
+            oldest = conn.execute(select(func.min(Transaction.date)).where(Transaction.date < cutoff)).scalar()
+
+    if oldest is not None:
+        month = _month(oldest)
+        while month < cutoff:
+            archived += _archive_month_rows(month, archive_dir, run, dry_run)
+            month = _add_months(month, 1)
+    return archived
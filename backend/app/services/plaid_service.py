@@ -0,0 +1,244 @@
+import asyncio
+import datetime
+import heapq
+import weakref
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from plaid.model.transactions_sync_request import TransactionsSyncRequest
+    from plaid.model.accounts_get_request import AccountsGetRequest
+except ImportError:
+    # La librería Plaid no está disponible (ver routers/plaid.py)
+    TransactionsSyncRequest = None
+    AccountsGetRequest = None
+
+from ..core.cache import cache
+from ..core.config import settings
+from ..core.singleflight import SingleFlight
+from ..core.rate_limit import plaid_limiter, RateLimitExceeded
+from ..core.security import decrypt_data
+from ..models.plaid_item import PlaidItem
+from ..schemas.plaid import PlaidTransaction, PlaidAccount, PlaidItemSync
+from .fx_service import fx_rates, to_days
+
+# --- Concurrencia por Usuario ---
+# Un semáforo por usuario: todas las peticiones concurrentes del mismo usuario comparten
+# el límite PLAID_MAX_CONCURRENCY_PER_USER, no sólo las de una misma petición.
+# Referencias débiles: el semáforo vive mientras alguna petición del usuario lo use y luego
+# desaparece del diccionario (no crece con cada usuario que ha pasado por el proceso).
+_user_semaphores: "weakref.WeakValueDictionary[int, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+
+def _user_semaphore(user_id: int) -> asyncio.Semaphore:
+    semaphore = _user_semaphores.get(user_id)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max(1, settings.PLAID_MAX_CONCURRENCY_PER_USER))
+        _user_semaphores[user_id] = semaphore
+    return semaphore
+
+async def fan_out_items(
+    user_id: int,
+    items: List[PlaidItem],
+    fetch: Callable[[PlaidItem], Any],
+    flight: Optional[SingleFlight] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+    """
+    Ejecuta 'fetch' (síncrona, SDK de Plaid) para cada Item en paralelo, en hilos,
+    respetando el límite de concurrencia del usuario. Con 'flight', las consultas concurrentes
+    del mismo Item se colapsan en una sola (y su resultado se reutiliza durante su TTL).
+
+    Returns:
+        (resultados por item_id, errores por item_id). El fallo de un Item (incluido
+        RateLimitExceeded si el limitador de Plaid está saturado) no afecta a los demás.
+    """
+    semaphore = _user_semaphore(user_id)
+
+    async def call(item: PlaidItem) -> Any:
+        async with semaphore:
+            await plaid_limiter.acquire() # Lanza RateLimitExceeded si el limitador está saturado
+            return await asyncio.to_thread(fetch, item)
+
+    async def run(item: PlaidItem) -> Any:
+        if flight is None:
+            return await call(item)
+        return await flight.do(item.item_id, lambda: call(item))
+
+    outcomes = await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+
+    results: Dict[str, Any] = {}
+    errors: Dict[str, Exception] = {}
+    for item, outcome in zip(items, outcomes):
+        if isinstance(outcome, Exception):
+            print(f"ERROR: Falla al consultar Plaid para item {item.item_id}: {outcome}")
+            errors[item.item_id] = outcome
+        else:
+            results[item.item_id] = outcome
+    return results, errors
+
+def decrypt_item_token(item: PlaidItem) -> str:
+    """Desencripta el access_token de un Item. Lanza ValueError si no es posible."""
+    access_token = decrypt_data(item.access_token_encrypted)
+    if not access_token:
+        raise ValueError(f"No se pudo desencriptar el access_token del item {item.item_id}")
+    return access_token
+
+# Transacciones por Item: peticiones concurrentes (dashboard, /plaid/transactions) comparten
+# una única llamada a Transactions Sync y su resultado se reutiliza unos segundos.
+transactions_flight = SingleFlight(
+    "plaid_transactions",
+    namespace=cache.namespace("plaid_transactions", settings.PLAID_TRANSACTIONS_CACHE_TTL_SECONDS, value_type=PlaidItemSync),
+)
+
+def sync_item_transactions(client: Any, item: PlaidItem) -> PlaidItemSync:
+    """
+    Obtiene (síncronamente) los cambios de un Item vía Transactions Sync:
+    transacciones añadidas y modificadas, e ids de las eliminadas.
+    """
+    access_token = decrypt_item_token(item)
+    # Para simplicidad en MVP, pediremos siempre las últimas transacciones
+    # (requiere más lógica de cursor para ser eficiente en producción)
+    request = TransactionsSyncRequest(access_token=access_token)
+    response = client.transactions_sync(request)
+
+    # La respuesta contiene 'added', 'modified' y 'removed'
+    transactions_list: List[PlaidTransaction] = []
+    for t_dict in list(response.get('added', [])) + list(response.get('modified', [])):
+        try:
+            transaction = PlaidTransaction.model_validate(t_dict)
+        except Exception as validation_error:
+            print(f"Error validando transacción de Plaid: {validation_error}, Datos: {t_dict}")
+            continue # Omitir transacción inválida
+        transaction.item_id = item.item_id
+        transactions_list.append(transaction)
+    removed = [entry['transaction_id'] for entry in response.get('removed', []) if entry.get('transaction_id')]
+    return PlaidItemSync(transactions=transactions_list, removed=removed)
+
+def merge_transactions(per_item: List[List[PlaidTransaction]]) -> List[PlaidTransaction]:
+    """Une las listas de cada Item en un único flujo ordenado por fecha (más reciente primero)."""
+    sorted_lists = [sorted(transactions, key=lambda t: t.date, reverse=True) for transactions in per_item]
+    return list(heapq.merge(*sorted_lists, key=lambda t: t.date, reverse=True))
+
+# --- Cuentas y Saldos (accounts_get) con Caché TTL ---
+
+def fetch_item_accounts(client: Any, item: PlaidItem) -> List[PlaidAccount]:
+    """Obtiene (síncronamente) las cuentas de un Item con sus saldos vía accounts_get."""
+    access_token = decrypt_item_token(item)
+    response = client.accounts_get(AccountsGetRequest(access_token=access_token))
+    data = response.to_dict() if hasattr(response, 'to_dict') else response
+
+    accounts: List[PlaidAccount] = []
+    for account in data.get('accounts', []):
+        balances = account.get('balances') or {}
+        accounts.append(PlaidAccount(
+            account_id=account['account_id'],
+            item_id=item.item_id,
+            name=account.get('name') or "Cuenta",
+            official_name=account.get('official_name'),
+            type=str(account['type']) if account.get('type') is not None else None,
+            subtype=str(account['subtype']) if account.get('subtype') is not None else None,
+            mask=account.get('mask'),
+            current_balance=balances.get('current'),
+            available_balance=balances.get('available'),
+            iso_currency_code=balances.get('iso_currency_code'),
+        ))
+    return accounts
+
+class AccountsCache:
+    """
+    Caché de las cuentas de cada Item, con TTL, sobre la caché compartida (espacio 'plaid_accounts').
+    Las entradas expiradas se conservan PLAID_ACCOUNTS_STALE_SECONDS para degradar si Plaid está saturado.
+    Los misses concurrentes del mismo Item (en este proceso) se colapsan en una única llamada a Plaid.
+    """
+
+    def __init__(self, ttl_seconds: float, stale_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._namespace = cache.namespace("plaid_accounts", ttl_seconds, stale_seconds, value_type=List[PlaidAccount])
+        self._flight = SingleFlight("plaid_accounts")
+
+    async def peek(self, item_id: str) -> Optional[List[PlaidAccount]]:
+        """Devuelve las cuentas cacheadas si siguen vigentes (sin llamar a Plaid)."""
+        return await self._namespace.aget(item_id)
+
+    async def invalidate(self, item_id: str) -> None:
+        await self._namespace.adelete(item_id)
+
+    async def get(self, item_id: str, loader: Callable[[], Awaitable[List[PlaidAccount]]]) -> List[PlaidAccount]:
+        cached = await self.peek(item_id)
+        if cached is not None:
+            return cached
+
+        async def load() -> List[PlaidAccount]:
+            try:
+                accounts = await loader()
+            except RateLimitExceeded:
+                # Degradación explícita: con el limitador saturado se sirven los saldos expirados
+                accounts = await self._namespace.aget_stale(item_id)
+                if accounts is None:
+                    raise
+                print(f"ADVERTENCIA: Limitador de Plaid saturado; sirviendo cuentas expiradas del item {item_id}.")
+                return accounts # No se vuelve a guardar: siguen expirados
+            await self._namespace.aset(item_id, accounts)
+            return accounts
+
+        # Otra petición que ya está consultando este Item comparte su resultado
+        return await self._flight.do(item_id, load)
+
+accounts_cache = AccountsCache(settings.PLAID_ACCOUNTS_CACHE_TTL_SECONDS, settings.PLAID_ACCOUNTS_STALE_SECONDS)
+
+async def get_accounts_for_items(
+    client: Any,
+    user_id: int,
+    items: List[PlaidItem],
+) -> Tuple[List[PlaidAccount], Dict[str, Exception]]:
+    """
+    Devuelve las cuentas de todos los Items del usuario, desde la caché cuando es posible.
+    Los Items sin caché se consultan en paralelo respetando el límite del usuario.
+    """
+    semaphore = _user_semaphore(user_id)
+
+    def loader_for(item: PlaidItem) -> Callable[[], Awaitable[List[PlaidAccount]]]:
+        async def load() -> List[PlaidAccount]:
+            async with semaphore:
+                await plaid_limiter.acquire()
+                return await asyncio.to_thread(fetch_item_accounts, client, item)
+        return load
+
+    outcomes = await asyncio.gather(
+        *(accounts_cache.get(item.item_id, loader_for(item)) for item in items),
+        return_exceptions=True,
+    )
+
+    accounts: List[PlaidAccount] = []
+    errors: Dict[str, Exception] = {}
+    for item, outcome in zip(items, outcomes):
+        if isinstance(outcome, Exception):
+            print(f"ERROR: Falla al obtener cuentas de Plaid para item {item.item_id}: {outcome}")
+            errors[item.item_id] = outcome
+        else:
+            accounts.extend(outcome)
+    return accounts, errors
+
+# Tipos de cuenta cuyo saldo es deuda (resta del balance total)
+LIABILITY_ACCOUNT_TYPES = {"credit", "loan"}
+
+def total_balance(accounts: List[PlaidAccount], currency: Optional[str] = None) -> float:
+    """
+    Suma los saldos actuales: activos suman, deudas (crédito/préstamo) restan.
+    Cada saldo se convierte a 'currency' (por defecto BASE_CURRENCY) con el tipo de cambio más
+    reciente; las cuentas en divisas sin tipos se omiten.
+    """
+    accounts = [account for account in accounts if account.current_balance is not None]
+    if not accounts:
+        return 0.0
+    balances = np.asarray([
+        -account.current_balance if account.type in LIABILITY_ACCOUNT_TYPES else account.current_balance
+        for account in accounts
+    ], dtype=np.float64)
+    codes = fx_rates.codes(account.iso_currency_code for account in accounts)
+    converted = fx_rates.convert(balances, codes, to_days([datetime.date.today()] * len(accounts)), currency or settings.BASE_CURRENCY)
+    skipped = np.isnan(converted)
+    if skipped.any():
+        missing = sorted({accounts[i].iso_currency_code for i in np.flatnonzero(skipped)})
+        print(f"ADVERTENCIA: {int(skipped.sum())} cuentas sin tipo de cambio ({', '.join(missing)}) fuera del balance.")
+    return float(converted[~skipped].sum())
@@ -0,0 +1,144 @@
+import functools
+from typing import Optional, Tuple
+
+import numpy as np
+
+from ..core.config import settings
+from ..schemas.investment import PortfolioProjection, ProjectionBand, RiskProfile
+
+# --- Proyección Monte Carlo de Cartera ---
+# Simula miles de trayectorias de rentabilidad anual (log-normal) para un plan de aportaciones.
+# Todo está vectorizado: con P_t = producto de los factores de crecimiento hasta el año t,
+# el patrimonio tras t años es  W_t = P_t * (W_0 + sum_{s<=t} C_s / P_{s-1})
+# (aportación C_s al inicio del año s), es decir, un cumprod y un cumsum sobre la matriz
+# (trayectorias x años) sin bucles en Python. 10.000 trayectorias x 40 años < 20 ms.
+
+# Hipótesis de mercado (ilustrativas, anuales): renta variable y renta fija
+EQUITY_RETURN, EQUITY_VOLATILITY = 0.07, 0.16
+BOND_RETURN, BOND_VOLATILITY = 0.03, 0.05
+EQUITY_BOND_CORRELATION = 0.1
+# Coste aproximado de restringir la cartera a fondos ESG
+ESG_RETURN_ADJUSTMENT = -0.002
+
+# Palabras clave de 'primary_goal' (texto libre) y su ajuste sobre el % de renta variable
+GOAL_EQUITY_ADJUSTMENTS = [
+    (("emergencia", "emergency", "deuda", "debt", "casa", "house", "home", "vivienda", "corto", "short"), -0.25),
+    (("ahorr", "sav", "estudio", "educa", "college"), -0.10),
+    (("jubila", "retire", "pensi"), 0.0),
+    (("crec", "grow", "invert", "invest", "riqueza", "wealth", "libertad", "fire"), 0.10),
+]
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+def risk_profile(age: Optional[int], primary_goal: Optional[str], esg_interest: bool) -> RiskProfile:
+    """
+    Perfil de riesgo a partir del perfil del usuario: % en renta variable según la edad
+    (regla '110 - edad'), ajustado por el objetivo principal, y su rentabilidad/volatilidad esperadas.
+    """
+    equity_share = (110 - (age or 35)) / 100.0
+    goal = (primary_goal or "").lower()
+    for keywords, adjustment in GOAL_EQUITY_ADJUSTMENTS:
+        if any(keyword in goal for keyword in keywords):
+            equity_share += adjustment
+            break
+    equity_share = float(min(0.95, max(0.10, equity_share)))
+    bond_share = 1.0 - equity_share
+
+    expected_return = equity_share * EQUITY_RETURN + bond_share * BOND_RETURN
+    if esg_interest:
+        expected_return += ESG_RETURN_ADJUSTMENT
+    variance = (
+        (equity_share * EQUITY_VOLATILITY) ** 2 + (bond_share * BOND_VOLATILITY) ** 2
+        + 2 * equity_share * bond_share * EQUITY_BOND_CORRELATION * EQUITY_VOLATILITY * BOND_VOLATILITY
+    )
+    if equity_share >= 0.7:
+        name = "crecimiento"
+    elif equity_share >= 0.45:
+        name = "equilibrado"
+    else:
+        name = "conservador"
+    return RiskProfile(
+        name=name,
+        equity_share=round(equity_share, 4),
+        expected_return=round(expected_return, 6),
+        volatility=round(float(np.sqrt(variance)), 6),
+        esg=esg_interest,
+    )
+
+def simulate_paths(
+    initial_amount: float,
+    annual_contribution: float,
+    contribution_growth: float,
+    years: int,
+    expected_return: float,
+    volatility: float,
+    paths: int,
+    seed: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Devuelve (patrimonio, aportado): matriz (paths, years + 1) con el valor de cada trayectoria
+    al final de cada año (columna 0 = hoy) y el total aportado acumulado por año.
+    """
+    rng = np.random.default_rng(seed)
+    # Rentabilidad log-normal con media aritmética 'expected_return'
+    sigma = np.sqrt(np.log1p(volatility ** 2 / (1.0 + expected_return) ** 2))
+    mu = np.log1p(expected_return) - 0.5 * sigma ** 2
+    log_growth = rng.standard_normal((paths, years), dtype=np.float64)
+    log_growth *= sigma
+    log_growth += mu
+
+    cumulative = np.exp(np.cumsum(log_growth, axis=1))                 # P_1 .. P_T
+    previous = np.empty_like(cumulative)                                # P_0 .. P_{T-1}
+    previous[:, 0] = 1.0
+    previous[:, 1:] = cumulative[:, :-1]
+
+    contributions = annual_contribution * (1.0 + contribution_growth) ** np.arange(years)  # C_1 .. C_T
+    wealth = np.empty((paths, years + 1), dtype=np.float64)
+    wealth[:, 0] = initial_amount
+    np.cumsum(contributions / previous, axis=1, out=previous)           # reutiliza el buffer
+    previous += initial_amount
+    np.multiply(cumulative, previous, out=wealth[:, 1:])
+
+    contributed = initial_amount + np.concatenate(([0.0], np.cumsum(contributions)))
+    return wealth, contributed
+
+@functools.lru_cache(maxsize=settings.PROJECTION_CACHE_SIZE)
+def project_portfolio(
+    age: Optional[int],
+    primary_goal: Optional[str],
+    esg_interest: bool,
+    initial_amount: float,
+    monthly_contribution: float,
+    contribution_growth: float,
+    years: int,
+    paths: int,
+    seed: int,
+    target_amount: Optional[float],
+) -> PortfolioProjection:
+    """
+    Proyección con bandas de percentiles año a año. Determinista (RNG con semilla) y
+    cacheada por perfil y parámetros: mover un slider a un valor ya visto no recalcula nada.
+    El resultado cacheado es compartido: no debe modificarse.
+    """
+    profile = risk_profile(age, primary_goal, esg_interest)
+    wealth, contributed = simulate_paths(
+        initial_amount, monthly_contribution * 12.0, contribution_growth, years,
+        profile.expected_return, profile.volatility, paths, seed,
+    )
+    bands = np.percentile(wealth, PERCENTILES, axis=0)
+    # En porcentaje (0-100), como documenta el esquema
+    probability = round(float(np.mean(wealth[:, -1] >= target_amount)) * 100.0, 2) if target_amount is not None else None
+
+    return PortfolioProjection(
+        risk_profile=profile,
+        years=list(range(years + 1)),
+        contributed=np.round(contributed, 2).tolist(),
+        bands=[
+            ProjectionBand(percentile=p, values=np.round(values, 2).tolist())
+            for p, values in zip(PERCENTILES, bands)
+        ],
+        target_amount=target_amount,
+        probability_of_target=probability,
+        paths=paths,
+        seed=seed,
+    )
@@ -0,0 +1,249 @@
+import datetime
+import sys
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..models.transaction import Transaction, TransactionCategory
+from ..core.config import settings
+from ..schemas.plaid import PlaidTransaction
+from .fx_service import FxRates
+from .ia_service import FINANCIAL_CATEGORIES, UNCATEGORIZED_CATEGORY
+
+# --- Representación Columnar de Transacciones ---
+# Para agregar, una lista de PlaidTransaction (un objeto Pydantic por fila, con sus str, date y
+# dict internos) ocupa del orden de 1-2 KB por transacción y cada suma recorre atributos en Python.
+# TransactionFrame guarda una columna NumPy por campo (~21 bytes por fila):
+#   amounts float64 · days int32 (días desde 1970-01-01) · category_codes int16 · pending bool
+#   name_codes int32 -> 'names' (cada nombre distinto una sola vez, internado)
+#   currency_codes int16 -> 'currencies' (divisa del importe; sin divisa = BASE_CURRENCY)
+# Las agregaciones son bincount sobre los códigos: suma por categoría, por ventana de fechas
+# o por ambas a la vez, sin recorrer filas en Python. Sólo tiene sentido sumar importes de una
+# misma divisa: in_currency() convierte el frame entero con los tipos diarios (services/fx_service.py).
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+def to_day(day: datetime.date) -> int:
+    return day.toordinal() - _EPOCH_ORDINAL
+
+def from_day(day: int) -> datetime.date:
+    return datetime.date.fromordinal(int(day) + _EPOCH_ORDINAL)
+
+
+class TransactionFrame:
+    """Transacciones de un usuario en columnas (sólo lectura una vez construido)."""
+
+    __slots__ = ("amounts", "days", "category_codes", "pending", "name_codes", "currency_codes",
+                 "categories", "names", "currencies")
+
+    def __init__(
+        self,
+        amounts: np.ndarray,
+        days: np.ndarray,
+        category_codes: np.ndarray,
+        pending: np.ndarray,
+        name_codes: np.ndarray,
+        currency_codes: np.ndarray,
+        categories: List[str],
+        names: List[str],
+        currencies: List[str],
+    ):
+        self.amounts = amounts
+        self.days = days
+        self.category_codes = category_codes
+        self.pending = pending
+        self.name_codes = name_codes
+        self.currency_codes = currency_codes
+        self.categories = categories # código -> categoría
+        self.names = names # código -> nombre
+        self.currencies = currencies # código -> divisa
+
+    # --- Construcción ---
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[datetime.date, float, bool, str, Optional[str], Optional[str]]],
+                  default_category: str = UNCATEGORIZED_CATEGORY) -> "TransactionFrame":
+        """
+        Construye el frame desde filas (fecha, importe, pendiente, nombre, categoría o None,
+        divisa o None), ej. directamente de un cursor de la base de datos, sin objetos
+        intermedios por fila.
+        """
+        category_index = {category: code for code, category in enumerate(FINANCIAL_CATEGORIES)}
+        categories = list(FINANCIAL_CATEGORIES)
+        name_index: Dict[str, int] = {}
+        names: List[str] = []
+        currency_index: Dict[str, int] = {}
+        currencies: List[str] = []
+        amounts: List[float] = []
+        days: List[int] = []
+        category_codes: List[int] = []
+        pending: List[bool] = []
+        name_codes: List[int] = []
+        currency_codes: List[int] = []
+
+        for day, amount, is_pending, name, category, currency in rows:
+            category = category or default_category
+            code = category_index.get(category)
+            if code is None:
+                code = category_index[category] = len(categories)
+                categories.append(category)
+            name_code = name_index.get(name)
+            if name_code is None:
+                name_code = name_index[name] = len(names)
+                names.append(sys.intern(name))
+            currency = (currency or settings.BASE_CURRENCY).upper()
+            currency_code = currency_index.get(currency)
+            if currency_code is None:
+                currency_code = currency_index[currency] = len(currencies)
+                currencies.append(currency)
+            amounts.append(amount)
+            days.append(day.toordinal() - _EPOCH_ORDINAL)
+            category_codes.append(code)
+            pending.append(bool(is_pending))
+            name_codes.append(name_code)
+            currency_codes.append(currency_code)
+
+        return cls(
+            amounts=np.asarray(amounts, dtype=np.float64),
+            days=np.asarray(days, dtype=np.int32),
+            category_codes=np.asarray(category_codes, dtype=np.int16),
+            pending=np.asarray(pending, dtype=np.bool_),
+            name_codes=np.asarray(name_codes, dtype=np.int32),
+            currency_codes=np.asarray(currency_codes, dtype=np.int16),
+            categories=categories,
+            names=names,
+            currencies=currencies,
+        )
+
+    @classmethod
+    def from_transactions(cls, transactions: Sequence[PlaidTransaction], categories: Mapping[str, str],
+                          default_category: str = UNCATEGORIZED_CATEGORY) -> "TransactionFrame":
+        """Construye el frame desde una página de sincronización y sus categorías {transaction_id: categoría}."""
+        return cls.from_rows(
+            ((t.date, t.amount, t.pending, t.name, categories.get(t.transaction_id), t.iso_currency_code)
+             for t in transactions),
+            default_category,
+        )
+
+    # --- Propiedades ---
+
+    def __len__(self) -> int:
+        return int(self.amounts.shape[0])
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria de las columnas NumPy (los nombres distintos aparte)."""
+        columns = ("amounts", "days", "category_codes", "pending", "name_codes", "currency_codes")
+        return sum(getattr(self, column).nbytes for column in columns)
+
+    def category_mask(self, categories: Iterable[str]) -> np.ndarray:
+        """Filas cuya categoría está en 'categories'."""
+        wanted = set(categories)
+        codes = [code for code, category in enumerate(self.categories) if category in wanted]
+        return np.isin(self.category_codes, codes)
+
+    def date_mask(self, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None) -> np.ndarray:
+        """Filas con fecha en [start, end] (ambos incluidos; None = sin límite)."""
+        mask = np.ones(len(self), dtype=np.bool_)
+        if start is not None:
+            mask &= self.days >= to_day(start)
+        if end is not None:
+            mask &= self.days <= to_day(end)
+        return mask
+
+    def spending_mask(self, excluded_categories: Iterable[str] = ()) -> np.ndarray:
+        """Gastos (importe positivo, convención de Plaid) fuera de las categorías excluidas."""
+        return (self.amounts > 0) & ~self.category_mask(excluded_categories)
+
+    # --- Divisas ---
+
+    def in_currency(self, fx: FxRates, currency: str) -> "TransactionFrame":
+        """
+        Frame con todos los importes convertidos a 'currency' con el tipo del día de cada fila
+        (un único cálculo vectorizado). Las filas en divisas sin tipos de cambio se descartan.
+        """
+        currency = currency.upper()
+        if self.currencies in ([], [currency]):
+            return self
+        converted = fx.convert(self.amounts, fx.codes(self.currencies)[self.currency_codes], self.days, currency)
+        known = ~np.isnan(converted)
+        if not known.all():
+            missing = sorted({self.currencies[code] for code in np.unique(self.currency_codes[~known])})
+            print(f"ADVERTENCIA: {int((~known).sum())} transacciones sin tipo de cambio ({', '.join(missing)}) excluidas de los agregados.")
+        return TransactionFrame(
+            amounts=converted[known],
+            days=self.days[known],
+            category_codes=self.category_codes[known],
+            pending=self.pending[known],
+            name_codes=self.name_codes[known],
+            currency_codes=np.zeros(int(known.sum()), dtype=np.int16),
+            categories=self.categories,
+            names=self.names,
+            currencies=[currency],
+        )
+
+    # --- Agregaciones ---
+
+    def sum_by_category(self, mask: Optional[np.ndarray] = None) -> Dict[str, float]:
+        """{categoría: total} de las filas seleccionadas (sólo categorías con filas)."""
+        codes = self.category_codes if mask is None else self.category_codes[mask]
+        amounts = self.amounts if mask is None else self.amounts[mask]
+        totals = np.bincount(codes, weights=amounts, minlength=len(self.categories))
+        counts = np.bincount(codes, minlength=len(self.categories))
+        return {self.categories[code]: float(totals[code]) for code in np.flatnonzero(counts)}
+
+    def _window_index(self, edges: Sequence[datetime.date]) -> np.ndarray:
+        """Ventana de cada fila para los límites dados (-1 = fuera de rango)."""
+        bounds = np.asarray([to_day(edge) for edge in edges], dtype=np.int32)
+        index = np.searchsorted(bounds, self.days, side="right") - 1
+        index[(index < 0) | (index >= len(bounds) - 1)] = -1
+        return index
+
+    def sum_by_window(self, edges: Sequence[datetime.date], mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Totales por ventana de fechas [edges[i], edges[i+1]) (edges ordenados).
+        Devuelve un array de len(edges) - 1 totales.
+        """
+        index = self._window_index(edges)
+        selected = index >= 0 if mask is None else (index >= 0) & mask
+        return np.bincount(index[selected], weights=self.amounts[selected], minlength=len(edges) - 1)
+
+    def sum_by_category_and_window(
+        self, edges: Sequence[datetime.date], mask: Optional[np.ndarray] = None,
+    ) -> Tuple[List[str], np.ndarray]:
+        """
+        Matriz categoría x ventana de totales (un único bincount sobre el índice combinado).
+        Devuelve (categorías, matriz) sólo con las categorías que tienen filas seleccionadas.
+        """
+        windows = len(edges) - 1
+        index = self._window_index(edges)
+        selected = index >= 0 if mask is None else (index >= 0) & mask
+        combined = self.category_codes[selected].astype(np.int64) * windows + index[selected]
+        totals = np.bincount(combined, weights=self.amounts[selected], minlength=len(self.categories) * windows)
+        matrix = totals.reshape(len(self.categories), windows)
+        present = np.flatnonzero(np.bincount(self.category_codes[selected], minlength=len(self.categories)))
+        return [self.categories[code] for code in present], matrix[present]
+
+
+def load_frame(
+    db: Session,
+    user_id: int,
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    batch_size: int = 5000,
+) -> TransactionFrame:
+    """Histórico guardado del usuario (con su categoría) como TransactionFrame, leído por lotes."""
+    statement = (
+        select(Transaction.date, Transaction.amount, Transaction.pending, Transaction.name, TransactionCategory.category,
+               Transaction.iso_currency_code)
+        .outerjoin(TransactionCategory, TransactionCategory.transaction_id == Transaction.transaction_id)
+        .where(Transaction.user_id == user_id)
+        .execution_options(yield_per=batch_size)
+    )
+    if start is not None:
+        statement = statement.where(Transaction.date >= start)
+    if end is not None:
+        statement = statement.where(Transaction.date <= end)
+    return TransactionFrame.from_rows(db.execute(statement))
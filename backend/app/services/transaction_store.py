@@ -0,0 +1,294 @@
+import asyncio
+import csv
+import io
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+from sqlalchemy import delete, func, or_, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..db.database import SessionLocal
+from ..models.categorization_job import CategorizationJob
+from ..models.transaction import Transaction, TransactionCategory
+from ..schemas.plaid import PlaidTransaction
+from .insight_service import apply_transactions, revert_transactions
+from .live_updates import publish_changes
+from .categorization_queue import enqueue
+
+# --- Histórico de Transacciones ---
+# transactions_sync sólo devuelve lo de esta consulta; guardamos cada transacción
+# para que las tendencias (dashboard/timeseries) cubran cualquier rango de fechas.
+# La ingesta es por lotes, todo en una única transacción de la base de datos:
+#   1. Eliminadas (lista 'removed' de Plaid) y pendientes sustituidas por su transacción
+#      confirmada: DELETE por lotes (la categoría de la pendiente pasa a la confirmada).
+#   2. Añadidas/modificadas: INSERT multi-fila ... ON CONFLICT DO UPDATE de INGEST_BATCH_SIZE filas.
+#      Sólo se reescriben las filas que cambian (IS DISTINCT FROM): re-sincronizar lo mismo no
+#      genera versiones muertas en PostgreSQL. Desde INGEST_COPY_THRESHOLD filas, en PostgreSQL
+#      se usa COPY a una tabla temporal y un único INSERT ... SELECT ... ON CONFLICT.
+#   3. Los gastos nuevos se encolan en la cola de categorización.
+# Antes de 1 y 2, las transacciones ya sumadas a estadísticas y presupuestos que se eliminan o
+# cambian de importe, fecha, divisa o nombre se restan (revert_transactions); tras el commit,
+# save_transactions vuelve a aplicarlas con sus valores nuevos.
+# En PostgreSQL la PK es (transaction_id, date) por el particionado: si una transacción cambia
+# de fecha se borra la versión anterior (conservando stats_applied) antes del upsert.
+
+TABLE = Transaction.__table__
+# Columnas que se actualizan cuando la transacción ya existe
+UPDATED_COLUMNS = ("item_id", "account_id", "date", "name", "amount", "iso_currency_code", "pending")
+STAGING_COLUMNS = ("transaction_id", "user_id") + UPDATED_COLUMNS + ("stats_applied",)
+STAGING_TABLE = "transactions_staging"
+
+
+def _row(user_id: int, transaction: PlaidTransaction) -> dict:
+    return {
+        "transaction_id": transaction.transaction_id,
+        "user_id": user_id,
+        "item_id": transaction.item_id,
+        "account_id": transaction.account_id,
+        "date": transaction.date,
+        "name": transaction.name,
+        "amount": transaction.amount,
+        "iso_currency_code": transaction.iso_currency_code,
+        "pending": transaction.pending,
+        "stats_applied": False, # Sólo se usa al insertar: el upsert no lo modifica
+    }
+
+def _chunks(values: Sequence, size: int) -> Iterable[Sequence]:
+    size = max(1, size)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def _insert(db: Session, table):
+    """INSERT del dialecto (con ON CONFLICT): PostgreSQL o SQLite."""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+def _conflict_target(db: Session) -> List[str]:
+    # Con particiones (PostgreSQL) la clave única incluye la fecha
+    return ["transaction_id", "date"] if db.get_bind().dialect.name == "postgresql" else ["transaction_id"]
+
+# --- Eliminaciones y Sustitución de Pendientes ---
+
+def _carry_categories(db: Session, user_id: int, replacements: Dict[str, PlaidTransaction]) -> None:
+    """Copia la categoría de cada pendiente a la transacción confirmada que la sustituye."""
+    for pending_ids in _chunks(list(replacements), settings.INGEST_BATCH_SIZE):
+        rows = db.execute(
+            select(TransactionCategory.transaction_id, TransactionCategory.category, TransactionCategory.source)
+            .where(TransactionCategory.user_id == user_id, TransactionCategory.transaction_id.in_(pending_ids))
+        ).all()
+        if not rows:
+            continue
+        db.execute(
+            _insert(db, TransactionCategory.__table__).on_conflict_do_nothing(index_elements=["transaction_id"]),
+            [
+                {"transaction_id": replacements[pending_id].transaction_id, "user_id": user_id,
+                 "name": replacements[pending_id].name, "category": category, "source": source}
+                for pending_id, category, source in rows
+            ],
+        )
+
+def _delete_transactions(db: Session, user_id: int, transaction_ids: List[str]) -> int:
+    """Borra por lotes las transacciones, sus categorías y sus trabajos de categorización."""
+    deleted = 0
+    for batch in _chunks(transaction_ids, settings.INGEST_BATCH_SIZE):
+        result = db.execute(
+            delete(TABLE).where(TABLE.c.user_id == user_id, TABLE.c.transaction_id.in_(batch))
+        )
+        deleted += result.rowcount or 0
+        db.execute(
+            delete(TransactionCategory.__table__)
+            .where(TransactionCategory.user_id == user_id, TransactionCategory.transaction_id.in_(batch))
+        )
+        db.execute(
+            delete(CategorizationJob.__table__)
+            .where(CategorizationJob.user_id == user_id, CategorizationJob.transaction_id.in_(batch))
+        )
+    return deleted
+
+def _changed_applied(db: Session, user_id: int, rows: Dict[str, dict]) -> Set[str]:
+    """Transacciones ya aplicadas cuyo importe, fecha, divisa o nombre cambia, o que dejan de ser un gasto."""
+    changed: Set[str] = set()
+    for batch in _chunks(list(rows), settings.INGEST_BATCH_SIZE):
+        applied = db.execute(
+            select(TABLE.c.transaction_id, TABLE.c.applied_date, TABLE.c.applied_amount, TABLE.c.applied_currency, TABLE.c.name)
+            .where(TABLE.c.user_id == user_id, TABLE.c.transaction_id.in_(batch), TABLE.c.stats_applied.is_(True))
+        ).all()
+        for transaction_id, day, amount, currency, name in applied:
+            row = rows[transaction_id]
+            if (day, amount, currency, name) != (row["date"], row["amount"], row["iso_currency_code"], row["name"]) \
+                    or row["pending"] or row["amount"] <= 0:
+                changed.add(transaction_id)
+    return changed
+
+# --- Upsert por Lotes ---
+
+def _delete_moved(db: Session, user_id: int, batch: Sequence[dict]) -> None:
+    """
+    PostgreSQL: borra las versiones con otra fecha de las transacciones del lote (quedarían
+    duplicadas en otra partición) y traslada su stats_applied a la fila nueva.
+    """
+    moved = db.execute(
+        delete(TABLE)
+        .where(
+            TABLE.c.user_id == user_id,
+            TABLE.c.transaction_id.in_([row["transaction_id"] for row in batch]),
+            ~tuple_(TABLE.c.transaction_id, TABLE.c.date).in_([(row["transaction_id"], row["date"]) for row in batch]),
+        )
+        .returning(TABLE.c.transaction_id, TABLE.c.stats_applied)
+    ).all()
+    applied = {transaction_id for transaction_id, stats_applied in moved if stats_applied}
+    for row in batch:
+        if row["transaction_id"] in applied:
+            row["stats_applied"] = True
+
+def _upsert_batches(db: Session, user_id: int, rows: List[dict]) -> int:
+    """
+    INSERT multi-fila ... ON CONFLICT DO UPDATE, de INGEST_BATCH_SIZE filas por sentencia.
+    La sentencia se compila una vez (executemany); con psycopg2 SQLAlchemy la envía como
+    VALUES multi-fila ("insertmanyvalues"); sqlite3 la ejecuta en bucle dentro del driver.
+    Devuelve cuántas filas se insertaron o cambiaron (RETURNING sólo las devuelve a ellas).
+    """
+    statement = _insert(db, TABLE)
+    excluded = statement.excluded
+    statement = statement.on_conflict_do_update(
+        index_elements=_conflict_target(db),
+        set_={**{column: excluded[column] for column in UPDATED_COLUMNS}, "updated_at": func.now()},
+        where=or_(*(TABLE.c[column].is_distinct_from(excluded[column]) for column in UPDATED_COLUMNS)),
+    ).returning(TABLE.c.transaction_id).execution_options(insertmanyvalues_page_size=settings.INGEST_BATCH_SIZE)
+    postgres = db.get_bind().dialect.name == "postgresql"
+    changed = 0
+    for batch in _chunks(rows, settings.INGEST_BATCH_SIZE):
+        if postgres:
+            _delete_moved(db, user_id, batch)
+        changed += len(db.execute(statement, list(batch)).all())
+    return changed
+
+def _copy_merge(db: Session, rows: List[dict]) -> int:
+    """
+    PostgreSQL: COPY a una tabla temporal y merge con un único INSERT ... SELECT ... ON CONFLICT.
+    Devuelve cuántas filas se insertaron o cambiaron.
+    """
+    connection = db.connection()
+    connection.exec_driver_sql(
+        f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} "
+        f"(LIKE transactions INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+    )
+    connection.exec_driver_sql(f"TRUNCATE {STAGING_TABLE}")
+
+    # Textos y fechas entre comillas, números y booleanos sin ellas; None se escribe como ""
+    # y FORCE_NULL lo convierte en NULL en las columnas opcionales
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+    writer.writerows([row[column] for column in STAGING_COLUMNS] for row in rows)
+    buffer.seek(0)
+    columns = ", ".join(STAGING_COLUMNS)
+    with connection.connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {STAGING_TABLE} ({columns}) FROM STDIN WITH (FORMAT csv, FORCE_NULL (item_id, iso_currency_code))",
+            buffer,
+        )
+
+    # Transacciones que cambian de fecha: fuera la versión anterior (conservando stats_applied)
+    connection.exec_driver_sql(f"""
+        WITH moved AS (
+            DELETE FROM transactions t USING {STAGING_TABLE} s
+            WHERE t.transaction_id = s.transaction_id AND t.user_id = s.user_id AND t.date <> s.date
+            RETURNING t.transaction_id, t.stats_applied
+        )
+        UPDATE {STAGING_TABLE} s SET stats_applied = moved.stats_applied
+        FROM moved WHERE s.transaction_id = moved.transaction_id
+    """)
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in UPDATED_COLUMNS)
+    current = ", ".join(f"transactions.{column}" for column in UPDATED_COLUMNS)
+    incoming = ", ".join(f"EXCLUDED.{column}" for column in UPDATED_COLUMNS)
+    return connection.exec_driver_sql(f"""
+        INSERT INTO transactions ({columns}, updated_at)
+        SELECT {columns}, now() FROM {STAGING_TABLE}
+        ON CONFLICT (transaction_id, date) DO UPDATE SET {updates}, updated_at = now()
+        WHERE ({current}) IS DISTINCT FROM ({incoming})
+    """).rowcount
+
+# --- Ingesta ---
+
+def ingest_transactions(
+    db: Session, user_id: int, transactions: List[PlaidTransaction], removed: Sequence[str] = (),
+) -> Tuple[int, int]:
+    """
+    Escribe un resultado de Transactions Sync (añadidas/modificadas y eliminadas) en la sesión
+    dada, sin hacer commit: todo queda en la misma transacción de quien llama.
+
+    Returns:
+        (transacciones insertadas o modificadas, transacciones eliminadas).
+    """
+    rows = {t.transaction_id: _row(user_id, t) for t in transactions}
+    # Pendiente -> confirmada: Plaid envía la confirmada con pending_transaction_id y la
+    # pendiente en 'removed'. Se trata igual aunque la pendiente no venga en 'removed'.
+    replacements = {
+        t.pending_transaction_id: t for t in transactions
+        if t.pending_transaction_id and not t.pending and t.pending_transaction_id not in rows
+    }
+    if replacements:
+        _carry_categories(db, user_id, replacements)
+    doomed = sorted((set(removed) | set(replacements)) - set(rows))
+    # Antes de borrar o reescribir: restar lo que ya se aplicó con los valores anteriores
+    for batch in _chunks(sorted(set(doomed) | _changed_applied(db, user_id, rows)), settings.INGEST_BATCH_SIZE):
+        revert_transactions(db, user_id, list(batch))
+    deleted = _delete_transactions(db, user_id, doomed) if doomed else 0
+
+    values = list(rows.values())
+    written = 0
+    if db.get_bind().dialect.name == "postgresql" and len(values) >= settings.INGEST_COPY_THRESHOLD:
+        written = _copy_merge(db, values)
+    elif values:
+        written = _upsert_batches(db, user_id, values)
+
+    # Los gastos nuevos entran en la cola de categorización (ya categorizados o encolados se ignoran)
+    spending = [(row["transaction_id"], row["name"]) for row in values if row["amount"] > 0]
+    for batch in _chunks(spending, settings.INGEST_BATCH_SIZE):
+        enqueue(db, user_id, batch)
+    return written, deleted
+
+def save_transactions(user_id: int, transactions: List[PlaidTransaction], removed: Sequence[str] = ()) -> int:
+    """
+    Inserta, actualiza y elimina las transacciones del usuario (ver ingest_transactions).
+    Abre su propia sesión porque se ejecuta en segundo plano, en un hilo.
+
+    Returns:
+        Número de transacciones insertadas o modificadas.
+    """
+    if not transactions and not removed:
+        return 0
+    db = SessionLocal()
+    try:
+        written, deleted = ingest_transactions(db, user_id, transactions, removed)
+        db.commit()
+        # Las que ya tenían categoría entran ahora en las estadísticas de insights
+        transaction_ids = [t.transaction_id for t in transactions]
+        applied = 0
+        for batch in _chunks(transaction_ids, settings.INGEST_BATCH_SIZE):
+            applied += apply_transactions(db, user_id, list(batch))
+        # Sólo si cambió algo visible: cada /dashboard/data vuelve a guardar la última sincronización
+        if written or applied or deleted:
+            publish_changes(db, user_id, "transactions")
+        return written
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR: No se pudieron guardar transacciones para usuario {user_id}: {e}")
+        return 0
+    finally:
+        db.close()
+
+# Referencias fuertes a las escrituras en segundo plano (evita que el GC las cancele)
+_background: Set[asyncio.Task] = set()
+
+def persist_transactions_in_background(
+    user_id: int, transactions: List[PlaidTransaction], removed: Sequence[str] = (),
+) -> None:
+    """Guarda las transacciones (y aplica las eliminaciones) sin añadir latencia a la petición."""
+    if not transactions and not removed:
+        return
+    task = asyncio.ensure_future(asyncio.to_thread(save_transactions, user_id, list(transactions), list(removed)))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
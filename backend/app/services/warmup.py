@@ -0,0 +1,165 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+from ..core.cache import cache
+from ..core.config import settings
+from ..db.database import engine
+from .fund_catalog import fund_catalog
+from .ia_service import get_http_client, knn_categorizer
+
+# --- Calentamiento y Disponibilidad del Worker ---
+# Cada worker, al arrancar, abre de antemano lo que la primera petición pagaría en su latencia:
+# conexiones del pool de la BD, cliente de Plaid, cliente HTTP de inferencia, páginas del índice
+# kNN y caché compartida. El calentamiento corre como tarea en segundo plano lanzada desde el
+# lifespan (start_warmup): uvicorn no acepta conexiones hasta que el lifespan termina, así que
+# sólo en segundo plano puede /readyz responder durante el arranque. /readyz responde 503
+# ("starting") hasta que el calentamiento termina (y "draining" durante el apagado), de modo
+# que el balanceador no envía peticiones a un worker frío. Las comprobaciones de dependencias
+# se cachean READINESS_CACHE_SECONDS para que las sondas no carguen la base de datos.
+
+READY = "ready"
+STARTING = "starting"
+DRAINING = "draining"
+
+
+class Readiness:
+    """Estado del worker y resultado cacheado de las comprobaciones de /readyz."""
+
+    def __init__(self):
+        self.phase = STARTING
+        self.warmup: Dict[str, Dict[str, Any]] = {}
+        self._checked_at = 0.0
+        self._checks: Dict[str, Dict[str, Any]] = {}
+        self._lock: Optional[asyncio.Lock] = None
+
+    def mark_ready(self) -> None:
+        if self.phase == STARTING: # Un apagado durante el calentamiento no vuelve a 'ready'
+            self.phase = READY
+
+    def mark_draining(self) -> None:
+        self.phase = DRAINING
+
+    async def checks(self) -> Dict[str, Dict[str, Any]]:
+        """Comprobaciones de dependencias, reutilizadas durante READINESS_CACHE_SECONDS."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock: # Las sondas concurrentes comparten una sola comprobación
+            if time.monotonic() - self._checked_at >= settings.READINESS_CACHE_SECONDS:
+                self._checks = {
+                    "database": await _check(_ping_database, required=True),
+                    "cache": await _check(_ping_cache, required=False),
+                }
+                self._checked_at = time.monotonic()
+            return self._checks
+
+    async def status(self) -> Tuple[bool, Dict[str, Any]]:
+        checks = await self.checks()
+        dependencies_ok = all(check["ok"] or not check["required"] for check in checks.values())
+        ready = self.phase == READY and dependencies_ok
+        status = self.phase if self.phase != READY else (READY if dependencies_ok else "unavailable")
+        return ready, {"status": status, "checks": checks}
+
+
+readiness = Readiness()
+
+# --- Comprobaciones ---
+
+def _ping_database() -> None:
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+def _ping_cache() -> None:
+    cache.backend.get("health", "ping") # Sin pasar por CacheNamespace, que oculta los errores
+
+async def _check(probe: Callable[[], None], required: bool) -> Dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(asyncio.to_thread(probe), timeout=settings.READINESS_TIMEOUT_SECONDS)
+        result: Dict[str, Any] = {"ok": True}
+    except Exception as e:
+        result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    result["required"] = required
+    result["ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+# --- Calentamiento ---
+
+def _open_db_pool() -> int:
+    """Abre a la vez varias conexiones del pool y las devuelve (quedan abiertas para reutilizarse)."""
+    size = engine.pool.size() if hasattr(engine.pool, "size") else 1
+    count = max(1, min(settings.WARMUP_DB_CONNECTIONS, size))
+    connections = []
+    try:
+        for _ in range(count):
+            connection = engine.connect()
+            connections.append(connection)
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            connection.close()
+    return count
+
+def _init_plaid_client() -> bool:
+    from ..routers.plaid import get_plaid_client # Import diferido: el router importa servicios
+    return get_plaid_client() is not None
+
+def _load_categorizer() -> int:
+    # Una predicción recorre la matriz completa: trae a memoria las páginas del memory-map
+    knn_categorizer.predict(["warmup"])
+    return knn_categorizer.size
+
+def _load_caches() -> int:
+    _ping_cache()
+    # Listado de fondos por defecto (la consulta más habitual), ya serializado
+    fund_catalog.query_json((), "esgScore", True, 1, 20)
+    return len(fund_catalog.funds)
+
+async def _step(name: str, fn: Callable[[], Any]) -> None:
+    started = time.perf_counter()
+    try:
+        result = await asyncio.to_thread(fn)
+        readiness.warmup[name] = {"ok": True, "result": result}
+    except Exception as e:
+        print(f"ADVERTENCIA: Calentamiento '{name}' falló: {e}")
+        readiness.warmup[name] = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    readiness.warmup[name]["ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+async def warmup() -> Dict[str, Dict[str, Any]]:
+    """
+    Calienta el worker. Nunca impide el arranque: un paso que falla se registra y
+    /readyz refleja el estado real de las dependencias.
+    """
+    started = time.perf_counter()
+    await asyncio.gather(
+        _step("database_pool", _open_db_pool),
+        _step("plaid_client", _init_plaid_client),
+        _step("categorizer", _load_categorizer),
+        _step("caches", _load_caches),
+    )
+    get_http_client() # Se crea en el loop del worker (el pool de httpx queda ligado a él)
+    readiness.warmup["http_client"] = {"ok": True, "ms": 0.0}
+    print(f"DEBUG: Worker calentado en {(time.perf_counter() - started) * 1000:.0f} ms: "
+          + ", ".join(f"{name}={'ok' if step['ok'] else 'error'}" for name, step in readiness.warmup.items()))
+    return readiness.warmup
+
+def start_warmup(enabled: bool) -> "asyncio.Task[None]":
+    """
+    Prepara el worker y lanza el calentamiento en segundo plano; al terminar, el worker pasa
+    a 'ready'. Se llama desde el lifespan, que no debe esperarla (ver arriba).
+    """
+    # Con preload, el proceso maestro pudo abrir conexiones antes del fork: no se comparten.
+    # Antes de aceptar peticiones, para que ninguna use una conexión heredada.
+    engine.dispose(close=False)
+
+    async def run() -> None:
+        try:
+            if enabled:
+                await warmup()
+        except Exception as e:
+            print(f"ERROR: Calentamiento del worker interrumpido: {e}")
+        readiness.mark_ready()
+
+    return asyncio.ensure_future(run())
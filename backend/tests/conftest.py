@@ -0,0 +1,5 @@
+import os
+
+# La URL por defecto de config.py es un placeholder que SQLAlchemy no puede ni parsear; los tests
+# que usan la base de datos crean su propio motor SQLite
+os.environ.setdefault("DATABASE_URL", "sqlite://")
@@ -0,0 +1,130 @@
+import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.database import Base
+from app.models.budget import AlertOutbox, Budget, BudgetAlertRule, BudgetPeriodTotal
+from app.models.insight import CategoryStats
+from app.models.transaction import TransactionCategory
+from app.models.user import User
+from app.schemas.plaid import PlaidTransaction
+from app.services import budget_service
+from app.services.fx_service import FxRates
+from app.services.insight_service import apply_transactions
+from app.services.transaction_store import ingest_transactions
+
+TODAY = datetime.date.today()
+THIS_MONTH = TODAY.replace(day=1)
+LAST_MONTH = (THIS_MONTH - datetime.timedelta(days=1)).replace(day=1)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'budgets.sqlite3'}")
+    Base.metadata.create_all(engine)
+    rates_path = tmp_path / "fx_rates.csv"
+    rates_path.write_text("date,currency,rate\n2020-01-01,EUR,0.5\n", encoding="utf-8") # 1 USD = 0.5 EUR
+    rates = FxRates(str(rates_path), "USD")
+    rates.load()
+    monkeypatch.setattr(budget_service, "fx_rates", rates)
+
+    session = sessionmaker(bind=engine, autoflush=False)()
+    session.add(User(id=1, email="budget@example.com", hashed_password="x"))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _budget(db, category="Food and Drink", amount=100.0, period="month", currency="USD", thresholds=(0.5, 1.0)):
+    budget = Budget(user_id=1, category=category, period=period, amount=amount, currency=currency,
+                    rules=[BudgetAlertRule(threshold=threshold) for threshold in thresholds])
+    db.add(budget)
+    db.commit()
+    return budget
+
+
+def _total(db, budget, period_start):
+    row = db.get(BudgetPeriodTotal, (budget.id, period_start))
+    return row.total if row else 0.0
+
+
+def _alerts(db, budget):
+    return sorted(alert.threshold for alert in db.query(AlertOutbox).filter(AlertOutbox.budget_id == budget.id))
+
+
+def _evaluate(db, *amounts, currency="USD", day=TODAY, category="Food and Drink"):
+    fired = budget_service.evaluate_transactions(db, 1, [(day, category, amount, currency) for amount in amounts])
+    db.commit()
+    return fired
+
+
+def test_threshold_fires_when_the_total_crosses_it(db):
+    budget = _budget(db)
+
+    assert _evaluate(db, 30.0) == 0
+    assert _evaluate(db, 25.0) == 1 # 55 >= 50
+    assert _alerts(db, budget) == [0.5]
+    assert _evaluate(db, 50.0) == 1 # 105 >= 100
+    assert _alerts(db, budget) == [0.5, 1.0]
+    assert _total(db, budget, THIS_MONTH) == pytest.approx(105.0)
+
+
+def test_threshold_is_written_once_per_period(db):
+    budget = _budget(db)
+    _evaluate(db, 60.0)
+    budget_service.subtract_transactions(db, 1, [(TODAY, "Food and Drink", 60.0, "USD")])
+    db.commit()
+    _evaluate(db, 60.0) # Vuelve a cruzar el 50% en el mismo periodo
+
+    assert _alerts(db, budget) == [0.5]
+    # Los periodos ya cerrados actualizan su total pero no avisan
+    assert _evaluate(db, 500.0, day=LAST_MONTH) == 0
+    assert _total(db, budget, LAST_MONTH) == pytest.approx(500.0)
+
+
+def test_amounts_are_converted_to_each_budget_currency(db):
+    in_usd = _budget(db, period="month", currency="USD")
+    in_eur = _budget(db, period="week", currency="EUR")
+
+    _evaluate(db, 10.0, currency="EUR")
+    _evaluate(db, 10.0, currency="USD")
+    _evaluate(db, 10.0, currency=None) # Sin divisa: BASE_CURRENCY (USD)
+
+    week = budget_service.current_period_start("week")
+    assert _total(db, in_usd, THIS_MONTH) == pytest.approx(20.0 + 10.0 + 10.0)
+    assert _total(db, in_eur, week) == pytest.approx(10.0 + 5.0 + 5.0)
+
+
+def _plaid(amount, day=TODAY, transaction_id="t1"):
+    return PlaidTransaction(transaction_id=transaction_id, account_id="a1", date=day, name="Starbucks #12",
+                            amount=amount, iso_currency_code="USD", pending=False)
+
+
+def _sync(db, transactions, removed=()):
+    ingest_transactions(db, 1, transactions, removed)
+    db.commit()
+    return apply_transactions(db, 1, [t.transaction_id for t in transactions])
+
+
+def test_changed_and_removed_transactions_are_subtracted(db):
+    budget = _budget(db)
+    db.add(TransactionCategory(transaction_id="t1", user_id=1, name="Starbucks #12", category="Food and Drink"))
+    db.commit()
+
+    assert _sync(db, [_plaid(40.0)]) == 1
+    assert _sync(db, [_plaid(40.0)]) == 0 # Sin cambios: no se vuelve a sumar
+    assert _sync(db, [_plaid(25.0)]) == 1 # Nuevo importe: se resta el anterior y se suma el nuevo
+    assert _total(db, budget, THIS_MONTH) == pytest.approx(25.0)
+
+    assert _sync(db, [_plaid(25.0, day=LAST_MONTH)]) == 1 # Cambio de fecha: pasa al otro periodo
+    assert _total(db, budget, THIS_MONTH) == pytest.approx(0.0)
+    assert _total(db, budget, LAST_MONTH) == pytest.approx(25.0)
+
+    _sync(db, [], removed=["t1"])
+    assert _total(db, budget, LAST_MONTH) == pytest.approx(0.0)
+    stats = db.get(CategoryStats, (1, "Food and Drink"))
+    db.refresh(stats)
+    assert (stats.count, stats.mean) == (0, 0.0)
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from app.core.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from app.core.rate_limit import RateLimitExceeded
+from app.services import ia_service
+
+
+def _half_open_breaker() -> CircuitBreaker:
+    """Breaker que se abre con un fallo y pasa a HALF_OPEN de inmediato (una sonda)."""
+    breaker = CircuitBreaker(
+        "test",
+        failure_rate_threshold=0.5,
+        slow_call_seconds=10.0,
+        slow_call_rate_threshold=1.0,
+        window_size=4,
+        min_calls=1,
+        open_seconds=0.0,
+        half_open_max_calls=1,
+    )
+    breaker.record_failure()
+    assert breaker.state == HALF_OPEN
+    return breaker
+
+
+class _SaturatedLimiter:
+    async def acquire(self) -> None:
+        raise RateLimitExceeded("huggingface", 5.0)
+
+
+class _FreeLimiter:
+    async def acquire(self) -> None:
+        return None
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = _half_open_breaker()
+    monkeypatch.setattr(ia_service, "hf_breaker", breaker)
+    monkeypatch.setattr(ia_service, "category_cache", None)
+    monkeypatch.setattr(ia_service.settings, "HUGGINGFACE_API_KEY", "test-key")
+    return breaker
+
+
+def test_release_probe_frees_half_open_slot():
+    breaker = _half_open_breaker()
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.release_probe()
+    assert breaker.allow_request()
+
+
+def test_rate_limited_call_does_not_hold_probe(breaker, monkeypatch):
+    monkeypatch.setattr(ia_service, "huggingface_limiter", _SaturatedLimiter())
+
+    result = asyncio.run(ia_service.categorize_with_source("STARBUCKS 123"))
+
+    assert result == (ia_service.UNCATEGORIZED_CATEGORY, ia_service.SOURCE_THROTTLED)
+    assert breaker._half_open_in_flight == 0
+    assert [breaker.allow_request() for _ in range(3)] == [True, False, False]
+
+
+def test_non_retryable_error_releases_probe(breaker, monkeypatch):
+    async def rejected(headers, payload):
+        raise ia_service._NonRetryableError("401")
+
+    monkeypatch.setattr(ia_service, "huggingface_limiter", _FreeLimiter())
+    monkeypatch.setattr(ia_service, "_hedged_inference", rejected)
+
+    assert asyncio.run(ia_service.categorize_with_source("STARBUCKS 123")) == ("Other", ia_service.SOURCE_NONE)
+    assert breaker._half_open_in_flight == 0
+    assert breaker.allow_request()
+
+
+def test_cancelled_call_releases_probe(breaker, monkeypatch):
+    started = asyncio.Event()
+
+    async def hanging(headers, payload):
+        started.set()
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(ia_service, "huggingface_limiter", _FreeLimiter())
+    monkeypatch.setattr(ia_service, "_hedged_inference", hanging)
+
+    async def scenario():
+        task = asyncio.create_task(ia_service.categorize_with_source("STARBUCKS 123"))
+        await started.wait()
+        assert breaker._half_open_in_flight == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert breaker.state == HALF_OPEN
+    assert breaker._half_open_in_flight == 0
+    assert breaker.allow_request()
+
+
+def test_successful_probe_closes_breaker(breaker, monkeypatch):
+    async def answered(headers, payload):
+        return {"labels": ["Food and Drink"], "scores": [0.9]}
+
+    monkeypatch.setattr(ia_service, "huggingface_limiter", _FreeLimiter())
+    monkeypatch.setattr(ia_service, "_hedged_inference", answered)
+
+    assert asyncio.run(ia_service.categorize_with_source("STARBUCKS 123")) == ("Food and Drink", ia_service.SOURCE_MODEL)
+    assert breaker.state == CLOSED
+
+
+def test_open_breaker_skips_limiter(monkeypatch):
+    breaker = _half_open_breaker()
+    breaker.open_seconds = 3600.0
+    breaker.record_failure() # La sonda falla: vuelve a OPEN
+    assert breaker.state == OPEN
+    monkeypatch.setattr(ia_service, "hf_breaker", breaker)
+    monkeypatch.setattr(ia_service, "category_cache", None)
+    monkeypatch.setattr(ia_service.settings, "HUGGINGFACE_API_KEY", "test-key")
+    monkeypatch.setattr(ia_service, "huggingface_limiter", _SaturatedLimiter())
+
+    category, source = asyncio.run(ia_service.categorize_with_source("STARBUCKS 123"))
+
+    assert source == ia_service.SOURCE_LOCAL
@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+
+from app.services.ia_service import NearestNeighbourCategorizer
+
+
+def _categorizer(index_dir, max_segments=16):
+    return NearestNeighbourCategorizer(str(index_dir), dim=256, k=3, threshold=0.5, rebuild_every=1, max_segments=max_segments)
+
+
+def _manifest(index_dir):
+    with open(os.path.join(str(index_dir), "index.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_rebuild_appends_a_segment_without_rewriting_existing_ones(tmp_path):
+    knn = _categorizer(tmp_path)
+    knn.learn(["Starbucks"], ["Food and Drink"])
+    knn.rebuild()
+    first = _manifest(tmp_path)["segments"][0]
+    first_mtime = os.path.getmtime(tmp_path / (first + "vectors.npy"))
+
+    knn.learn(["Shell Oil"], ["Travel"])
+    knn.rebuild()
+
+    manifest = _manifest(tmp_path)
+    assert manifest["segments"][0] == first and len(manifest["segments"]) == 2
+    assert os.path.getmtime(tmp_path / (first + "vectors.npy")) == first_mtime
+    assert knn.predict(["starbucks"])[0][0] == "Food and Drink"
+    assert knn.predict(["shell oil"])[0][0] == "Travel"
+
+
+def test_newer_segment_overrides_label_and_survives_compaction(tmp_path):
+    knn = _categorizer(tmp_path, max_segments=2)
+    for category in ("Food and Drink", "Shopping"):
+        knn.learn(["Target"], [category])
+        knn.rebuild()
+    assert knn.predict(["target"])[0][0] == "Shopping"
+
+    knn.learn(["Uber"], ["Travel"])
+    knn.rebuild() # Tercer segmento: supera max_segments y compacta
+
+    assert len(_manifest(tmp_path)["segments"]) == 1
+    reloaded = _categorizer(tmp_path, max_segments=2)
+    reloaded.load()
+    assert reloaded.size == 2
+    assert reloaded.predict(["target"])[0][0] == "Shopping"
+    assert reloaded.predict(["uber"])[0][0] == "Travel"
+
+
+def test_rebuild_picks_up_segments_written_by_another_worker(tmp_path):
+    worker_a, worker_b = _categorizer(tmp_path), _categorizer(tmp_path)
+    worker_a.learn(["Netflix"], ["Entertainment"])
+    worker_a.rebuild()
+    worker_b.learn(["Walgreens"], ["Health & Wellness"])
+    worker_b.rebuild()
+
+    assert worker_b.size == 2
+    assert worker_b.predict(["netflix"])[0][0] == "Entertainment"
+
+
+def test_learn_does_not_wait_for_the_file_lock(tmp_path):
+    knn = _categorizer(tmp_path)
+    knn.learn(["Starbucks"], ["Food and Drink"])
+    entered, release = threading.Event(), threading.Event()
+    knn._atomic_write = _blocking(knn._atomic_write, entered, release)
+
+    rebuild = threading.Thread(target=knn.rebuild)
+    rebuild.start()
+    assert entered.wait(5)
+    try:
+        # rebuild() está escribiendo: learn() y predict() siguen respondiendo
+        knn.learn(["Shell Oil"], ["Travel"])
+        assert knn.predict(["shell oil"])[0][0] == "Travel"
+    finally:
+        release.set()
+        rebuild.join(5)
+
+    assert knn.predict(["starbucks"])[0][0] == "Food and Drink"
+    assert list(knn._pending) == ["shell oil"] # Sólo se retiran del buffer las etiquetas escritas
+
+
+def _blocking(write, entered, release):
+    def wrapper(filename, writer):
+        entered.set()
+        release.wait(5)
+        return write(filename, writer)
+    return wrapper
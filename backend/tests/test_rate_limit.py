@@ -0,0 +1,35 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from app.core.rate_limit import RateLimitExceeded, SQLiteBucketStore, TokenBucket
+
+
+def test_sqlite_store_grants_and_rejects(tmp_path):
+    store = SQLiteBucketStore(str(tmp_path / "buckets.sqlite3"))
+    bucket = TokenBucket("test", rate=0.001, burst=1.0, max_wait=0.0, store=store)
+
+    asyncio.run(bucket.acquire())
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(bucket.acquire())
+    assert (bucket.granted, bucket.rejected) == (1, 1)
+
+
+def test_locked_sqlite_store_is_reported_as_rate_limited(tmp_path):
+    path = str(tmp_path / "buckets.sqlite3")
+    store = SQLiteBucketStore(path)
+    bucket = TokenBucket("test", rate=10.0, burst=5.0, max_wait=0.0, store=store)
+    asyncio.run(bucket.acquire()) # Crea la tabla
+
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute("BEGIN IMMEDIATE") # Otro proceso retiene el archivo
+    try:
+        with pytest.raises(RateLimitExceeded):
+            asyncio.run(bucket.acquire())
+        assert asyncio.run(bucket.try_acquire()) is False
+    finally:
+        holder.execute("ROLLBACK")
+        holder.close()
+
+    asyncio.run(bucket.acquire()) # La conexión sigue utilizable tras el rechazo
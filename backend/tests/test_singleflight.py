@@ -0,0 +1,146 @@
+import asyncio
+
+from app.core.singleflight import SingleFlight
+
+
+class _SlowNamespace:
+    """Espacio de nombres mínimo cuya escritura tarda (como un backend compartido en un hilo)."""
+
+    def __init__(self, write_seconds: float = 0.0):
+        self.write_seconds = write_seconds
+        self.values = {}
+
+    async def aget(self, key, default=None):
+        return self.values.get(key, default)
+
+    async def aset(self, key, value, ttl_seconds=None):
+        await asyncio.sleep(self.write_seconds)
+        self.values[key] = value
+
+    async def adelete(self, key):
+        self.values.pop(key, None)
+
+
+def test_waiters_get_result_when_leader_is_cancelled_during_cache_write():
+    async def scenario():
+        flight = SingleFlight("test", namespace=_SlowNamespace(write_seconds=10.0))
+        started = asyncio.Event()
+
+        async def load():
+            started.set()
+            await asyncio.sleep(0.01)
+            return "value"
+
+        leader = asyncio.create_task(flight.do("k", load))
+        await started.wait()
+        waiter = asyncio.create_task(flight.do("k", load))
+        await asyncio.sleep(0.05) # El líder ya está escribiendo en la caché
+        leader.cancel()
+        return await asyncio.wait_for(waiter, 1.0)
+
+    assert asyncio.run(scenario()) == "value"
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flight = SingleFlight("test")
+        calls = 0
+
+        async def load():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.02)
+            return calls
+
+        results = await asyncio.gather(*(flight.do("k", load) for _ in range(5)))
+        return results, calls, flight.stats()
+
+    results, calls, stats = asyncio.run(scenario())
+    assert results == [1] * 5
+    assert calls == 1
+    assert stats == {"leaders": 1, "shared": 4, "in_flight": 0}
+
+
+def test_exception_is_shared_with_waiters():
+    async def scenario():
+        flight = SingleFlight("test")
+
+        async def load():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        return await asyncio.gather(*(flight.do("k", load) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_waiter_takes_over_when_leader_is_cancelled():
+    async def scenario():
+        flight = SingleFlight("test")
+        calls = 0
+
+        async def load():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return "value"
+
+        leader = asyncio.create_task(flight.do("k", load))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(flight.do("k", load))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        result = await asyncio.wait_for(waiter, 1.0)
+        return result, calls, leader.cancelled()
+
+    result, calls, leader_cancelled = asyncio.run(scenario())
+    assert result == "value"
+    assert calls == 2 # El que esperaba repite la carga como nuevo líder
+    assert leader_cancelled
+
+
+def test_cancelled_waiter_does_not_cancel_leader():
+    async def scenario():
+        flight = SingleFlight("test")
+
+        async def load():
+            await asyncio.sleep(0.05)
+            return "value"
+
+        leader = asyncio.create_task(flight.do("k", load))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(flight.do("k", load))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        return await leader, waiter.cancelled()
+
+    assert asyncio.run(scenario()) == ("value", True)
+
+
+def test_cache_if_controls_what_is_reused():
+    async def scenario():
+        namespace = _SlowNamespace()
+        flight = SingleFlight("test", namespace=namespace)
+        calls = 0
+
+        async def load():
+            nonlocal calls
+            calls += 1
+            return {"complete": calls > 1}
+
+        def complete(value):
+            return value["complete"]
+
+        first = await flight.do("k", load, cache_if=complete) # Parcial: no se cachea
+        second = await flight.do("k", load, cache_if=complete)
+        third = await flight.do("k", load, cache_if=complete) # Servido desde la caché
+        await flight.forget("k")
+        fourth = await flight.do("k", load, cache_if=complete)
+        return first, second, third, fourth, calls
+
+    first, second, third, fourth, calls = asyncio.run(scenario())
+    assert first == {"complete": False}
+    assert second == third == {"complete": True}
+    assert fourth == {"complete": True}
+    assert calls == 3